@@ -1,12 +1,29 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import (Flask, render_template, request, jsonify, session, redirect, url_for, Response,
+                   stream_with_context, g, send_file, abort)
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_cors import CORS
 from config import Config
-from utils.ai_service import AIService
-from utils.voice_service import VoiceService
-from utils.db_service import DatabaseService
-from utils.supabase_service import SupabaseService
+from utils.voice_service import VoiceService, VoiceRelay, EchoRecognizer, XfyunRecognizer
+from utils.job_queue import JobQueue
+from utils.user_cache import UserCache
+from utils.rate_limiter import TokenBucketLimiter
+from utils.password_service import HasherBusyError
+from utils.plan_patch import make_day_patch
+from utils.budget_analysis import analyze_locally
+from utils.plan_search import parse_filters
+from utils.plan_export import (ExportFormatError, iter_records, encode_records, file_extension,
+                               export_to_file, import_from_file)
+from utils.metrics import REGISTRY, HTTP_REQUEST_SECONDS, InstrumentedService, cache_samples
+from utils.profiler import SlowRequestProfiler
+from utils.lazy_service import LazyService
+from utils.assets import AssetManifest, build_assets, choose_encoding, DIST_DIR
+import click
+import gzip
 import json
+import mimetypes
+import os
+import threading
+import time
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -17,16 +34,209 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
-# 根据配置选择数据库服务
-if Config.USE_SUPABASE:
-    print("使用 Supabase 云端数据库")
-    db_service = SupabaseService()
-else:
-    print("使用本地 SQLite 数据库")
-    db_service = DatabaseService()
+def create_db_service():
+    """根据配置选择数据库服务；Supabase 和 DashScope 的 SDK 导入较慢，只在用到时导入"""
+    if Config.STORAGE_MODE == 'hybrid':
+        from utils.sync_service import HybridDatabaseService
+        print("使用本地 SQLite 数据库，后台同步到 Supabase")
+        service = HybridDatabaseService()
+    elif Config.STORAGE_MODE == 'supabase' and Config.SUPABASE_ASYNC:
+        from utils.async_supabase_service import AsyncSupabaseService, BlockingServiceAdapter
+        print("使用 Supabase 云端数据库（异步客户端）")
+        service = BlockingServiceAdapter(AsyncSupabaseService())
+    elif Config.STORAGE_MODE == 'supabase':
+        from utils.supabase_service import SupabaseService
+        print("使用 Supabase 云端数据库")
+        service = SupabaseService()
+    else:
+        from utils.db_service import DatabaseService
+        print("使用本地 SQLite 数据库")
+        service = DatabaseService()
+    
+    if Config.METRICS_ENABLED:
+        # 记录每个数据库方法的耗时；同步线程只用到 connection 和 plan_cache，不计入
+        service = InstrumentedService(service, Config.STORAGE_MODE)
+    return service
+
+def create_ai_service():
+    from utils.ai_service import AIService
+    return AIService()
+
+def geocoder_kind():
+    return Config.GEOCODER or ('amap' if Config.AMAP_WEB_KEY else 'none')
+
+def create_geocoding_service():
+    from utils.geocoding import AmapGeocoder, FixtureGeocoder, GeocodeCache, GeocodingService
+    if geocoder_kind() == 'fixture':
+        geocoder = FixtureGeocoder(Config.GEOCODE_FIXTURE_PATH or None, synthesize=Config.GEOCODE_FIXTURE_SYNTHESIZE)
+    else:
+        geocoder = AmapGeocoder(Config.AMAP_WEB_KEY, timeout=Config.GEOCODE_TIMEOUT)
+    cache = GeocodeCache(Config.GEOCODE_CACHE_PATH or Config.DATABASE_PATH,
+                         ttl=Config.GEOCODE_CACHE_TTL, miss_ttl=Config.GEOCODE_MISS_TTL)
+    return GeocodingService(geocoder, cache)
+
+# 服务在首次使用时创建：导入本模块不会连接数据库或启动线程，可以在 fork 前预加载
+db_service = LazyService(create_db_service)
+ai_service = LazyService(create_ai_service)
+voice_service = LazyService(VoiceService)
+voice_relay = LazyService(lambda: VoiceRelay(
+    EchoRecognizer() if Config.VOICE_RECOGNIZER == 'echo' else XfyunRecognizer(voice_service),
+    max_sessions=Config.VOICE_MAX_SESSIONS,
+    queue_size=Config.VOICE_QUEUE_CHUNKS,
+    idle_timeout=Config.VOICE_IDLE_TIMEOUT
+))
+plan_jobs = LazyService(lambda: JobQueue(
+    max_workers=Config.AI_MAX_WORKERS,
+    max_pending=Config.AI_MAX_PENDING_JOBS,
+    ttl=Config.AI_JOB_TTL,
+    shared_path=Config.AI_JOB_SHARED_PATH or None
+))
+geo_service = LazyService(create_geocoding_service)
+user_cache = LazyService(lambda: UserCache(
+    maxsize=Config.USER_CACHE_SIZE,
+    ttl=Config.USER_CACHE_TTL,
+    shared_path=Config.USER_CACHE_SHARED_PATH or None,
+    shared_ttl=Config.USER_CACHE_SHARED_TTL
+))
+# 登录限流：按 IP 和用户名分别计数，防止暴力破解占满密码哈希计算池
+ip_limiter = TokenBucketLimiter(Config.LOGIN_RATE_IP_BURST, Config.LOGIN_RATE_IP_PER_MINUTE / 60)
+username_limiter = TokenBucketLimiter(Config.LOGIN_RATE_USER_BURST, Config.LOGIN_RATE_USER_PER_MINUTE / 60)
+
+def rate_limited(retry_after):
+    response = jsonify({'success': False, 'message': '尝试次数过多，请稍后再试'})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(int(retry_after) + 1)
+    return response
+
+# 后台线程不能跨 fork 存活，按进程启动：记录已启动的进程号
+sync_worker = None
+profiler = None
+_background_pid = None
+_background_lock = threading.Lock()
+
+def start_background_workers():
+    """在当前进程中启动同步线程和慢请求采样线程，每个进程只启动一次"""
+    global sync_worker, profiler, _background_pid
+    if _background_pid == os.getpid():
+        return
+    with _background_lock:
+        if _background_pid == os.getpid():
+            return
+        sync_worker = None
+        profiler = None
+        if Config.STORAGE_MODE == 'hybrid':
+            from utils.sync_service import SupabaseSyncWorker
+            from utils.supabase_service import SupabaseService
+            # 多个进程的同步线程通过租约认领变更，不会重复推送；
+            # 与请求共用 db_service，从云端拉取计划后失效的是路由实际读取的 plan_cache
+            sync_worker = SupabaseSyncWorker(
+                db_service, SupabaseService(),
+                batch_size=Config.SYNC_BATCH_SIZE,
+                interval=Config.SYNC_INTERVAL,
+                max_attempts=Config.SYNC_MAX_ATTEMPTS
+            )
+            sync_worker.start()
+        if Config.PROFILE_SLOW_REQUEST_MS > 0:
+            profiler = SlowRequestProfiler(Config.PROFILE_DIR, Config.PROFILE_SLOW_REQUEST_MS,
+                                           Config.PROFILE_INTERVAL_MS, Config.PROFILE_MAX_FILES)
+            profiler.start()
+        _background_pid = os.getpid()
+
+def init_storage():
+    """创建或迁移本地数据库表；部署时只需执行一次，而不是每个 worker 进程各执行一次
+
+    Supabase 的表结构通过 supabase_setup.sql 在控制台中创建，这里不做处理。
+    """
+    if Config.STORAGE_MODE in ('sqlite', 'hybrid'):
+        db_service.init_db()
+        print("数据库表已初始化")
+
+def preload_modules():
+    """预先导入较慢的 SDK，供多进程部署在 fork 前调用，子进程通过写时复制共享"""
+    import utils.ai_service  # noqa: F401
+    if Config.STORAGE_MODE != 'sqlite':
+        import utils.supabase_service  # noqa: F401
+        import utils.async_supabase_service  # noqa: F401
+
+def create_app():
+    """生产环境入口（见 wsgi.py）：返回已注册全部路由的应用，服务在首次请求时才创建"""
+    return app
+
+@app.before_request
+def start_request_timer():
+    start_background_workers()
+    g.request_start = time.perf_counter()
+    if profiler:
+        profiler.begin()
 
-ai_service = AIService()
-voice_service = VoiceService()
+@app.after_request
+def record_request_metrics(response):
+    # 流式响应在这里只是开始输出，耗时不包含后续推送
+    start = g.pop('request_start', None)
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    # 使用路由模板而不是实际路径，避免计划 ID 等参数造成标签爆炸
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    if Config.METRICS_ENABLED:
+        HTTP_REQUEST_SECONDS.observe(elapsed, route=route, method=request.method, status=response.status_code)
+    if profiler:
+        path = profiler.end(f'{request.method}_{route}', elapsed)
+        if path:
+            print(f"慢请求 {request.method} {request.path} 耗时 {elapsed * 1000:.0f}ms，采样已保存到 {path}")
+    return response
+
+@app.after_request
+def compress_response(response):
+    """压缩较大的 JSON 响应（如计划详情），流式响应和已压缩的响应不处理"""
+    if (not Config.COMPRESS_JSON or response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code >= 300
+            or response.mimetype != 'application/json' or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.headers.get('Accept-Encoding', '')):
+        return response
+    data = response.get_data()
+    if len(data) < Config.COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=Config.COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    # 同一个 ETag 对应不同编码的内容，改为弱 ETag
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+asset_manifest = AssetManifest(app.static_folder)
+
+@app.template_global()
+def asset_url(filename):
+    """模板中引用静态资源：有构建结果时返回带内容哈希的文件地址"""
+    return url_for('static', filename=asset_manifest.resolve(filename))
+
+@app.route(f'/static/{DIST_DIR}/<path:filename>')
+def dist_asset(filename):
+    """带哈希的构建结果：内容不变文件名就不变，可以永久缓存；按 Accept-Encoding 返回预压缩版本"""
+    base_dir = os.path.join(app.static_folder, DIST_DIR)
+    path = os.path.realpath(os.path.join(base_dir, filename))
+    if not path.startswith(os.path.realpath(base_dir) + os.sep) or not os.path.isfile(path):
+        abort(404)
+    body_path, encoding = choose_encoding(request.headers.get('Accept-Encoding'), path)
+    response = send_file(body_path, mimetype=mimetypes.guess_type(path)[0], conditional=True, etag=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = f'public, max-age={Config.ASSET_MAX_AGE}, immutable'
+    return response
+
+def build_static_assets():
+    """压缩并按内容哈希重命名静态资源；部署时执行一次"""
+    return build_assets(app.static_folder)
+
+def hasher_busy():
+    response = jsonify({'success': False, 'message': '服务繁忙，请稍后再试'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
 
 class User(UserMixin):
     def __init__(self, user_id, username, email):
@@ -36,7 +246,8 @@ class User(UserMixin):
 
 @login_manager.user_loader
 def load_user(user_id):
-    user_data = db_service.get_user_by_id(user_id)
+    # 每个登录请求都会调用，先查缓存，避免每次都访问数据库
+    user_data = user_cache.get_or_load(user_id, db_service.get_user_by_id)
     if user_data:
         return User(user_data['id'], user_data['username'], user_data['email'])
     return None
@@ -52,8 +263,17 @@ def login():
         username = data.get('username')
         password = data.get('password')
         
-        user_data = db_service.authenticate_user(username, password)
+        for limiter, key in ((ip_limiter, request.remote_addr), (username_limiter, username)):
+            allowed, retry_after = limiter.allow(key)
+            if not allowed:
+                return rate_limited(retry_after)
+        
+        try:
+            user_data = db_service.authenticate_user(username, password)
+        except HasherBusyError:
+            return hasher_busy()
         if user_data:
+            username_limiter.reset(username)
             user = User(user_data['id'], user_data['username'], user_data['email'])
             login_user(user)
             return jsonify({'success': True, 'message': '登录成功'})
@@ -68,12 +288,19 @@ def register():
     email = data.get('email')
     password = data.get('password')
     
-    success, message = db_service.create_user(username, email, password)
+    allowed, retry_after = ip_limiter.allow(request.remote_addr)
+    if not allowed:
+        return rate_limited(retry_after)
+    try:
+        success, message = db_service.create_user(username, email, password)
+    except HasherBusyError:
+        return hasher_busy()
     return jsonify({'success': success, 'message': message})
 
 @app.route('/logout')
 @login_required
 def logout():
+    user_cache.invalidate(current_user.id)
     logout_user()
     return redirect(url_for('index'))
 
@@ -82,38 +309,201 @@ def logout():
 def planner():
     return render_template('planner.html', username=current_user.username)
 
+def add_coordinates(plan_data=None, day=None, city='', cache_only=False):
+    """为计划（或单日行程）中的地点写入坐标；地理编码失败不影响保存"""
+    if geocoder_kind() == 'none':
+        return
+    try:
+        if day is not None:
+            geo_service.annotate_day(day, city, cache_only=cache_only)
+        else:
+            geo_service.annotate_plan(plan_data, cache_only=cache_only)
+    except Exception as e:
+        print(f"地理编码错误: {e}")
+
+def generate_and_save_plan(user_id, user_input):
+    """后台任务：生成旅行计划并保存"""
+    plan = ai_service.generate_travel_plan(user_input)
+    add_coordinates(plan)
+    plan_id = db_service.save_travel_plan(user_id, plan)
+    return {'plan': plan, 'plan_id': plan_id, 'cost_summary': saved_cost_summary(plan_id, user_id)}
+
+def saved_cost_summary(plan_id, user_id):
+    """读回保存时计算的费用摘要（同时预热计划详情缓存）"""
+    saved = db_service.get_plan_by_id(plan_id, user_id) if plan_id else None
+    return saved.get('cost_summary') if saved else None
+
 @app.route('/api/generate-plan', methods=['POST'])
 @login_required
 def generate_plan():
     data = request.get_json()
     user_input = data.get('input', '')
     
-    # 使用 AI 生成旅行计划
-    plan = ai_service.generate_travel_plan(user_input)
+    # 交给后台任务生成，立即返回任务 ID
+    job_id = plan_jobs.submit(current_user.id, generate_and_save_plan, current_user.id, user_input)
+    if not job_id:
+        return jsonify({'success': False, 'message': '当前生成任务过多，请稍后重试'}), 503
     
-    # 保存计划到数据库
-    plan_id = db_service.save_travel_plan(current_user.id, plan)
+    return jsonify({'success': True, 'job_id': job_id, 'status': 'pending'}), 202
+
+def sse_event(event, data):
+    """格式化一条 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/generate-plan/stream', methods=['GET'])
+@login_required
+def stream_plan():
+    """以 SSE 流式返回计划：每完成一天行程或一条住宿就推送一次，结束时保存完整计划"""
+    user_input = request.args.get('input', '')
+    user_id = current_user.id
     
-    return jsonify({
-        'success': True,
-        'plan': plan,
-        'plan_id': plan_id
-    })
+    def event_stream():
+        for event in ai_service.stream_travel_plan(user_input):
+            if event['type'] == 'plan':
+                plan = event['data']
+                add_coordinates(plan)
+                plan_id = db_service.save_travel_plan(user_id, plan)
+                yield sse_event('done', {'plan': plan, 'plan_id': plan_id,
+                                         'cost_summary': saved_cost_summary(plan_id, user_id)})
+            else:
+                yield sse_event(event['type'], event)
+    
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/generate-plan/<job_id>', methods=['GET'])
+@login_required
+def get_generate_status(job_id):
+    """查询计划生成任务状态"""
+    job = plan_jobs.get(job_id, current_user.id)
+    if not job:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    
+    response = {'success': True, 'job_id': job_id, 'status': job['status']}
+    if job['status'] == 'done':
+        response.update(job['result'])
+    elif job['status'] == 'error':
+        response['success'] = False
+        response['message'] = job['error']
+    return jsonify(response)
 
 @app.route('/api/my-plans', methods=['GET'])
 @login_required
 def get_my_plans():
-    plans = db_service.get_user_plans(current_user.id)
-    return jsonify({'success': True, 'plans': plans})
+    """分页获取计划列表：?limit=20&cursor=...，列表未变化时返回 304"""
+    limit = request.args.get('limit', Config.PLANS_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, Config.PLANS_PAGE_MAX))
+    cursor = request.args.get('cursor')
+    
+    try:
+        plans, next_cursor = db_service.get_user_plans_page(current_user.id, limit, cursor)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    response = jsonify({'success': True, 'plans': plans, 'next_cursor': next_cursor})
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/api/search', methods=['GET'])
+@login_required
+def search_plans():
+    """检索已保存的计划：?q=西湖 灵隐寺&duration=4-7&budget=2000-5000&month=2026-10&limit=20&offset=0
+
+    返回按相关度排序的摘要（不含完整计划）、命中总数和天数/预算/月份分面
+    """
+    query = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', Config.PLANS_PAGE_SIZE, type=int), Config.PLANS_PAGE_MAX))
+    offset = max(0, min(request.args.get('offset', 0, type=int), Config.SEARCH_MAX_OFFSET))
+    try:
+        filters = parse_filters(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    result = db_service.search_plans(current_user.id, query, filters, limit, offset)
+    if result is None:
+        return jsonify({'success': False, 'message': '检索失败，请稍后重试'}), 500
+    next_offset = offset + limit if offset + limit < result['total'] else None
+    return jsonify({'success': True, 'next_offset': next_offset, **result})
+
+@app.route('/api/export', methods=['GET'])
+@login_required
+def export_plans():
+    """导出当前用户的全部计划和费用：?format=ndjson|msgpack&compression=none|gzip|zstd，边读边发送"""
+    fmt = request.args.get('format', 'ndjson')
+    compression = request.args.get('compression', 'gzip')
+    try:
+        chunks = encode_records(iter_records(db_service, current_user.id), fmt, compression)
+        # 先取第一块：格式错误在这里抛出，而不是在响应发送途中
+        first = next(chunks, b'')
+    except ExportFormatError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    def generate():
+        yield first
+        yield from chunks
+    
+    if compression != 'none':
+        mimetype = 'application/gzip' if compression == 'gzip' else 'application/zstd'
+    else:
+        mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'application/vnd.msgpack'
+    filename = f"travel-plans-{time.strftime('%Y%m%d')}{file_extension(fmt, compression)}"
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 @app.route('/api/plan/<int:plan_id>', methods=['GET'])
 @login_required
 def get_plan(plan_id):
     plan = db_service.get_plan_by_id(plan_id, current_user.id)
     if plan:
+        if not plan['plan_data'].get('center'):
+            # 早期保存的计划没有坐标，只从缓存补齐，其余由前端解析
+            add_coordinates(plan['plan_data'], cache_only=True)
         return jsonify({'success': True, 'plan': plan})
     return jsonify({'success': False, 'message': '计划不存在'}), 404
 
+@app.route('/api/plan/<int:plan_id>/day/<int:day_index>', methods=['GET'])
+@login_required
+def get_plan_day(plan_id, day_index):
+    """只获取计划中的某一天（day_index 从 0 开始）"""
+    day = db_service.get_plan_day(plan_id, current_user.id, day_index)
+    if day:
+        return jsonify({'success': True, 'day': day})
+    return jsonify({'success': False, 'message': '行程不存在'}), 404
+
+@app.route('/api/plan/<int:plan_id>/regenerate-day', methods=['POST'])
+@login_required
+def regenerate_plan_day(plan_id):
+    """只重新生成计划中的某一天，并以 JSON Patch 局部写回数据库"""
+    data = request.get_json() or {}
+    plan = db_service.get_plan_by_id(plan_id, current_user.id)
+    if not plan:
+        return jsonify({'success': False, 'message': '计划不存在'}), 404
+    
+    itinerary = plan['plan_data'].get('itinerary') or []
+    try:
+        day_index = int(data.get('day_index'))
+    except (TypeError, ValueError):
+        day_index = -1
+    if not 0 <= day_index < len(itinerary):
+        return jsonify({'success': False, 'message': '行程天不存在'}), 400
+    
+    day = ai_service.regenerate_day(plan['plan_data'], day_index, (data.get('instructions') or '').strip())
+    if not day:
+        return jsonify({'success': False, 'message': '重新生成失败，请稍后重试'}), 502
+    
+    add_coordinates(day=day, city=plan['plan_data'].get('destination'))
+    patch = make_day_patch(day_index, day)
+    if not db_service.apply_plan_patch(plan_id, current_user.id, patch):
+        return jsonify({'success': False, 'message': '保存失败'}), 500
+    return jsonify({'success': True, 'day': day, 'patch': patch,
+                    'cost_summary': saved_cost_summary(plan_id, current_user.id)})
+
 @app.route('/api/plan/<int:plan_id>', methods=['DELETE'])
 @login_required
 def delete_plan(plan_id):
@@ -129,11 +519,8 @@ def delete_plan(plan_id):
             success = db_service.delete_plan(plan_id, current_user.id)
         else:
             # 如果是 SQLite，手动删除
-            conn = db_service.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM travel_plans WHERE id = ? AND user_id = ?', (plan_id, current_user.id))
-            conn.commit()
-            conn.close()
+            with db_service.connection() as conn:
+                conn.execute('DELETE FROM travel_plans WHERE id = ? AND user_id = ?', (plan_id, current_user.id))
             success = True
         
         if success:
@@ -154,9 +541,221 @@ def add_expense():
     success = db_service.add_expense(plan_id, current_user.id, expense_data)
     return jsonify({'success': success})
 
+@app.route('/api/expenses/batch', methods=['POST'])
+@login_required
+def add_expenses_batch():
+    """批量添加费用：{"plan_id": 1, "expenses": [...]}，返回每条的处理结果"""
+    data = request.get_json() or {}
+    plan_id = data.get('plan_id')
+    expenses = data.get('expenses')
+    
+    if not plan_id or not isinstance(expenses, list) or not expenses:
+        return jsonify({'success': False, 'message': '缺少计划或费用列表'}), 400
+    if len(expenses) > Config.EXPENSE_BATCH_MAX:
+        return jsonify({'success': False, 'message': f'单次最多提交 {Config.EXPENSE_BATCH_MAX} 条'}), 413
+    
+    results = db_service.add_expenses(plan_id, current_user.id, expenses)
+    inserted = sum(1 for result in results if result['success'])
+    return jsonify({'success': inserted == len(results), 'inserted': inserted, 'results': results})
+
+@app.route('/api/expense/<int:expense_id>', methods=['DELETE'])
+@login_required
+def delete_expense(expense_id):
+    success = db_service.delete_expense(expense_id, current_user.id)
+    if success:
+        return jsonify({'success': True})
+    return jsonify({'success': False, 'message': '费用记录不存在'}), 404
+
+@app.route('/api/plan/<int:plan_id>/expenses', methods=['GET'])
+@login_required
+def get_plan_expenses(plan_id):
+    expenses = db_service.get_plan_expenses(plan_id, current_user.id)
+    return jsonify({'success': True, 'expenses': expenses})
+
+@app.route('/api/plan/<int:plan_id>/expenses/summary', methods=['GET'])
+@login_required
+def get_expense_summary(plan_id):
+    """获取计划的费用汇总（总计、分类合计、每日合计）"""
+    summary = db_service.get_expense_summary(plan_id, current_user.id)
+    return jsonify({'success': True, 'summary': summary})
+
+def analyze_plan_budgets(plan_ids, user_id, with_advice):
+    """本地计算预算使用情况；with_advice 时再批量生成模型建议（有缓存）"""
+    items = []
+    for item in db_service.get_budget_inputs(plan_ids, user_id):
+        items.append((item, analyze_locally(item, Config.BUDGET_WARN_RATIO)))
+    if with_advice and items:
+        advice = ai_service.analyze_budgets(items)
+        for item, analysis in items:
+            analysis['advice'] = advice.get(item['id'])
+    return [analysis for _, analysis in items]
+
+@app.route('/api/plan/<int:plan_id>/budget-analysis', methods=['GET'])
+@login_required
+def get_budget_analysis(plan_id):
+    """单个计划的预算分析，?advice=1 时附带模型建议"""
+    results = analyze_plan_budgets([plan_id], current_user.id, request.args.get('advice') == '1')
+    if not results:
+        return jsonify({'success': False, 'message': '计划不存在'}), 404
+    return jsonify({'success': True, 'analysis': results[0]})
+
+@app.route('/api/budget-analysis', methods=['POST'])
+@login_required
+def batch_budget_analysis():
+    """多个计划的预算分析：{"plan_ids": [...], "advice": true}"""
+    data = request.get_json() or {}
+    try:
+        plan_ids = list(dict.fromkeys(int(plan_id) for plan_id in data.get('plan_ids') or []))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': '计划 ID 格式错误'}), 400
+    if not plan_ids:
+        return jsonify({'success': False, 'message': '请指定要分析的计划'}), 400
+    if len(plan_ids) > Config.BUDGET_MAX_PLANS:
+        return jsonify({'success': False, 'message': f'一次最多分析 {Config.BUDGET_MAX_PLANS} 个计划'}), 400
+    
+    results = analyze_plan_budgets(plan_ids, current_user.id, bool(data.get('advice')))
+    found = {analysis['plan_id'] for analysis in results}
+    return jsonify({
+        'success': True,
+        'analyses': results,
+        'missing': [plan_id for plan_id in plan_ids if plan_id not in found]
+    })
+
+@app.route('/api/cache-stats', methods=['GET'])
+@login_required
+def get_cache_stats():
+    """各级缓存的命中统计"""
+    stats = {
+        'user_cache': user_cache.stats(),
+        'plan_detail_cache': db_service.plan_cache.stats(),
+        'plan_jobs': plan_jobs.stats(),
+        'login_rate_limit': {'ip': ip_limiter.stats(), 'username': username_limiter.stats()}
+    }
+    if ai_service.plan_cache:
+        stats['ai_plan_cache'] = ai_service.plan_cache.stats()
+    stats['ai_generation'] = ai_service.generation_stats.stats()
+    stats['budget_advice_cache'] = ai_service.budget_cache.stats()
+    stats['ai_router'] = ai_service.router.stats()
+    if geocoder_kind() != 'none':
+        stats['geocode'] = geo_service.stats()
+    if sync_worker:
+        stats['supabase_sync'] = sync_worker.stats()
+    return jsonify({'success': True, 'stats': stats})
+
+# 抓取指标时不主动创建尚未使用过的服务
+def _cache_metrics():
+    caches = {
+        'user': user_cache if user_cache.initialized else None,
+        'plan_detail': db_service.plan_cache if db_service.initialized else None,
+        'ai_plan': ai_service.plan_cache if ai_service.initialized else None,
+        'budget_advice': ai_service.budget_cache if ai_service.initialized else None,
+        'geocode': geo_service.cache if geo_service.initialized else None
+    }
+    return cache_samples(caches)
+
+def _ai_generation_metrics():
+    if not ai_service.initialized:
+        return []
+    stats = ai_service.generation_stats.stats()
+    return [({}, stats['parse_failures'])]
+
+def _router_metrics(key):
+    if not ai_service.initialized:
+        return []
+    models = ai_service.router.stats()['models']
+    if key == 'breaker_open':
+        return [({'model': name}, int(slot['breaker'] != 'closed')) for name, slot in models.items()]
+    return [({'model': name}, slot[key]) for name, slot in models.items()]
+
+REGISTRY.gauge_callback('cache_hits_total', '各级缓存命中次数', lambda: _cache_metrics()[0], 'counter')
+REGISTRY.gauge_callback('cache_misses_total', '各级缓存未命中次数', lambda: _cache_metrics()[1], 'counter')
+REGISTRY.gauge_callback('cache_hit_ratio', '各级缓存命中率', lambda: _cache_metrics()[2])
+REGISTRY.gauge_callback('llm_plan_parse_failures_total', '模型输出无法解析为计划的次数', _ai_generation_metrics, 'counter')
+REGISTRY.gauge_callback('llm_model_in_flight', '各模型正在进行的调用数', lambda: _router_metrics('in_flight'))
+REGISTRY.gauge_callback('llm_model_breaker_open', '模型熔断器是否处于断开或半开状态', lambda: _router_metrics('breaker_open'))
+REGISTRY.gauge_callback('llm_hedged_requests_total', '发起的对冲请求数',
+                        lambda: [({}, ai_service.router.hedges)] if ai_service.initialized else [], 'counter')
+REGISTRY.gauge_callback('voice_relay_sessions', '语音中转会话数',
+                        lambda: [({'state': k}, voice_relay.stats()[k]) for k in ('active', 'finished')]
+                        if voice_relay.initialized else [])
+REGISTRY.gauge_callback('plan_jobs', '后台计划生成任务数',
+                        lambda: [({'status': k}, v) for k, v in plan_jobs.stats().items() if k != 'max_workers']
+                        if plan_jobs.initialized else [])
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 格式的性能指标"""
+    if not Config.METRICS_ENABLED:
+        return jsonify({'success': False, 'message': '未启用指标'}), 404
+    if Config.METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {Config.METRICS_TOKEN}':
+        return jsonify({'success': False, 'message': '未授权'}), 401
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/voice-config', methods=['GET'])
+@login_required
 def get_voice_config():
-    return jsonify(voice_service.get_client_config())
+    """语音输入配置：只告诉前端是否启用了服务端中转"""
+    response = jsonify(voice_service.get_client_config())
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/voice/sessions', methods=['POST'])
+@login_required
+def create_voice_session():
+    """开始一次服务端中转的语音输入"""
+    if not Config.VOICE_RELAY_ENABLED:
+        return jsonify({'success': False, 'message': '未启用语音中转'}), 404
+    session = voice_relay.create(current_user.id)
+    if not session:
+        response = jsonify({'success': False, 'message': '语音识别繁忙，请稍后再试'})
+        response.headers['Retry-After'] = '2'
+        return response, 503
+    return jsonify({'success': True, 'session_id': session.id, 'max_chunk_bytes': Config.VOICE_MAX_CHUNK_BYTES}), 201
+
+@app.route('/api/voice/sessions/<session_id>/audio', methods=['POST'])
+@login_required
+def upload_voice_audio(session_id):
+    """上传一个音频分片（请求体为 16k 16bit PCM），?last=1 表示最后一片"""
+    session = voice_relay.get(session_id, current_user.id) if Config.VOICE_RELAY_ENABLED else None
+    if not session:
+        return jsonify({'success': False, 'message': '会话不存在'}), 404
+    if (request.content_length or 0) > Config.VOICE_MAX_CHUNK_BYTES:
+        return jsonify({'success': False, 'message': '音频分片过大'}), 413
+    
+    chunk = request.get_data(cache=False)
+    last = request.args.get('last') == '1'
+    if not session.put_audio(chunk, last, timeout=Config.VOICE_PUT_TIMEOUT):
+        if session.final or session.received_last:
+            return jsonify({'success': False, 'message': '会话已结束'}), 409
+        # 识别器跟不上上传速度，让客户端稍后重发这一片
+        response = jsonify({'success': False, 'message': '音频发送过快'})
+        response.headers['Retry-After'] = '1'
+        return response, 429
+    return jsonify({'success': True}), 202
+
+@app.route('/api/voice/sessions/<session_id>/events', methods=['GET'])
+@login_required
+def stream_voice_transcript(session_id):
+    """以 SSE 推送识别结果：partial 为中间结果，final 为最终结果"""
+    session = voice_relay.get(session_id, current_user.id) if Config.VOICE_RELAY_ENABLED else None
+    if not session:
+        return jsonify({'success': False, 'message': '会话不存在'}), 404
+    
+    def event_stream():
+        version = 0
+        while True:
+            version, text, final, error = session.wait_for_update(version, timeout=15)
+            if final:
+                yield sse_event('error' if error else 'final', {'text': text, 'message': error})
+                return
+            # 超时没有新结果时也发送一次，及时发现已断开的连接
+            yield sse_event('partial', {'text': text})
+    
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @app.route('/api/map-config', methods=['GET'])
 def get_map_config():
@@ -166,8 +765,51 @@ def get_map_config():
         'amap_secret': Config.AMAP_SECRET_KEY
     })
 
+@app.cli.command('init-db')
+def init_db_command():
+    """flask --app app init-db：部署时初始化或迁移本地数据库"""
+    init_storage()
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """flask --app app build-assets：生成 static/dist 下的带哈希资源和压缩版本"""
+    build_static_assets()
+
+def _print_throughput(action, count, seconds):
+    print(f"{action} {count} 条记录，耗时 {seconds:.2f}s（{count / seconds if seconds else 0:.0f} 条/秒）")
+
+@app.cli.command('export-plans')
+@click.argument('path')
+@click.option('--user-id', type=int, default=None, help='只导出该用户的计划和费用，默认导出整个数据库')
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'msgpack']), default=None, help='默认按扩展名判断')
+@click.option('--compression', type=click.Choice(['none', 'gzip', 'zstd']), default=None, help='默认按扩展名判断')
+@click.option('--batch-size', type=int, default=1000, help='每次从数据库读取的行数')
+def export_plans_command(path, user_id, fmt, compression, batch_size):
+    """flask --app app export-plans backup.msgpack.zst：流式导出计划和费用到文件"""
+    try:
+        count, size, seconds = export_to_file(db_service, path, user_id, fmt, compression, batch_size)
+    except ExportFormatError as e:
+        raise click.ClickException(str(e))
+    _print_throughput('导出', count, seconds)
+    print(f"文件 {path}，{size / 1024 / 1024:.1f} MB")
+
+@app.cli.command('import-plans')
+@click.argument('path')
+@click.option('--user-id', type=int, default=None, help='全部导入到该用户名下并重新分配 id，默认按原 id 恢复')
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'msgpack']), default=None, help='默认按扩展名判断')
+@click.option('--compression', type=click.Choice(['none', 'gzip', 'zstd']), default=None, help='默认按扩展名判断')
+@click.option('--batch-size', type=int, default=500, help='每次批量写入的行数')
+def import_plans_command(path, user_id, fmt, compression, batch_size):
+    """flask --app app import-plans backup.msgpack.zst：从导出文件批量导入到当前配置的数据库"""
+    init_storage()
+    try:
+        counts, seconds = import_from_file(db_service, path, user_id, fmt, compression, batch_size)
+    except ExportFormatError as e:
+        raise click.ClickException(str(e))
+    _print_throughput('导入', sum(counts[table] for table in ('users', 'travel_plans', 'expenses')), seconds)
+    print(f"用户 {counts['users']}，计划 {counts['travel_plans']}，费用 {counts['expenses']}，跳过 {counts['skipped']}")
+
 if __name__ == '__main__':
-    # 只有使用本地数据库时才需要初始化
-    if not Config.USE_SUPABASE:
-        db_service.init_db()
+    # 开发服务器：单进程，启动时直接初始化；生产环境使用 gunicorn -c gunicorn.conf.py
+    init_storage()
     app.run(debug=True, host='0.0.0.0', port=5000)
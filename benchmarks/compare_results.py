@@ -0,0 +1,92 @@
+"""对比两次 load_suite 结果
+
+逐个接口列出 p50/p95/p99、吞吐量和内存的变化；p95、p99 或内存升高、吞吐量下降
+超过阈值时标记为回归，存在回归时以状态码 1 退出，便于在 CI 中使用。
+
+用法：
+    python -m benchmarks.compare_results base.json new.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+# (字段, 数值越大越好)
+METRICS = (
+    ('p50_ms', False),
+    ('p95_ms', False),
+    ('p99_ms', False),
+    ('throughput_rps', True),
+    ('mem_peak_kb', False)
+)
+# 参与回归判断的字段，p50 只作参考
+GATED = ('p95_ms', 'p99_ms', 'throughput_rps', 'mem_peak_kb')
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def change(base, new):
+    if base in (None, 0) or new is None:
+        return None
+    return (new - base) / base * 100
+
+
+def compare(base, new, threshold):
+    """返回 (表格行, 回归列表)"""
+    rows = []
+    regressions = []
+    names = sorted(set(base['endpoints']) | set(new['endpoints']))
+    for name in names:
+        old_stats = base['endpoints'].get(name)
+        new_stats = new['endpoints'].get(name)
+        if not old_stats or not new_stats:
+            rows.append((name, '仅存在于' + ('新结果' if new_stats else '基准结果')))
+            continue
+        for metric, higher_is_better in METRICS:
+            delta = change(old_stats.get(metric), new_stats.get(metric))
+            if delta is None:
+                continue
+            worse = -delta if higher_is_better else delta
+            flag = ''
+            if metric in GATED and worse > threshold:
+                flag = '回归'
+                regressions.append(f'{name}.{metric} {delta:+.1f}%')
+            elif worse < -threshold:
+                flag = '改善'
+            rows.append((name, metric, old_stats[metric], new_stats[metric], f'{delta:+.1f}%', flag))
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base', help='基准结果 JSON')
+    parser.add_argument('new', help='新结果 JSON')
+    parser.add_argument('--threshold', type=float, default=10.0, help='判定回归的变化百分比')
+    args = parser.parse_args()
+
+    base = load(args.base)
+    new = load(args.new)
+    print(f'基准: {base["meta"].get("commit")} ({base["meta"]["args"].get("backend")})  '
+          f'新: {new["meta"].get("commit")} ({new["meta"]["args"].get("backend")})')
+    for key in ('throughput_rps', 'rss_peak_mb', 'errors'):
+        print(f'{key}: {base["summary"].get(key)} -> {new["summary"].get(key)}')
+
+    rows, regressions = compare(base, new, args.threshold)
+    print(f'{"接口":<20}{"指标":<16}{"基准":>10}{"新":>10}{"变化":>10}')
+    for row in rows:
+        if len(row) == 2:
+            print(f'{row[0]:<20}{row[1]}')
+        else:
+            name, metric, old, value, delta, flag = row
+            print(f'{name:<20}{metric:<16}{old:>10}{value:>10}{delta:>10}  {flag}')
+
+    if regressions:
+        print(f'超过 {args.threshold}% 的回归: ' + ', '.join(regressions))
+        sys.exit(1)
+    print('没有超过阈值的回归')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""SQLite 连接池前后对比基准测试
+
+通过 Flask 测试客户端请求 /api/my-plans（每个请求包含 load_user 和
+get_user_plans 两次数据库访问），分别使用旧的“每次查询新建连接”方式
+和连接池方式，输出每秒请求数。
+
+用法：
+    python benchmarks/db_pool_bench.py --requests 2000 --threads 4
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 基准测试只使用临时 SQLite 文件，不连接云端
+_tmp_dir = tempfile.mkdtemp(prefix='db-pool-bench-')
+os.environ['DATABASE_PATH'] = os.path.join(_tmp_dir, 'bench.db')
+os.environ['SUPABASE_URL'] = ''
+os.environ['SUPABASE_KEY'] = ''
+
+import app as app_module  # noqa: E402
+from utils.db_service import DatabaseService  # noqa: E402
+
+
+class NaiveDatabaseService(DatabaseService):
+    """模拟改造前的行为：每次访问都新建并关闭连接"""
+
+    @contextmanager
+    def connection(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def seed(service, plans=20):
+    service.init_db()
+    service.create_user('bench', 'bench@example.com', 'bench-password')
+    user = service.authenticate_user('bench', 'bench-password')
+    for i in range(plans):
+        service.save_travel_plan(user['id'], {'destination': f'城市{i}', 'itinerary': []})
+    return user
+
+
+def run(service, total_requests, threads):
+    app_module.db_service = service
+    flask_app = app_module.app
+    user = service.authenticate_user('bench', 'bench-password')
+    per_thread = total_requests // threads
+
+    def worker():
+        client = flask_app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(user['id'])
+            sess['_fresh'] = True
+        for _ in range(per_thread):
+            response = client.get('/api/my-plans')
+            assert response.status_code == 200
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    pooled = DatabaseService()
+    seed(pooled)
+    naive = NaiveDatabaseService()
+
+    naive_rps = run(naive, args.requests, args.threads)
+    pooled_rps = run(pooled, args.requests, args.threads)
+
+    print(f'每次新建连接: {naive_rps:8.1f} req/s')
+    print(f'连接池:       {pooled_rps:8.1f} req/s')
+    print(f'提升:         {pooled_rps / naive_rps:8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
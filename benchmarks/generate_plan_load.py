@@ -0,0 +1,90 @@
+"""计划生成接口离线压测
+
+使用本地 DashScope 替身（DASHSCOPE_STUB=1）和临时 SQLite 文件，
+模拟 N 个并发用户提交 /api/generate-plan 并轮询结果，
+输出提交接口的响应耗时和整体吞吐量。
+
+用法：
+    python benchmarks/generate_plan_load.py --users 20 --workers 4 --latency 1.0
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20, help='并发用户数')
+    parser.add_argument('--workers', type=int, default=4, help='后台生成线程数（AI_MAX_WORKERS）')
+    parser.add_argument('--latency', type=float, default=1.0, help='替身模拟的大模型耗时（秒）')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='generate-load-')
+    os.environ.update({
+        'DATABASE_PATH': os.path.join(tmp_dir, 'load.db'),
+        'SUPABASE_URL': '',
+        'SUPABASE_KEY': '',
+        'DASHSCOPE_STUB': '1',
+        'DASHSCOPE_STUB_LATENCY': str(args.latency),
+        'AI_MAX_WORKERS': str(args.workers),
+        'AI_MAX_PENDING_JOBS': str(max(args.users, 100))
+    })
+
+    import app as app_module
+
+    app_module.db_service.init_db()
+    flask_app = app_module.app
+
+    submit_latencies = []
+    finished = []
+    lock = threading.Lock()
+
+    def user_session(index):
+        username = f'load{index}'
+        app_module.db_service.create_user(username, f'{username}@example.com', 'pw')
+        user = app_module.db_service.authenticate_user(username, 'pw')
+
+        client = flask_app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(user['id'])
+            sess['_fresh'] = True
+
+        start = time.perf_counter()
+        response = client.post('/api/generate-plan', json={'input': f'我想去杭州玩{index % 5 + 2}天'})
+        submitted = time.perf_counter()
+        job_id = response.get_json()['job_id']
+
+        while True:
+            data = client.get(f'/api/generate-plan/{job_id}').get_json()
+            if data['status'] in ('done', 'error'):
+                break
+            time.sleep(0.05)
+
+        with lock:
+            submit_latencies.append(submitted - start)
+            finished.append(data['status'])
+
+    threads = [threading.Thread(target=user_session, args=(i,)) for i in range(args.users)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    submit_ms = sorted(latency * 1000 for latency in submit_latencies)
+    print(f'并发用户: {args.users}  后台线程: {args.workers}  模拟延迟: {args.latency}s')
+    print(f'完成: {finished.count("done")}  失败: {finished.count("error")}  总耗时: {elapsed:.2f}s')
+    print(f'吞吐量: {len(finished) / elapsed:.2f} plans/s')
+    print(f'提交接口耗时 p50: {statistics.median(submit_ms):.1f}ms  max: {submit_ms[-1]:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""混合存储模式与直连 Supabase 的写入延迟对比
+
+启动本地 PostgREST 替身（带固定延迟），分别测量：
+1. 直接通过 SupabaseService 保存计划和费用的耗时；
+2. 通过 HybridDatabaseService 写入本地 SQLite 的耗时；
+3. SupabaseSyncWorker 把积压的变更全部推送到替身所需的时间和 HTTP 请求数，
+   并核对替身中的行数与本地一致。
+
+用法：
+    python -m benchmarks.hybrid_sync_bench --plans 200 --latency 0.02
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.stubs.postgrest_stub import start_stub_server, STUB_KEY  # noqa: E402
+
+SAMPLE_PLAN = {
+    'destination': '杭州',
+    'duration': '3天',
+    'budget_breakdown': {'total': 3000},
+    'itinerary': [{'day': 1, 'activities': [{'time': '09:00', 'activity': '西湖'}]}]
+}
+SAMPLE_EXPENSE = {'category': '餐饮', 'amount': 88, 'description': '午餐', 'date': '2024-05-01'}
+
+
+def timed(func, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return (time.perf_counter() - start) / count * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--plans', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.02, help='替身每个请求的延迟（秒）')
+    parser.add_argument('--batch-size', type=int, default=200)
+    args = parser.parse_args()
+
+    server, stub, url = start_stub_server(latency=args.latency)
+    os.environ.update({'SUPABASE_URL': url, 'SUPABASE_KEY': STUB_KEY})
+
+    from utils.supabase_service import SupabaseService
+    from utils.sync_service import HybridDatabaseService, SupabaseSyncWorker
+
+    remote = SupabaseService()
+    remote.create_user('direct', 'direct@example.com', 'pw')
+    direct_user = remote.authenticate_user('direct', 'pw')['id']
+    direct_plan = remote.save_travel_plan(direct_user, SAMPLE_PLAN)
+    direct_ms = timed(lambda: remote.save_travel_plan(direct_user, SAMPLE_PLAN), args.plans)
+    direct_expense_ms = timed(lambda: remote.add_expense(direct_plan, direct_user, SAMPLE_EXPENSE), args.plans)
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'hybrid.db')
+    local = HybridDatabaseService(db_path)
+    local.init_db()
+    local.create_user('hybrid', 'hybrid@example.com', 'pw')
+    user_id = local.authenticate_user('hybrid', 'pw')['id']
+    plan_id = local.save_travel_plan(user_id, SAMPLE_PLAN)
+    local_ms = timed(lambda: local.save_travel_plan(user_id, SAMPLE_PLAN), args.plans)
+    local_expense_ms = timed(lambda: local.add_expense(plan_id, user_id, SAMPLE_EXPENSE), args.plans)
+
+    # 替身里已有直连写入的数据，清空后再同步以便核对行数
+    stub.tables.clear()
+    stub.request_count = 0
+    worker = SupabaseSyncWorker(local, remote, batch_size=args.batch_size)
+    pending = worker.stats()['pending']
+    start = time.perf_counter()
+    while worker.run_once():
+        pass
+    sync_elapsed = time.perf_counter() - start
+
+    with local.connection() as conn:
+        local_counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                        for table in ('users', 'travel_plans', 'expenses')}
+    remote_counts = {table: len(stub.tables.get(table, [])) for table in local_counts}
+
+    print(f'替身延迟: {args.latency * 1000:.0f}ms  计划数: {args.plans}')
+    print(f'直连 Supabase: 保存计划 {direct_ms:.2f}ms/次  添加费用 {direct_expense_ms:.2f}ms/次')
+    print(f'混合模式本地写入: 保存计划 {local_ms:.2f}ms/次  添加费用 {local_expense_ms:.2f}ms/次')
+    print(f'后台同步: {pending} 条变更  耗时 {sync_elapsed:.2f}s  HTTP 请求 {stub.request_count}')
+    print(f'行数核对: 本地 {local_counts}  云端 {remote_counts}  '
+          f'{"一致" if local_counts == remote_counts else "不一致"}')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
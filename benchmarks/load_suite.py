@@ -0,0 +1,405 @@
+"""混合负载基准测试
+
+在本进程内启动 Flask 应用（真实 HTTP 服务器），外部依赖全部替换为本地替身：
+DashScope 使用 DASHSCOPE_STUB，Supabase 使用 benchmarks/stubs/postgrest_stub.py，
+SQLite 使用临时文件。然后由多个虚拟用户按比例混合执行登录、计划列表、查看计划、
+生成计划和记账，统计每个接口的吞吐量、p50/p95/p99 延迟和内存，结果保存为 JSON，
+可以用 compare_results.py 对比两次提交之间的变化。
+
+内存有两项：整个运行期间的进程 RSS，以及压测结束后通过测试客户端逐个接口串行执行时
+用 tracemalloc 测得的单次请求 Python 内存峰值（生成计划包含后台任务的分配）。
+
+用法：
+    python -m benchmarks.load_suite --backend sqlite --users 16 --duration 30
+    python -m benchmarks.load_suite --backend supabase-async --db-latency 0.02 --output base.json
+    python -m benchmarks.compare_results base.json new.json
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from urllib.parse import urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.stubs.postgrest_stub import start_stub_server, STUB_KEY  # noqa: E402
+
+BACKENDS = ('sqlite', 'supabase', 'supabase-async', 'hybrid')
+DEFAULT_MIX = 'login:1,list_plans:4,view_plan:4,add_expense:2,generate_plan:1'
+CITIES = ('杭州', '成都', '西安', '厦门', '青岛', '大理', '桂林', '苏州')
+SEED_PLAN_INPUT = '我想去{city}玩{days}天，喜欢美食和历史'
+SAMPLE_EXPENSE = {'category': '餐饮', 'amount': 88, 'description': '午餐', 'date': '2024-05-01'}
+
+
+def parse_mix(text):
+    """'login:1,view_plan:4' -> [('login', 1), ('view_plan', 4)]"""
+    mix = []
+    for item in text.split(','):
+        name, _, weight = item.strip().partition(':')
+        if name:
+            mix.append((name, float(weight or 1)))
+    return mix
+
+
+def percentile(sorted_values, pct):
+    """最近秩法求百分位数"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def configure_environment(args):
+    """在导入 app 之前设置环境变量，返回 PostgREST 替身（不需要时为 None）"""
+    tmp_dir = tempfile.mkdtemp(prefix='load-suite-')
+    env = {
+        'DATABASE_PATH': os.path.join(tmp_dir, 'bench.db'),
+        'SUPABASE_URL': '',
+        'SUPABASE_KEY': '',
+        'SUPABASE_ASYNC': '',
+        'STORAGE_MODE': 'sqlite',
+        'DASHSCOPE_STUB': '1',
+        'DASHSCOPE_STUB_LATENCY': str(args.llm_latency),
+        'AI_MAX_PENDING_JOBS': str(max(args.users * 4, 100)),
+        'PLAN_CACHE_BACKEND': args.plan_cache,
+        'PROFILE_SLOW_REQUEST_MS': '0',
+        # 所有虚拟用户都来自 127.0.0.1，放开登录限流
+        'LOGIN_RATE_IP_BURST': '1000000',
+        'LOGIN_RATE_USER_BURST': '1000000'
+    }
+    if args.scrypt_n:
+        env['PASSWORD_SCRYPT_N'] = str(args.scrypt_n)
+
+    stub = None
+    if args.backend != 'sqlite':
+        server, stub, url = start_stub_server(latency=args.db_latency)
+        env.update({'SUPABASE_URL': url, 'SUPABASE_KEY': STUB_KEY,
+                    'STORAGE_MODE': 'hybrid' if args.backend == 'hybrid' else 'supabase',
+                    'SUPABASE_ASYNC': '1' if args.backend == 'supabase-async' else ''})
+    os.environ.update(env)
+    return stub
+
+
+def start_app_server(flask_app):
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+class VirtualUser:
+    """一个登录用户的会话，各操作返回是否成功
+
+    压测时通过 http.client 访问真实服务器；传入 client（Flask 测试客户端）时不经过网络，
+    用于测量内存：开发服务器关闭连接前会 rfile.read(10_000_000)，每个请求都有约 10MB 的临时分配。
+    """
+
+    def __init__(self, base_url, username, password, plan_ids, rng, poll_interval=0.05, client=None):
+        parsed = urlparse(base_url or '')
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.client = client
+        self.username = username
+        self.password = password
+        self.plan_ids = list(plan_ids)
+        self.rng = rng
+        self.poll_interval = poll_interval
+        self.cookies = {}
+
+    def _request(self, method, path, payload=None):
+        """发送请求，返回 (状态码, 解析后的 JSON 或 None)"""
+        if self.client is not None:
+            response = self.client.open(path, method=method, json=payload)
+            return response.status_code, response.get_json(silent=True)
+        headers = {}
+        body = None
+        if payload is not None:
+            body = json.dumps(payload).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+            for header in response.headers.get_all('Set-Cookie') or []:
+                name, _, value = header.split(';', 1)[0].partition('=')
+                self.cookies[name.strip()] = value.strip()
+        finally:
+            conn.close()
+        is_json = response.headers.get('Content-Type', '').startswith('application/json')
+        return response.status, json.loads(data) if data and is_json else None
+
+    def login(self):
+        status, _ = self._request('POST', '/login', {'username': self.username, 'password': self.password})
+        return status == 200
+
+    def list_plans(self):
+        status, _ = self._request('GET', '/api/my-plans')
+        return status in (200, 304)
+
+    def view_plan(self):
+        if not self.plan_ids:
+            return self.list_plans()
+        status, _ = self._request('GET', f'/api/plan/{self.rng.choice(self.plan_ids)}')
+        return status == 200
+
+    def add_expense(self):
+        if not self.plan_ids:
+            return False
+        payload = {'plan_id': self.rng.choice(self.plan_ids), 'expense': SAMPLE_EXPENSE}
+        status, data = self._request('POST', '/api/expense', payload)
+        return status == 200 and bool(data and data.get('success'))
+
+    def generate_plan(self):
+        """提交生成任务并轮询到完成，返回 (提交是否成功, 端到端是否成功, 提交耗时)"""
+        user_input = SEED_PLAN_INPUT.format(city=self.rng.choice(CITIES), days=self.rng.randint(2, 5))
+        start = time.perf_counter()
+        status, data = self._request('POST', '/api/generate-plan', {'input': user_input})
+        submit_seconds = time.perf_counter() - start
+        if status != 202:
+            return False, False, submit_seconds
+        job_id = data['job_id']
+        while True:
+            _, data = self._request('GET', f'/api/generate-plan/{job_id}')
+            if not data or data['status'] in ('done', 'error'):
+                break
+            time.sleep(self.poll_interval)
+        done = bool(data) and data['status'] == 'done'
+        if done and data.get('plan_id'):
+            self.plan_ids.append(data['plan_id'])
+        return True, done, submit_seconds
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, ok):
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+
+def run_operation(user, name, recorder):
+    start = time.perf_counter()
+    try:
+        if name == 'generate_plan':
+            submitted, finished, submit_seconds = user.generate_plan()
+            recorder.record('generate_plan', submit_seconds, submitted)
+            recorder.record('generate_plan_e2e', time.perf_counter() - start, finished)
+            return
+        ok = getattr(user, name)()
+    except Exception as e:
+        print(f"{name} 请求错误: {e}")
+        ok = False
+    recorder.record(name, time.perf_counter() - start, ok)
+
+
+def seed_users(db_service, count, plans_per_user):
+    """直接通过服务层创建用户和计划，返回 [(用户名, 密码, 计划 ID 列表)]"""
+    from utils.ai_stub import _build_stub_plan
+    users = []
+    for i in range(count):
+        username = f'bench{i}'
+        db_service.create_user(username, f'{username}@example.com', 'bench-pw')
+        user_id = db_service.authenticate_user(username, 'bench-pw')['id']
+        plan_ids = []
+        for j in range(plans_per_user):
+            user_input = SEED_PLAN_INPUT.format(city=CITIES[(i + j) % len(CITIES)], days=j % 4 + 2)
+            plan_ids.append(db_service.save_travel_plan(user_id, _build_stub_plan(user_input)))
+        users.append((username, 'bench-pw', [p for p in plan_ids if p]))
+    return users
+
+
+def summarize(recorder, elapsed):
+    endpoints = {}
+    for name, values in sorted(recorder.samples.items()):
+        values = sorted(values)
+        endpoints[name] = {
+            'count': len(values),
+            'errors': recorder.errors.get(name, 0),
+            'throughput_rps': round(len(values) / elapsed, 2),
+            'mean_ms': round(statistics.fmean(values) * 1000, 2),
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p95_ms': round(percentile(values, 95) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2),
+            'max_ms': round(values[-1] * 1000, 2)
+        }
+    return endpoints
+
+
+def measure_memory(flask_app, seeded_user, mix, samples):
+    """通过测试客户端逐个接口串行执行 samples 次，返回单次请求 tracemalloc 峰值（KB）的中位数"""
+    username, password, plan_ids = seeded_user
+    user = VirtualUser(None, username, password, plan_ids, random.Random(0), client=flask_app.test_client())
+    user.login()
+    result = {}
+    tracemalloc.start()
+    try:
+        for name, _ in mix:
+            peaks = []
+            for _ in range(samples):
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                if name == 'generate_plan':
+                    user.generate_plan()
+                else:
+                    getattr(user, name)()
+                peaks.append(tracemalloc.get_traced_memory()[1] - before)
+            result[name] = round(statistics.median(peaks) / 1024, 1)
+    finally:
+        tracemalloc.stop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=BACKENDS, default='sqlite', help='存储后端')
+    parser.add_argument('--users', type=int, default=8, help='并发虚拟用户数')
+    parser.add_argument('--duration', type=float, default=20.0, help='压测时长（秒）')
+    parser.add_argument('--warmup', type=float, default=2.0, help='预热时长（秒），不计入结果')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='操作及权重，如 login:1,view_plan:4')
+    parser.add_argument('--think', type=float, default=0.0, help='每次操作后的等待时间（秒）')
+    parser.add_argument('--seed-plans', type=int, default=10, help='每个用户预先创建的计划数')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='DashScope 替身的模拟耗时（秒）')
+    parser.add_argument('--db-latency', type=float, default=0.01, help='PostgREST 替身的模拟延迟（秒）')
+    parser.add_argument('--plan-cache', default='memory', help='计划缓存后端: memory, sqlite, off')
+    parser.add_argument('--scrypt-n', type=int, default=0, help='覆盖密码哈希成本参数，0 表示使用配置值')
+    parser.add_argument('--memory-samples', type=int, default=10, help='每个接口测量内存的次数，0 表示跳过')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    parser.add_argument('--output', help='结果 JSON 路径，默认 benchmarks/results/<提交>-<后端>.json')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    configure_environment(args)
+
+    import app as app_module
+
+    if args.backend == 'sqlite':
+        app_module.db_service.init_db()
+    users = seed_users(app_module.db_service, args.users, args.seed_plans)
+    server, base_url = start_app_server(app_module.app)
+
+    sessions = []
+    for i, (username, password, plan_ids) in enumerate(users):
+        user = VirtualUser(base_url, username, password, plan_ids, random.Random(args.seed + i))
+        user.login()
+        sessions.append(user)
+
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    recorder = Recorder()
+    warm_recorder = Recorder()
+    rss_samples = []
+    stop = threading.Event()
+    measuring = threading.Event()
+
+    def sample_rss():
+        while not stop.is_set():
+            rss_samples.append(current_rss_mb())
+            stop.wait(0.5)
+
+    def user_loop(user):
+        while not stop.is_set():
+            name = user.rng.choices(names, weights)[0]
+            run_operation(user, name, recorder if measuring.is_set() else warm_recorder)
+            if args.think:
+                time.sleep(args.think)
+
+    rss_start = current_rss_mb()
+    threads = [threading.Thread(target=sample_rss, daemon=True)]
+    threads += [threading.Thread(target=user_loop, args=(user,), daemon=True) for user in sessions]
+    for t in threads:
+        t.start()
+    time.sleep(args.warmup)
+    measuring.set()
+    start = time.perf_counter()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    endpoints = summarize(recorder, elapsed)
+    total = sum(e['count'] for name, e in endpoints.items() if name != 'generate_plan_e2e')
+    memory = measure_memory(app_module.app, users[0], mix, args.memory_samples) if args.memory_samples else {}
+    for name, peak_kb in memory.items():
+        if name in endpoints:
+            endpoints[name]['mem_peak_kb'] = peak_kb
+    server.shutdown()
+
+    result = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args)
+        },
+        'summary': {
+            'duration_s': round(elapsed, 2),
+            'requests': total,
+            'errors': sum(e['errors'] for name, e in endpoints.items() if name != 'generate_plan_e2e'),
+            'throughput_rps': round(total / elapsed, 2),
+            'rss_start_mb': round(rss_start, 1),
+            'rss_peak_mb': round(max(rss_samples or [rss_start]), 1),
+            'rss_end_mb': round(current_rss_mb(), 1)
+        },
+        'endpoints': endpoints
+    }
+
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results',
+                                         f'{result["meta"]["commit"] or "local"}-{args.backend}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    summary = result['summary']
+    print(f'后端: {args.backend}  并发用户: {args.users}  时长: {summary["duration_s"]}s  '
+          f'总请求: {summary["requests"]}  吞吐量: {summary["throughput_rps"]} req/s  错误: {summary["errors"]}')
+    print(f'RSS: 启动 {summary["rss_start_mb"]}MB  峰值 {summary["rss_peak_mb"]}MB  结束 {summary["rss_end_mb"]}MB')
+    print(f'{"接口":<20}{"次数":>8}{"错误":>6}{"req/s":>9}{"p50":>9}{"p95":>9}{"p99":>9}{"内存KB":>9}')
+    for name, e in endpoints.items():
+        print(f'{name:<20}{e["count"]:>8}{e["errors"]:>6}{e["throughput_rps"]:>9}{e["p50_ms"]:>9}'
+              f'{e["p95_ms"]:>9}{e["p99_ms"]:>9}{e.get("mem_peak_kb", "-"):>9}')
+    print(f'结果已保存到 {output}')
+
+
+if __name__ == '__main__':
+    main()
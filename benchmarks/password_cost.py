@@ -0,0 +1,72 @@
+"""选取 scrypt 成本参数
+
+在当前机器上测量不同 N 值下单次哈希的耗时、内存占用，以及用计算池
+并发校验时每秒可以处理的登录数，并给出不超过目标耗时的最大 N。
+结果可以直接写入 .env（PASSWORD_SCRYPT_N / PASSWORD_SCRYPT_R / PASSWORD_SCRYPT_P）。
+
+用法：
+    python -m benchmarks.password_cost --target-ms 100 --logins 200
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import wait
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.password_service import PasswordHasher  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target-ms', type=float, default=100, help='单次哈希可接受的最长耗时（毫秒）')
+    parser.add_argument('--min-log2n', type=int, default=12)
+    parser.add_argument('--max-log2n', type=int, default=17)
+    parser.add_argument('-r', type=int, default=8)
+    parser.add_argument('-p', type=int, default=1)
+    parser.add_argument('--executor', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--logins', type=int, default=100, help='测量吞吐量时并发校验的次数')
+    args = parser.parse_args()
+
+    print(f'CPU 核数: {os.cpu_count()}  计算池: {args.executor} x {args.workers}  r={args.r} p={args.p}')
+    print(f'{"N":>8} {"内存":>8} {"单次耗时":>10} {"吞吐量":>12}')
+
+    chosen = None
+    for log2n in range(args.min_log2n, args.max_log2n + 1):
+        n = 2 ** log2n
+        hasher = PasswordHasher(n=n, r=args.r, p=args.p, workers=args.workers,
+                                executor=args.executor, max_pending=args.logins + 1)
+        stored = hasher.hash('benchmark-password')
+
+        samples = []
+        for _ in range(5):
+            start = time.perf_counter()
+            hasher.verify('benchmark-password', stored)
+            samples.append(time.perf_counter() - start)
+        single_ms = sorted(samples)[len(samples) // 2] * 1000
+
+        start = time.perf_counter()
+        futures = [hasher.submit_verify('benchmark-password', stored) for _ in range(args.logins)]
+        wait(futures)
+        throughput = args.logins / (time.perf_counter() - start)
+        hasher._executor.shutdown()
+
+        memory_mb = 128 * n * args.r * args.p / 1024 / 1024
+        print(f'{n:>8} {memory_mb:>6.0f}MB {single_ms:>8.1f}ms {throughput:>9.1f}/s')
+        if single_ms <= args.target_ms:
+            chosen = (n, single_ms, throughput)
+
+    if chosen:
+        n, single_ms, throughput = chosen
+        print(f'\n建议配置（单次 {single_ms:.0f}ms，每秒约 {throughput:.0f} 次登录）:')
+        print(f'PASSWORD_SCRYPT_N={n}\nPASSWORD_SCRYPT_R={args.r}\nPASSWORD_SCRYPT_P={args.p}')
+        print(f'PASSWORD_HASH_EXECUTOR={args.executor}\nPASSWORD_HASH_WORKERS={args.workers}')
+    else:
+        print(f'\n没有 N 值能在 {args.target_ms:.0f}ms 内完成，请调低 --min-log2n 或放宽目标')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""计划导出 / 导入吞吐量测试
+
+在临时 SQLite 文件中生成 N 个合成计划（每个计划带若干费用），依次测量：
+1. 批量导入（import_records，按批写入 DatabaseService）的耗时；
+2. 按 NDJSON / MessagePack 与 none / gzip / zstd 的每种组合流式导出到文件的耗时和文件大小；
+3. 把导出文件恢复到新的 SQLite 文件的耗时，并核对行数；
+4. 可选：把前 --supabase-plans 个计划导入本地 PostgREST 替身（SupabaseService）。
+
+没有安装 msgpack / zstandard 时跳过对应的组合。--trace-memory 用 tracemalloc 记录每个阶段的
+Python 内存峰值（会明显变慢），用来确认导出和导入的内存占用与计划数无关。
+
+用法：
+    python -m benchmarks.plan_export_bench --plans 100000
+"""
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.db_service import DatabaseService  # noqa: E402
+from utils.plan_export import (COMPRESSIONS, EXPORT_VERSION, FORMATS, ExportFormatError,  # noqa: E402
+                               check_format, export_to_file, file_extension, import_from_file, import_records)
+
+CITIES = ('杭州', '成都', '西安', '厦门', '昆明', '青岛', '桂林', '东京', '大阪', '首尔')
+ACTIVITIES = ('博物馆参观', '老街漫步', '品尝当地小吃', '登山观景', '游船', '夜市', '寺庙参观', '午餐')
+CATEGORIES = ('餐饮', '交通', '住宿', '门票', '购物')
+
+
+def synthetic_records(plans, expenses_per_plan, users):
+    """按导出文件的记录格式生成合成数据（逐条生成，不占用额外内存）"""
+    yield {'type': 'header', 'version': EXPORT_VERSION, 'scope': 'all'}
+    for user_id in range(1, users + 1):
+        yield {'type': 'user', 'id': user_id, 'username': f'bench{user_id}', 'email': f'bench{user_id}@example.com',
+               'password_hash': 'x', 'created_at': '2026-01-01 00:00:00'}
+    for plan_id in range(1, plans + 1):
+        city = CITIES[plan_id % len(CITIES)]
+        days = 2 + plan_id % 6
+        yield {
+            'type': 'plan', 'id': plan_id, 'user_id': 1 + plan_id % users, 'title': city,
+            'created_at': f'2026-{1 + plan_id % 12:02d}-01 08:00:00', 'updated_at': None,
+            'plan_data': {
+                'destination': city,
+                'duration': days,
+                'budget': 1000 * days,
+                'itinerary': [{
+                    'day': day + 1,
+                    'activities': [{'time': f'{9 + 3 * slot:02d}:00',
+                                    'activity': f'{city}{ACTIVITIES[(plan_id + day + slot) % len(ACTIVITIES)]}',
+                                    'location': f'{city}第{slot + 1}站', 'cost': 50 + 30 * slot}
+                                   for slot in range(3)]
+                } for day in range(days)],
+                'accommodation': [{'name': f'{city}酒店', 'location': f'{city}市中心', 'cost': 300 * days}],
+                'transportation': {'to_destination': {'method': '高铁', 'cost': 500}},
+                'budget_breakdown': {'total': 900 * days, 'accommodation': 300 * days, 'food': 150 * days,
+                                     'activities': 200 * days, 'transportation': 250 * days},
+                'tips': [f'{city}旅行注意天气', '提前预订门票']
+            }
+        }
+    expense_id = itertools.count(1)
+    for plan_id in range(1, plans + 1):
+        for index in range(expenses_per_plan):
+            yield {'type': 'expense', 'id': next(expense_id), 'plan_id': plan_id, 'user_id': 1 + plan_id % users,
+                   'category': CATEGORIES[(plan_id + index) % len(CATEGORIES)], 'amount': 20 + index * 15,
+                   'description': '合成数据', 'date': f'2026-05-{1 + index % 28:02d}',
+                   'created_at': '2026-05-01 12:00:00'}
+
+
+def measure(trace_memory, func, *args):
+    """运行 func，返回 (结果, 耗时秒, Python 内存峰值 MB 或 None)"""
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def format_peak(peak):
+    return f'  内存峰值 {peak:.1f}MB' if peak is not None else ''
+
+
+def row_counts(service):
+    with service.connection() as conn:
+        return {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                for table in ('users', 'travel_plans', 'expenses')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--plans', type=int, default=100000)
+    parser.add_argument('--expenses-per-plan', type=int, default=2)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=500, help='导入时每批写入的行数')
+    parser.add_argument('--supabase-plans', type=int, default=2000, help='导入 PostgREST 替身的计划数，0 表示跳过')
+    parser.add_argument('--trace-memory', action='store_true')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='plan-export-')
+    source = DatabaseService(os.path.join(tmp_dir, 'source.db'))
+    source.init_db()
+    records = synthetic_records(args.plans, args.expenses_per_plan, args.users)
+    counts, elapsed, peak = measure(args.trace_memory, import_records, source, records, None, args.batch_size)
+    total = counts['users'] + counts['travel_plans'] + counts['expenses']
+    print(f'计划数: {args.plans}  费用数: {counts["expenses"]}  批大小: {args.batch_size}')
+    print(f'生成并导入 SQLite: {elapsed:.2f}s  {total / elapsed:.0f} 条/秒  '
+          f'{counts["travel_plans"] / elapsed:.0f} 计划/秒{format_peak(peak)}')
+
+    print(f'{"格式":<20}{"大小(MB)":>10}{"导出(s)":>10}{"条/秒":>10}{"恢复(s)":>10}{"条/秒":>10}')
+    expected = row_counts(source)
+    for fmt, compression in itertools.product(FORMATS, COMPRESSIONS):
+        try:
+            check_format(fmt, compression)
+        except ExportFormatError as e:
+            print(f'{fmt}+{compression:<13}跳过：{e}')
+            continue
+        path = os.path.join(tmp_dir, 'export' + file_extension(fmt, compression))
+        (count, size, _), export_elapsed, export_peak = measure(args.trace_memory, export_to_file, source, path)
+
+        target = DatabaseService(os.path.join(tmp_dir, f'restore-{fmt}-{compression}.db'))
+        target.init_db()
+        _, import_elapsed, import_peak = measure(args.trace_memory, import_from_file, target, path,
+                                                 None, None, None, args.batch_size)
+        status = '' if row_counts(target) == expected else '  行数不一致!'
+        print(f'{fmt + "+" + compression:<20}{size / 1024 / 1024:>10.1f}{export_elapsed:>10.2f}'
+              f'{count / export_elapsed:>10.0f}{import_elapsed:>10.2f}{count / import_elapsed:>10.0f}'
+              f'{format_peak(export_peak)}{format_peak(import_peak)}{status}')
+        os.remove(path)
+
+    if args.supabase_plans:
+        from config import Config
+        from benchmarks.stubs.postgrest_stub import start_stub_server, STUB_KEY
+        from utils.supabase_service import SupabaseService
+
+        server, stub, url = start_stub_server()
+        Config.SUPABASE_URL, Config.SUPABASE_KEY = url, STUB_KEY
+        remote = SupabaseService()
+        records = synthetic_records(args.supabase_plans, args.expenses_per_plan, args.users)
+        counts, elapsed, _ = measure(False, import_records, remote, records, None, args.batch_size)
+        total = counts['users'] + counts['travel_plans'] + counts['expenses']
+        print(f'导入 PostgREST 替身（SupabaseService）: {args.supabase_plans} 个计划  {elapsed:.2f}s  '
+              f'{total / elapsed:.0f} 条/秒  HTTP 请求 {stub.request_count}')
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""启动耗时基准测试
+
+每轮在新的子进程中测量（没有任何模块缓存在内存中）：
+1. import app 的耗时；
+2. 首个不需要服务的请求（GET /login 页面）完成时的总耗时；
+3. 首个需要数据库的请求（POST /login，创建数据库服务和密码哈希器）完成时的总耗时；
+4. 预加载较慢 SDK（preload_modules，多进程部署时在 fork 前执行一次）的耗时。
+加 --eager 时在导入后立即创建全部服务，模拟导入即初始化的旧方式，便于对比。
+最后列出 import app 中累计耗时最多的模块（python -X importtime）。
+
+用法：
+    python -m benchmarks.startup_bench --runs 5
+    python -m benchmarks.startup_bench --runs 5 --eager
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETUP = '''
+import app
+app.init_storage()
+app.db_service.create_user('startup', 'startup@example.com', 'startup-pw')
+'''
+
+MEASURE = '''
+import json, time, sys
+start = time.perf_counter()
+import app
+timings = {'import_ms': time.perf_counter() - start}
+if EAGER:
+    for service in (app.db_service, app.ai_service, app.voice_service, app.plan_jobs, app.user_cache):
+        service._get()
+    timings['eager_init_ms'] = time.perf_counter() - start
+client = app.app.test_client()
+client.get('/login')
+timings['first_page_ms'] = time.perf_counter() - start
+client.post('/login', json={'username': 'startup', 'password': 'startup-pw'})
+timings['first_login_ms'] = time.perf_counter() - start
+mark = time.perf_counter()
+app.preload_modules()
+timings['preload_modules_ms'] = time.perf_counter() - mark
+print(json.dumps({k: round(v * 1000, 1) for k, v in timings.items()}))
+'''
+
+
+def run_python(code, env, extra_args=()):
+    result = subprocess.run([sys.executable, *extra_args, '-c', code], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    return result
+
+
+def import_profile(env, top):
+    """解析 -X importtime 的输出，返回累计耗时最多的顶层模块"""
+    stderr = run_python('import app', env, ['-X', 'importtime']).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        parts = line[len('import time:'):].split('|')
+        try:
+            cumulative = int(parts[1])
+        except ValueError:
+            continue
+        name = parts[2]
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth <= 1:
+            rows.append((cumulative / 1000, name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='测量轮数，取中位数')
+    parser.add_argument('--eager', action='store_true', help='导入后立即创建全部服务')
+    parser.add_argument('--backend', choices=('sqlite', 'hybrid'), default='sqlite', help='存储模式')
+    parser.add_argument('--top', type=int, default=10, help='列出导入最慢的模块数')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='startup-bench-')
+    env = dict(os.environ, PYTHONPATH=ROOT, DATABASE_PATH=os.path.join(tmp_dir, 'startup.db'),
+               SUPABASE_URL='', SUPABASE_KEY='', STORAGE_MODE=args.backend, DASHSCOPE_STUB='1',
+               PYTHONDONTWRITEBYTECODE='')
+    if args.backend == 'hybrid':
+        # 同步线程连不上时只会退避重试，不影响启动耗时
+        env.update(SUPABASE_URL='http://127.0.0.1:9', SUPABASE_KEY='startup', SYNC_INTERVAL='60')
+    run_python(SETUP, env)
+
+    code = MEASURE.replace('EAGER', str(args.eager))
+    runs = [json.loads(run_python(code, env).stdout.strip().splitlines()[-1]) for _ in range(args.runs)]
+
+    print(f'模式: {"导入即创建服务" if args.eager else "按需创建服务"}  存储: {args.backend}  轮数: {args.runs}（中位数）')
+    for key in runs[0]:
+        values = [run[key] for run in runs]
+        print(f'  {key:<20}{statistics.median(values):>10.1f} ms   (min {min(values):.1f}, max {max(values):.1f})')
+    print(f'import app 中累计耗时最多的模块:')
+    for ms, name in import_profile(env, args.top):
+        print(f'  {name:<40}{ms:>10.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
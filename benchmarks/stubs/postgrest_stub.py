@@ -0,0 +1,406 @@
+"""本地 PostgREST 兼容替身服务器
+
+在内存中模拟 Supabase 的 /rest/v1/<table> 接口，供离线压测和调试使用：
+支持 select（含 alias:col->key->0 形式的 JSON 路径）、eq/neq/lt/lte/gt/gte/in 过滤、
+or/and 组合条件、order、limit、批量插入（含 merge / ignore-duplicates 两种 upsert）、
+PATCH、DELETE 以及 rpc/apply_plan_patch、search_plans、sync_id_sequences，
+并模拟 users 表的唯一约束、travel_plans 的级联删除和 expense_summaries 汇总表。
+可以配置固定延迟和随机失败率来验证超时与重试逻辑。
+
+用法：
+    python -m benchmarks.stubs.postgrest_stub --port 54321
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+from utils.plan_patch import apply_patch
+from utils.plan_utils import extract_plan_summary
+
+UNIQUE_COLUMNS = {'users': ('username', 'email')}
+
+
+def _split_top_level(text):
+    parts, depth, current = [], 0, ''
+    for c in text:
+        if c == ',' and depth == 0:
+            parts.append(current)
+            current = ''
+            continue
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        current += c
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _coerce(value, sample):
+    value = value.strip('"')
+    if isinstance(sample, bool):
+        return value == 'true'
+    if isinstance(sample, int):
+        try:
+            return int(value)
+        except ValueError:
+            return value
+    if isinstance(sample, float):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _compare(row_value, op, raw):
+    if op == 'is':
+        return row_value is None if raw == 'null' else row_value == (raw == 'true')
+    if op == 'in':
+        options = [v.strip('"') for v in raw.strip('()').split(',')]
+        return str(row_value) in options
+    if row_value is None:
+        return False
+    value = _coerce(raw, row_value)
+    try:
+        return {
+            'eq': row_value == value, 'neq': row_value != value,
+            'lt': row_value < value, 'lte': row_value <= value,
+            'gt': row_value > value, 'gte': row_value >= value
+        }[op]
+    except TypeError:
+        return False
+
+
+def _match_condition(row, condition):
+    """匹配 col.op.value 或 and(...)/or(...) 形式的条件"""
+    for logic in ('and', 'or'):
+        if condition.startswith(logic + '('):
+            inner = _split_top_level(condition[len(logic) + 1:-1])
+            results = (_match_condition(row, part) for part in inner)
+            return all(results) if logic == 'and' else any(results)
+    column, op, raw = condition.split('.', 2)
+    return _compare(row.get(column), op, raw)
+
+
+def _json_path(row, expression):
+    parts = expression.split('->')
+    value = row.get(parts[0])
+    for part in parts[1:]:
+        part = part.strip("'")
+        if isinstance(value, list) and part.lstrip('-').isdigit():
+            index = int(part)
+            value = value[index] if -len(value) <= index < len(value) else None
+        elif isinstance(value, dict):
+            value = value.get(part)
+        else:
+            value = None
+    return value
+
+
+def _project(row, select):
+    if not select or select == '*':
+        return dict(row)
+    result = {}
+    for column in _split_top_level(select):
+        column = column.strip()
+        if column == '*':
+            result.update(row)
+            continue
+        alias, _, expression = column.rpartition(':')
+        expression = expression or column
+        alias = alias or expression.split('->')[-1]
+        result[alias] = _json_path(row, expression)
+    return result
+
+
+class PostgrestStub:
+    """内存中的表数据"""
+
+    def __init__(self, latency=0.0, fail_rate=0.0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.tables = {}
+        self.sequences = {}
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+    def rows(self, table):
+        if table == 'expense_summaries':
+            return self._expense_summaries()
+        return self.tables.setdefault(table, [])
+
+    def _expense_summaries(self):
+        groups = {}
+        for row in self.tables.get('expenses', []):
+            key = (row['plan_id'], row['category'], row['date'])
+            group = groups.setdefault(key, {
+                'plan_id': row['plan_id'], 'user_id': row['user_id'], 'category': row['category'],
+                'date': row['date'], 'total': 0.0, 'count': 0
+            })
+            group['total'] += float(row['amount'])
+            group['count'] += 1
+        return list(groups.values())
+
+    def filter_rows(self, table, params):
+        rows = self.rows(table)
+        conditions = []
+        for key, value in params:
+            if key in ('select', 'order', 'limit', 'offset', 'on_conflict', 'columns'):
+                continue
+            if key in ('or', 'and'):
+                conditions.append(f'{key}{value}')
+            else:
+                conditions.append(f'{key}.{value}')
+        return [row for row in rows if all(_match_condition(row, c) for c in conditions)]
+
+    def select(self, table, params):
+        options = dict(params)
+        rows = self.filter_rows(table, params)
+        for spec in reversed((options.get('order') or '').split(',')):
+            if not spec:
+                continue
+            column, _, direction = spec.partition('.')
+            rows.sort(key=lambda r: (r.get(column) is None, r.get(column)),
+                      reverse=direction.startswith('desc'))
+        offset = int(options.get('offset', 0))
+        if 'limit' in options:
+            rows = rows[offset:offset + int(options['limit'])]
+        elif offset:
+            rows = rows[offset:]
+        return [_project(row, options.get('select')) for row in rows]
+
+    def insert(self, table, payload, upsert=False, on_conflict='id', ignore_duplicates=False):
+        rows = payload if isinstance(payload, list) else [payload]
+        created = []
+        existing = self.rows(table)
+        for row in rows:
+            row = dict(row)
+            if upsert and row.get(on_conflict) is not None:
+                match = next((r for r in existing if r.get(on_conflict) == row[on_conflict]), None)
+                if match:
+                    if not ignore_duplicates:
+                        match.update(row)
+                        created.append(dict(match))
+                    continue
+            for column in UNIQUE_COLUMNS.get(table, ()):
+                if any(r.get(column) == row.get(column) for r in existing):
+                    raise ValueError(f'duplicate key value violates unique constraint "{table}_{column}_key"')
+            if row.get('id') is None:
+                self.sequences[table] = self.sequences.get(table, 0) + 1
+                row['id'] = self.sequences[table]
+            else:
+                self.sequences[table] = max(self.sequences.get(table, 0), int(row['id']))
+            now = datetime.now(timezone.utc).isoformat()
+            row.setdefault('created_at', now)
+            if table == 'travel_plans':
+                row.setdefault('updated_at', now)
+            existing.append(row)
+            created.append(dict(row))
+        return created
+
+    def update(self, table, params, payload):
+        rows = self.filter_rows(table, params)
+        for row in rows:
+            row.update(payload)
+        return [dict(row) for row in rows]
+
+    def delete(self, table, params):
+        rows = self.filter_rows(table, params)
+        ids = {id(row) for row in rows}
+        self.tables[table] = [row for row in self.rows(table) if id(row) not in ids]
+        if table == 'travel_plans':
+            plan_ids = {row['id'] for row in rows}
+            self.tables['expenses'] = [e for e in self.rows('expenses') if e['plan_id'] not in plan_ids]
+        return [dict(row) for row in rows]
+
+    def rpc(self, name, body):
+        if name == 'apply_plan_patch':
+            return self._apply_plan_patch(body)
+        if name == 'search_plans':
+            return self._search_plans(body)
+        if name == 'sync_id_sequences':
+            # 插入带 id 的行时已经推进了序列
+            return None
+        raise KeyError(name)
+
+    def _apply_plan_patch(self, body):
+        plan = next((r for r in self.rows('travel_plans')
+                     if r['id'] == body['p_plan_id'] and r['user_id'] == body['p_user_id']), None)
+        if plan is None:
+            return False
+        plan['plan_data'] = apply_patch(plan['plan_data'], body['p_ops'])
+        plan.update(extract_plan_summary(plan['plan_data']))
+        plan['title'] = plan['plan_data'].get('destination') or '未命名计划'
+        plan['updated_at'] = datetime.now(timezone.utc).isoformat()
+        return True
+
+    def _search_plans(self, body):
+        """按 supabase_setup.sql 中 search_plans 的语义在内存中检索（相关度只看目的地是否命中）"""
+        patterns = [_like_regex(pattern) for pattern in body.get('p_terms') or []]
+        filters = body.get('p_filters') or {}
+        matched = []
+        for plan in self.rows('travel_plans'):
+            text = f"{plan.get('destination') or ''} {plan.get('search_text') or ''}"
+            if plan['user_id'] == body['p_user_id'] and all(pattern.search(text) for pattern in patterns):
+                matched.append(dict(plan, month=str(plan['created_at'])[:7]))
+
+        def keep(plan):
+            checks = (('min_duration', 'duration', lambda v, f: v >= f), ('max_duration', 'duration', lambda v, f: v <= f),
+                      ('min_budget', 'total_budget', lambda v, f: v >= f), ('max_budget', 'total_budget', lambda v, f: v < f),
+                      ('month', 'month', lambda v, f: v == f))
+            return all(key not in filters or (plan.get(column) is not None and test(plan[column], filters[key]))
+                       for key, column, test in checks)
+
+        filtered = [plan for plan in matched if keep(plan)]
+        for plan in filtered:
+            plan['rank'] = 1 if any(pattern.search(plan.get('destination') or '') for pattern in patterns) else 0
+        filtered.sort(key=lambda plan: (plan['rank'], str(plan['created_at']), plan['id']), reverse=True)
+        offset, limit = body.get('p_offset', 0), body.get('p_limit', 20)
+        columns = ('id', 'title', 'destination', 'duration', 'total_budget', 'day_count',
+                   'created_at', 'updated_at', 'search_text', 'rank')
+        groups = {}
+        for plan in matched:
+            key = (plan.get('duration'), plan.get('total_budget'), plan['month'])
+            groups[key] = groups.get(key, 0) + 1
+        return {
+            'total': len(filtered),
+            'results': [{column: plan.get(column) for column in columns} for plan in filtered[offset:offset + limit]],
+            'facet_groups': [{'duration': d, 'total_budget': b, 'month': m, 'count': n} for (d, b, m), n in groups.items()]
+        }
+
+
+def _like_regex(pattern):
+    """把 ILIKE 模式（反斜杠转义）转换为不区分大小写的正则"""
+    parts = []
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if char == '\\' and index + 1 < len(pattern):
+            parts.append(re.escape(pattern[index + 1]))
+            index += 2
+            continue
+        parts.append('.*' if char == '%' else '.' if char == '_' else re.escape(char))
+        index += 1
+    return re.compile('^' + ''.join(parts) + '$', re.I | re.S)
+
+
+def make_handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _table_and_params(self):
+            parsed = urlparse(self.path)
+            prefix = '/rest/v1/'
+            if not parsed.path.startswith(prefix):
+                return None, []
+            return parsed.path[len(prefix):], parse_qsl(parsed.query, keep_blank_values=True)
+
+        def _body(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            return json.loads(self.rfile.read(length) or b'null') if length else None
+
+        def _send(self, status, payload=None):
+            body = b'' if payload is None else json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _handle(self, method):
+            # 先读完请求体（postgrest-py 的 GET 也会带 {}），保证 keep-alive 连接可复用
+            body = self._body()
+            with stub.lock:
+                stub.request_count += 1
+            if stub.latency:
+                time.sleep(stub.latency)
+            if stub.fail_rate and random.random() < stub.fail_rate:
+                return self._send(503, {'message': 'injected failure'})
+
+            table, params = self._table_and_params()
+            if table is None:
+                return self._send(404, {'message': 'not found'})
+
+            prefer = self.headers.get('Prefer', '')
+            want_rows = 'return=representation' in prefer
+            try:
+                with stub.lock:
+                    if method == 'GET':
+                        return self._send(200, stub.select(table, params))
+                    if method == 'POST' and table.startswith('rpc/'):
+                        return self._send(200, stub.rpc(table[len('rpc/'):], body or {}))
+                    if method == 'POST':
+                        ignore_duplicates = 'resolution=ignore-duplicates' in prefer
+                        upsert = ignore_duplicates or 'resolution=merge-duplicates' in prefer
+                        on_conflict = dict(params).get('on_conflict', 'id')
+                        rows = stub.insert(table, body, upsert=upsert, on_conflict=on_conflict,
+                                           ignore_duplicates=ignore_duplicates)
+                        rows = [_project(r, dict(params).get('select')) for r in rows]
+                        return self._send(201, rows if want_rows else None)
+                    if method == 'PATCH':
+                        rows = stub.update(table, params, body or {})
+                        return self._send(200, rows) if want_rows else self._send(204)
+                    if method == 'DELETE':
+                        rows = stub.delete(table, params)
+                        return self._send(200, rows) if want_rows else self._send(204)
+            except ValueError as e:
+                return self._send(409, {'code': '23505', 'message': str(e)})
+            except KeyError as e:
+                return self._send(404, {'message': f'function {e} not found'})
+            return self._send(405, {'message': 'method not allowed'})
+
+        def do_GET(self):
+            self._handle('GET')
+
+        def do_POST(self):
+            self._handle('POST')
+
+        def do_PATCH(self):
+            self._handle('PATCH')
+
+        def do_DELETE(self):
+            self._handle('DELETE')
+
+    return Handler
+
+
+def start_stub_server(host='127.0.0.1', port=0, latency=0.0, fail_rate=0.0):
+    """在后台线程启动替身服务器，返回 (server, stub, base_url)"""
+    stub = PostgrestStub(latency=latency, fail_rate=fail_rate)
+    server = ThreadingHTTPServer((host, port), make_handler(stub))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stub, f'http://{host}:{server.server_address[1]}'
+
+
+# supabase-py 会校验 key 的格式，替身接受任意值，这里给一个格式合法的假 key
+STUB_KEY = 'eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.c3R1Yg'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=54321)
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的模拟延迟（秒）')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='随机返回 503 的比例')
+    args = parser.parse_args()
+
+    server, _, url = start_stub_server(port=args.port, latency=args.latency, fail_rate=args.fail_rate)
+    print(f'PostgREST 替身已启动: {url}  (SUPABASE_URL={url} SUPABASE_KEY={STUB_KEY})')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
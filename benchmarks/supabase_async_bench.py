@@ -0,0 +1,84 @@
+"""Supabase 同步客户端与异步客户端对比
+
+启动本地 PostgREST 替身（带固定延迟），分别用 SupabaseService 和
+AsyncSupabaseService 处理同样数量的并发 get_user_by_id / get_user_plans 请求，
+输出耗时、实际 HTTP 请求数、被合并的请求数和重试次数。
+
+用法：
+    python -m benchmarks.supabase_async_bench --requests 200 --concurrency 20 --latency 0.02
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.stubs.postgrest_stub import start_stub_server, STUB_KEY  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.02, help='替身每个请求的延迟（秒）')
+    parser.add_argument('--fail-rate', type=float, default=0.05, help='替身随机返回 503 的比例')
+    args = parser.parse_args()
+
+    server, stub, url = start_stub_server(latency=args.latency)
+    os.environ.update({'SUPABASE_URL': url, 'SUPABASE_KEY': STUB_KEY})
+
+    from utils.supabase_service import SupabaseService
+    from utils.async_supabase_service import AsyncSupabaseService
+
+    sync_service = SupabaseService()
+    sync_service.create_user('bench', 'bench@example.com', 'pw')
+    user = sync_service.authenticate_user('bench', 'pw')
+    for i in range(10):
+        sync_service.save_travel_plan(user['id'], {'destination': f'城市{i}', 'itinerary': []})
+
+    def sync_call(i):
+        if i % 2:
+            return sync_service.get_user_by_id(user['id'])
+        return sync_service.get_user_plans(user['id'])
+
+    stub.request_count = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(sync_call, range(args.requests)))
+    sync_elapsed = time.perf_counter() - start
+    sync_http = stub.request_count
+
+    stub.fail_rate = args.fail_rate
+
+    async def run_async():
+        service = AsyncSupabaseService(url=url, key=STUB_KEY, max_retries=3)
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one(i):
+            async with semaphore:
+                if i % 2:
+                    return await service.get_user_by_id(user['id'])
+                return await service.get_user_plans(user['id'])
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(one(i) for i in range(args.requests)))
+        elapsed = time.perf_counter() - start
+        await service.close()
+        return elapsed, service.stats(), sum(1 for r in results if r)
+
+    stub.request_count = 0
+    async_elapsed, stats, ok = asyncio.run(run_async())
+
+    print(f'请求数: {args.requests}  并发: {args.concurrency}  替身延迟: {args.latency * 1000:.0f}ms')
+    print(f'同步客户端: {sync_elapsed:.2f}s  HTTP 请求 {sync_http}')
+    print(f'异步客户端: {async_elapsed:.2f}s  HTTP 请求 {stats["http_requests"]}  '
+          f'合并 {stats["coalesced"]}  重试 {stats["retries"]}（注入失败率 {args.fail_rate:.0%}）  成功 {ok}')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
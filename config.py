@@ -9,20 +9,121 @@ class Config:
     # AI 服务配置 - 通义千问
     DASHSCOPE_API_KEY = os.getenv('DASHSCOPE_API_KEY', '')
     QWEN_MODEL = os.getenv('QWEN_MODEL', 'qwen-plus')  # 可选: qwen-turbo, qwen-plus, qwen-max
+    QWEN_JSON_MODE = os.getenv('QWEN_JSON_MODE', '1') == '1'  # 支持的模型使用 JSON 输出模式
+    AI_ROUTING = os.getenv('AI_ROUTING', '1') == '1'  # 按需求复杂度选择模型；关闭后全部使用 QWEN_MODEL
+    QWEN_MODEL_SIMPLE = os.getenv('QWEN_MODEL_SIMPLE', 'qwen-turbo')  # 短途、单城市等简单需求
+    QWEN_MODEL_COMPLEX = os.getenv('QWEN_MODEL_COMPLEX', QWEN_MODEL)  # 多城市、长行程等复杂需求
+    QWEN_HEDGE_MODEL = os.getenv('QWEN_HEDGE_MODEL', 'qwen-turbo')  # 首选模型超过延迟预算时发起对冲请求的模型，留空不对冲
+    QWEN_FALLBACK_MODELS = os.getenv('QWEN_FALLBACK_MODELS', '')  # 首选模型熔断或满载时依次尝试的模型，逗号分隔
+    AI_HEDGE_AFTER = float(os.getenv('AI_HEDGE_AFTER', '20'))  # 样本不足时的对冲等待时间（秒），之后使用该模型近期 p95
+    AI_MODEL_MAX_CONCURRENCY = int(os.getenv('AI_MODEL_MAX_CONCURRENCY', '4'))  # 每个模型的默认并发上限
+    AI_MODEL_CONCURRENCY = os.getenv('AI_MODEL_CONCURRENCY', '')  # 单独设置并发上限，如 qwen-plus:4,qwen-turbo:8
+    AI_BREAKER_FAILURES = int(os.getenv('AI_BREAKER_FAILURES', '5'))  # 连续失败多少次后熔断
+    AI_BREAKER_RESET = float(os.getenv('AI_BREAKER_RESET', '30'))  # 熔断后多久放行试探请求（秒）
+    AI_MAX_WORKERS = int(os.getenv('AI_MAX_WORKERS', '4'))  # 同时进行的计划生成任务数
+    AI_MAX_PENDING_JOBS = int(os.getenv('AI_MAX_PENDING_JOBS', '100'))  # 排队任务上限，超出后拒绝新请求
+    AI_JOB_TTL = int(os.getenv('AI_JOB_TTL', '3600'))  # 已完成任务结果保留时间（秒）
+    AI_JOB_SHARED_PATH = os.getenv('AI_JOB_SHARED_PATH', '')  # 多 worker 共享任务状态的本地 SQLite 文件，留空则只保存在进程内
+    PLAN_CACHE_BACKEND = os.getenv('PLAN_CACHE_BACKEND', 'memory')  # 计划缓存存储: memory, sqlite, off
+    PLAN_CACHE_SIZE = int(os.getenv('PLAN_CACHE_SIZE', '1000'))  # 最多缓存的计划数
+    PLAN_CACHE_TTL = int(os.getenv('PLAN_CACHE_TTL', str(7 * 24 * 3600)))  # 缓存有效期（秒）
+    BUDGET_BATCH_SIZE = int(os.getenv('BUDGET_BATCH_SIZE', '8'))  # 预算分析时每次模型请求合并的计划数
+    BUDGET_MAX_PLANS = int(os.getenv('BUDGET_MAX_PLANS', '50'))  # 一次预算分析请求最多包含的计划数
+    BUDGET_CACHE_SIZE = int(os.getenv('BUDGET_CACHE_SIZE', '5000'))  # 缓存的预算建议数
+    BUDGET_CACHE_TTL = int(os.getenv('BUDGET_CACHE_TTL', str(24 * 3600)))  # 预算建议缓存时间（秒）
+    BUDGET_WARN_RATIO = float(os.getenv('BUDGET_WARN_RATIO', '0.8'))  # 花费达到预算的该比例时标记为 warning
+    PLAN_COST_TOLERANCE = float(os.getenv('PLAN_COST_TOLERANCE', '0.1'))  # 分项费用超出预算拆分多少比例时标记为不一致
+    DASHSCOPE_STUB = os.getenv('DASHSCOPE_STUB', '') == '1'  # 使用本地替身代替 DashScope（离线压测）
+    DASHSCOPE_STUB_LATENCY = float(os.getenv('DASHSCOPE_STUB_LATENCY', '2.0'))  # 替身模拟的响应耗时（秒）
     
     # 科大讯飞语音识别配置
     XFYUN_APP_ID = os.getenv('XFYUN_APP_ID', '')
     XFYUN_API_KEY = os.getenv('XFYUN_API_KEY', '')
     XFYUN_API_SECRET = os.getenv('XFYUN_API_SECRET', '')
+    VOICE_SIGN_WINDOW = int(os.getenv('VOICE_SIGN_WINDOW', '60'))  # 语音中转连接讯飞时预签名 URL 的复用窗口（秒），窗口内不重复计算签名
+    VOICE_RELAY_ENABLED = os.getenv('VOICE_RELAY_ENABLED', '') == '1'  # 启用服务端音频中转（浏览器不支持语音识别时使用；会话保存在进程内，只支持 WEB_WORKERS=1）
+    VOICE_RECOGNIZER = os.getenv('VOICE_RECOGNIZER', 'xfyun')  # 中转使用的识别器：xfyun / echo（本地替身，测试用）
+    VOICE_MAX_SESSIONS = int(os.getenv('VOICE_MAX_SESSIONS', '20'))  # 每个进程同时进行的中转会话上限
+    VOICE_QUEUE_CHUNKS = int(os.getenv('VOICE_QUEUE_CHUNKS', '32'))  # 每个会话待转发的音频分片上限
+    VOICE_PUT_TIMEOUT = float(os.getenv('VOICE_PUT_TIMEOUT', '2'))  # 音频队列已满时上传请求最多等待的秒数
+    VOICE_MAX_CHUNK_BYTES = int(os.getenv('VOICE_MAX_CHUNK_BYTES', str(64 * 1024)))  # 单个音频分片的大小上限
+    VOICE_IDLE_TIMEOUT = int(os.getenv('VOICE_IDLE_TIMEOUT', '30'))  # 会话超过该秒数没有收到音频则结束
     
     # 高德地图配置（Web 端 JS API）
     AMAP_API_KEY = os.getenv('AMAP_API_KEY', '')
     AMAP_SECRET_KEY = os.getenv('AMAP_SECRET_KEY', '')
+
+    # 服务端地理编码：保存计划时解析地点坐标并写入计划
+    AMAP_WEB_KEY = os.getenv('AMAP_WEB_KEY', '')  # 高德 Web 服务 key（与 JS API key 不是同一种）
+    GEOCODER = os.getenv('GEOCODER', '')  # amap / fixture / none，留空时有 AMAP_WEB_KEY 则用 amap
+    GEOCODE_FIXTURE_PATH = os.getenv('GEOCODE_FIXTURE_PATH', '')  # fixture 地理编码器的数据文件，留空用内置样例
+    GEOCODE_FIXTURE_SYNTHESIZE = os.getenv('GEOCODE_FIXTURE_SYNTHESIZE', '') == '1'  # 未收录的地点在所在城市附近生成固定坐标（离线压测）
+    GEOCODE_CACHE_PATH = os.getenv('GEOCODE_CACHE_PATH', '')  # 坐标缓存所在的 SQLite 文件，留空与 DATABASE_PATH 相同
+    GEOCODE_CACHE_TTL = int(os.getenv('GEOCODE_CACHE_TTL', str(30 * 86400)))  # 坐标缓存时间（秒）
+    GEOCODE_MISS_TTL = int(os.getenv('GEOCODE_MISS_TTL', '86400'))  # 查无此地的缓存时间（秒）
+    GEOCODE_TIMEOUT = float(os.getenv('GEOCODE_TIMEOUT', '3'))  # 单次高德请求超时（秒）
     
     # Supabase 配置（云端数据同步）
     SUPABASE_URL = os.getenv('SUPABASE_URL', '')
     SUPABASE_KEY = os.getenv('SUPABASE_KEY', '')
     USE_SUPABASE = bool(SUPABASE_URL and SUPABASE_KEY)
+    SUPABASE_ASYNC = os.getenv('SUPABASE_ASYNC', '') == '1'  # 使用异步 HTTP 客户端（连接池、请求合并、重试）
+    SUPABASE_TIMEOUT = float(os.getenv('SUPABASE_TIMEOUT', '5.0'))  # 单次请求超时（秒）
+    SUPABASE_MAX_RETRIES = int(os.getenv('SUPABASE_MAX_RETRIES', '2'))  # 网络错误、429、5xx 的最大重试次数（插入等不幂等的 POST 只在请求未发出时重试）
+    SUPABASE_MAX_CONNECTIONS = int(os.getenv('SUPABASE_MAX_CONNECTIONS', '20'))  # HTTP 连接池大小
+    STORAGE_MODE = os.getenv('STORAGE_MODE', 'supabase' if USE_SUPABASE else 'sqlite')  # 存储模式: sqlite, supabase, hybrid（本地读写 + 后台同步到云端）
+    SYNC_BATCH_SIZE = int(os.getenv('SYNC_BATCH_SIZE', '200'))  # 每批推送到云端的变更数
+    SYNC_INTERVAL = float(os.getenv('SYNC_INTERVAL', '2.0'))  # 同步间隔（秒），失败时指数退避
+    SYNC_MAX_ATTEMPTS = int(os.getenv('SYNC_MAX_ATTEMPTS', '10'))  # 超过次数的变更不再重试，留在日志中待排查
+    
+    # 用户身份缓存（Flask-Login 每个请求都要加载用户）
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+    USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '300'))  # 进程内缓存有效期（秒），多 worker 部署建议调小
+    USER_CACHE_SHARED_PATH = os.getenv('USER_CACHE_SHARED_PATH', '')  # 多 worker 共享的本地 SQLite 缓存文件，留空则不启用
+    USER_CACHE_SHARED_TTL = int(os.getenv('USER_CACHE_SHARED_TTL', '600'))
+    
+    # 密码哈希与登录限流（成本参数可用 benchmarks/password_cost.py 在目标机器上选取）
+    PASSWORD_SCRYPT_N = int(os.getenv('PASSWORD_SCRYPT_N', str(2 ** 14)))  # CPU/内存成本，必须是 2 的幂；内存占用约 128 * N * R 字节
+    PASSWORD_SCRYPT_R = int(os.getenv('PASSWORD_SCRYPT_R', '8'))  # 块大小
+    PASSWORD_SCRYPT_P = int(os.getenv('PASSWORD_SCRYPT_P', '1'))  # 并行度
+    PASSWORD_HASH_EXECUTOR = os.getenv('PASSWORD_HASH_EXECUTOR', 'thread')  # 哈希计算池: thread, process
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '0'))  # 计算池大小，0 表示 CPU 核数
+    PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', '64'))  # 排队加执行中的任务上限，超出返回 503
+    LOGIN_RATE_IP_BURST = int(os.getenv('LOGIN_RATE_IP_BURST', '20'))  # 同一 IP 可连续尝试的次数
+    LOGIN_RATE_IP_PER_MINUTE = float(os.getenv('LOGIN_RATE_IP_PER_MINUTE', '10'))  # 同一 IP 每分钟恢复的次数
+    LOGIN_RATE_USER_BURST = int(os.getenv('LOGIN_RATE_USER_BURST', '5'))  # 同一用户名可连续尝试的次数
+    LOGIN_RATE_USER_PER_MINUTE = float(os.getenv('LOGIN_RATE_USER_PER_MINUTE', '2'))  # 同一用户名每分钟恢复的次数
     
     # 数据库配置
-    DATABASE_PATH = 'travel_planner.db'
+    DATABASE_PATH = os.getenv('DATABASE_PATH', 'travel_planner.db')
+    PLANS_PAGE_SIZE = int(os.getenv('PLANS_PAGE_SIZE', '20'))  # 计划列表默认每页条数
+    PLANS_PAGE_MAX = int(os.getenv('PLANS_PAGE_MAX', '100'))  # 计划列表每页条数上限
+    SEARCH_MAX_OFFSET = int(os.getenv('SEARCH_MAX_OFFSET', '1000'))  # 计划检索最多翻到的位置
+    EXPENSE_BATCH_MAX = int(os.getenv('EXPENSE_BATCH_MAX', '200'))  # 批量记账接口单次最多条数
+    SQLITE_POOL_SIZE = int(os.getenv('SQLITE_POOL_SIZE', '8'))  # 连接池最多保留的空闲连接数
+    SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', '8192'))  # 每个连接的页缓存大小
+    SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(64 * 1024 * 1024)))  # 内存映射 I/O 大小（字节）
+    SQLITE_STATEMENT_CACHE = int(os.getenv('SQLITE_STATEMENT_CACHE', '128'))  # 每个连接缓存的预编译语句数
+    PLAN_DETAIL_CACHE_SIZE = int(os.getenv('PLAN_DETAIL_CACHE_SIZE', '512'))  # 进程内缓存的已解析计划数
+    PLAN_DETAIL_CACHE_TTL = int(os.getenv('PLAN_DETAIL_CACHE_TTL', '300'))  # 多进程部署时其他进程的修改最迟在此时间后可见
+    
+    # 生产部署（gunicorn.conf.py）
+    WEB_BIND = os.getenv('WEB_BIND', '0.0.0.0:5000')
+    WEB_WORKERS = int(os.getenv('WEB_WORKERS', '0'))  # worker 进程数，0 表示 CPU 核数 * 2 + 1（最多 8）
+    WEB_THREADS = int(os.getenv('WEB_THREADS', '8'))  # 每个 worker 的线程数，SSE 长连接各占一个线程
+    WEB_TIMEOUT = int(os.getenv('WEB_TIMEOUT', '120'))  # 请求超时（秒），需大于流式生成计划的耗时
+    WEB_MAX_REQUESTS = int(os.getenv('WEB_MAX_REQUESTS', '0'))  # worker 处理多少请求后重启，0 表示不重启
+    
+    # 静态资源与响应压缩
+    ASSET_MAX_AGE = int(os.getenv('ASSET_MAX_AGE', str(365 * 24 * 3600)))  # 带哈希的静态资源缓存时间（秒）
+    COMPRESS_JSON = os.getenv('COMPRESS_JSON', '1') == '1'  # gzip 压缩较大的 JSON 响应
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))  # 小于该字节数的响应不压缩
+    COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', '6'))  # gzip 压缩级别，越高越省流量但越耗 CPU
+    
+    # 性能指标与慢请求采样
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'  # 记录请求、数据库和大模型调用指标，并开放 /metrics
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')  # 设置后抓取 /metrics 需要带 Authorization: Bearer <token>
+    PROFILE_SLOW_REQUEST_MS = float(os.getenv('PROFILE_SLOW_REQUEST_MS', '0'))  # 超过该耗时的请求保存采样堆栈，0 表示不采样
+    PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))  # 采样间隔（毫秒）
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')  # 堆栈文件目录（collapsed 格式，可直接生成火焰图）
+    PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '200'))  # 最多保留的堆栈文件数
@@ -0,0 +1,44 @@
+"""gunicorn 配置
+
+预加载应用时只导入模块（服务对象在首次使用时才创建），主进程中初始化一次数据库表
+并构建静态资源，然后 fork 出 worker；数据库连接、HTTP 客户端和后台线程都在各 worker 中重新创建。
+计划生成的 SSE 接口会长时间占用连接，因此使用 gthread 线程 worker。
+"""
+import multiprocessing
+import os
+
+# 多个 worker 时轮询任务状态的请求可能落到其他进程，默认让任务状态经本地 SQLite 文件共享
+os.environ.setdefault('AI_JOB_SHARED_PATH', 'jobs.db')
+
+from config import Config  # noqa: E402
+
+wsgi_app = 'wsgi:app'
+bind = Config.WEB_BIND
+workers = Config.WEB_WORKERS or min(multiprocessing.cpu_count() * 2 + 1, 8)
+worker_class = 'gthread'
+threads = Config.WEB_THREADS
+timeout = Config.WEB_TIMEOUT
+graceful_timeout = 30
+keepalive = 5
+preload_app = True
+max_requests = Config.WEB_MAX_REQUESTS
+max_requests_jitter = max_requests // 10
+
+if Config.VOICE_RELAY_ENABLED and workers != 1:
+    # 中转会话保存在进程内，上传音频和读取事件的请求可能落到其他 worker，只能在单 worker 部署中启用；
+    # 在预加载应用之前修改，fork 出的 worker 和 /api/voice-config 都会看到中转已关闭
+    print(f"VOICE_RELAY_ENABLED 需要 WEB_WORKERS=1（当前 {workers} 个 worker），已关闭服务端音频中转")
+    Config.VOICE_RELAY_ENABLED = False
+
+
+def on_starting(server):
+    # 只在主进程中执行一次，此时还没有 fork
+    import app
+    app.preload_modules()
+    app.init_storage()
+    app.build_static_assets()
+
+
+def post_fork(server, worker):
+    # 父进程中创建的服务对象和连接已由 os.register_at_fork 丢弃，这里只记录日志
+    server.log.info(f'worker {worker.pid} 已启动，服务将在首次请求时创建')
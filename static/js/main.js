@@ -1,12 +1,31 @@
 let currentPlanId = null;
+let currentPlanData = null;
+let currentCostSummary = null;
 let map = null;
 let recognition = null;
+let relayRecorder = null;
+const VOICE_SEND_INTERVAL = 200;
+let plansCursor = null;
+const PLANS_PAGE_SIZE = 20;
+const EXPENSE_QUEUE_KEY = 'expenseQueue';
+const EXPENSE_BATCH_SIZE = 50;
+const EXPENSE_FLUSH_DELAY = 2000;
+const EXPENSE_RETRY_DELAY = 10000;
+let expenseFlushTimer = null;
+let expenseFlushing = false;
+const SEARCH_DELAY = 300;
+let searchTimer = null;
+let searchOffset = null;
+let searchFilters = {};
 
 // 初始化
 document.addEventListener('DOMContentLoaded', () => {
     loadMyPlans();
     initVoiceRecognition();
     setupEventListeners();
+    // 提交上次离线时排队的费用
+    flushExpenseQueue();
+    window.addEventListener('online', flushExpenseQueue);
 });
 
 function setupEventListeners() {
@@ -15,30 +34,140 @@ function setupEventListeners() {
     document.getElementById('newPlanBtn').addEventListener('click', showInputSection);
     document.getElementById('backBtn').addEventListener('click', showInputSection);
     document.getElementById('expenseForm').addEventListener('submit', addExpense);
+    document.getElementById('planSearch').addEventListener('input', () => {
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(() => refreshPlans(), SEARCH_DELAY);
+    });
+}
+
+// 有检索词或筛选条件时检索，否则显示完整列表
+function refreshPlans() {
+    const query = document.getElementById('planSearch').value.trim();
+    if (query || Object.keys(searchFilters).length) {
+        searchPlans(true);
+    } else {
+        document.getElementById('planFacets').innerHTML = '';
+        loadMyPlans();
+    }
+}
+
+function renderPlanItem(plan) {
+    const planItem = document.createElement('div');
+    planItem.className = 'plan-item';
+    planItem.innerHTML = `
+        <div class="plan-item-content" onclick="loadPlan(${plan.id})">
+            <h4>${plan.title}</h4>
+            <small>${new Date(plan.created_at).toLocaleDateString()}${plan.duration ? ` · ${plan.duration}天` : ''}${plan.total_budget ? ` · ¥${plan.total_budget}` : ''}</small>
+            ${plan.snippet ? `<small class="snippet">${plan.snippet}</small>` : ''}
+        </div>
+        <button class="btn-delete" onclick="deletePlan(event, ${plan.id})" title="删除计划">🗑️</button>
+    `;
+    return planItem;
+}
+
+function appendLoadMore(plansList, onClick) {
+    const moreBtn = document.createElement('button');
+    moreBtn.id = 'loadMorePlans';
+    moreBtn.className = 'btn btn-secondary btn-block';
+    moreBtn.textContent = '加载更多';
+    moreBtn.addEventListener('click', onClick);
+    plansList.appendChild(moreBtn);
+}
+
+// 检索计划（服务端全文索引，只返回摘要），reset 为 false 时追加下一页
+async function searchPlans(reset = true) {
+    if (reset) {
+        searchOffset = 0;
+    }
+    
+    try {
+        const params = new URLSearchParams({
+            q: document.getElementById('planSearch').value.trim(),
+            limit: PLANS_PAGE_SIZE,
+            offset: searchOffset,
+            ...searchFilters
+        });
+        const response = await fetch(`/api/search?${params}`);
+        const data = await response.json();
+        if (!data.success) return;
+        
+        const plansList = document.getElementById('plansList');
+        if (reset) {
+            plansList.innerHTML = data.results.length ? '' : '<p><small>没有找到匹配的计划</small></p>';
+        }
+        const oldMoreBtn = document.getElementById('loadMorePlans');
+        if (oldMoreBtn) {
+            oldMoreBtn.remove();
+        }
+        data.results.forEach(plan => plansList.appendChild(renderPlanItem(plan)));
+        renderFacets(data.facets);
+        
+        searchOffset = data.next_offset;
+        if (searchOffset !== null) {
+            appendLoadMore(plansList, () => searchPlans(false));
+        }
+    } catch (error) {
+        console.error('检索计划失败:', error);
+    }
 }
 
-// 加载我的计划列表
-async function loadMyPlans() {
+const FACET_LABELS = {duration: '天数', budget: '预算', month: '月份'};
+
+// 分面：点击切换筛选条件
+function renderFacets(facets) {
+    const container = document.getElementById('planFacets');
+    container.innerHTML = Object.entries(facets)
+        .filter(([, buckets]) => buckets.length)
+        .map(([facet, buckets]) => `
+            <div>${FACET_LABELS[facet]}：${buckets.map(bucket => `
+                <span class="facet ${searchFilters[facet] === bucket.key ? 'active' : ''}"
+                      data-facet="${facet}" data-key="${bucket.key}">${bucket.key} (${bucket.count})</span>
+            `).join('')}</div>
+        `).join('');
+    container.querySelectorAll('.facet').forEach(element => {
+        element.addEventListener('click', () => {
+            const {facet, key} = element.dataset;
+            if (searchFilters[facet] === key) {
+                delete searchFilters[facet];
+            } else {
+                searchFilters[facet] = key;
+            }
+            refreshPlans();
+        });
+    });
+}
+
+// 加载我的计划列表（分页，reset 为 false 时追加下一页）
+async function loadMyPlans(reset = true) {
+    if (reset) {
+        plansCursor = null;
+    }
+    
     try {
-        const response = await fetch('/api/my-plans');
+        const params = new URLSearchParams({limit: PLANS_PAGE_SIZE});
+        if (plansCursor) {
+            params.set('cursor', plansCursor);
+        }
+        const response = await fetch(`/api/my-plans?${params}`);
         const data = await response.json();
         
         if (data.success) {
             const plansList = document.getElementById('plansList');
-            plansList.innerHTML = '';
+            if (reset) {
+                plansList.innerHTML = '';
+            }
             
-            data.plans.forEach(plan => {
-                const planItem = document.createElement('div');
-                planItem.className = 'plan-item';
-                planItem.innerHTML = `
-                    <div class="plan-item-content" onclick="loadPlan(${plan.id})">
-                        <h4>${plan.title}</h4>
-                        <small>${new Date(plan.created_at).toLocaleDateString()}</small>
-                    </div>
-                    <button class="btn-delete" onclick="deletePlan(event, ${plan.id})" title="删除计划">🗑️</button>
-                `;
-                plansList.appendChild(planItem);
-            });
+            const oldMoreBtn = document.getElementById('loadMorePlans');
+            if (oldMoreBtn) {
+                oldMoreBtn.remove();
+            }
+            
+            data.plans.forEach(plan => plansList.appendChild(renderPlanItem(plan)));
+            
+            plansCursor = data.next_cursor;
+            if (plansCursor) {
+                appendLoadMore(plansList, () => loadMyPlans(false));
+            }
         }
     } catch (error) {
         console.error('加载计划失败:', error);
@@ -58,20 +187,18 @@ async function generatePlan() {
     generateBtn.textContent = '生成中...';
 
     try {
-        const response = await fetch('/api/generate-plan', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({input: userInput})
-        });
-
-        const data = await response.json();
+        // 支持 SSE 的浏览器边生成边显示，否则提交后台任务并轮询
+        const data = window.EventSource
+            ? await streamPlan(userInput)
+            : await submitPlanJob(userInput);
         
         if (data.success) {
             currentPlanId = data.plan_id;
-            displayPlan(data.plan);
-            loadMyPlans();
+            displayPlan(data.plan, data.cost_summary);
+            loadExpenseSummary();
+            refreshPlans();
         } else {
-            alert('生成计划失败，请重试');
+            alert(data.message || '生成计划失败，请重试');
         }
     } catch (error) {
         console.error('生成计划错误:', error);
@@ -82,6 +209,77 @@ async function generatePlan() {
     }
 }
 
+// 通过 SSE 流式生成计划，逐天渲染已完成的行程
+function streamPlan(userInput) {
+    return new Promise((resolve, reject) => {
+        const partialPlan = {itinerary: [], accommodation: []};
+        const source = new EventSource(`/api/generate-plan/stream?input=${encodeURIComponent(userInput)}`);
+        let finished = false;
+        
+        showPlanSection();
+        clearPlanDetails();
+        
+        source.addEventListener('field', (e) => {
+            const event = JSON.parse(e.data);
+            partialPlan[event.key] = event.value;
+            if (event.key === 'destination') {
+                document.getElementById('planTitle').textContent = event.value;
+            }
+        });
+        source.addEventListener('itinerary', (e) => {
+            partialPlan.itinerary.push(JSON.parse(e.data).data);
+            renderItinerary(partialPlan);
+        });
+        source.addEventListener('accommodation', (e) => {
+            partialPlan.accommodation.push(JSON.parse(e.data).data);
+            renderAccommodation(partialPlan);
+        });
+        source.addEventListener('done', (e) => {
+            finished = true;
+            source.close();
+            const data = JSON.parse(e.data);
+            resolve({success: true, plan: data.plan, plan_id: data.plan_id, cost_summary: data.cost_summary});
+        });
+        source.onerror = () => {
+            if (finished) return;
+            source.close();
+            reject(new Error('计划流连接中断'));
+        };
+    });
+}
+
+// 提交后台生成任务并等待结果
+async function submitPlanJob(userInput) {
+    const response = await fetch('/api/generate-plan', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({input: userInput})
+    });
+
+    const job = await response.json();
+    if (!job.success) {
+        return job;
+    }
+    
+    return await waitForPlanJob(job.job_id);
+}
+
+// 轮询计划生成任务，直到完成或失败
+async function waitForPlanJob(jobId) {
+    let delay = 1000;
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, delay));
+        const response = await fetch(`/api/generate-plan/${jobId}`);
+        const data = await response.json();
+        
+        if (!data.success || data.status === 'done') {
+            return data;
+        }
+        // 逐步放慢轮询频率，最长 3 秒一次
+        delay = Math.min(delay * 1.5, 3000);
+    }
+}
+
 // 加载特定计划
 async function loadPlan(planId) {
     try {
@@ -90,21 +288,45 @@ async function loadPlan(planId) {
         
         if (data.success) {
             currentPlanId = planId;
-            displayPlan(data.plan.plan_data);
+            displayPlan(data.plan.plan_data, data.plan.cost_summary);
+            loadExpenseSummary();
         }
     } catch (error) {
         console.error('加载计划失败:', error);
     }
 }
 
-// 显示计划
-function displayPlan(plan) {
-    document.getElementById('inputSection').style.display = 'none';
-    document.getElementById('planSection').style.display = 'block';
+// 显示计划；costSummary 为保存时预先计算的费用摘要
+function displayPlan(plan, costSummary = null) {
+    currentPlanData = plan;
+    currentCostSummary = costSummary;
+    showPlanSection();
     
     document.getElementById('planTitle').textContent = plan.destination || '旅行计划';
     
-    // 显示预算摘要
+    renderBudget(plan);
+    renderItinerary(plan);
+    renderAccommodation(plan);
+    renderTips(plan);
+    
+    // 初始化地图并显示行程路线
+    initMapWithItinerary(plan);
+}
+
+function showPlanSection() {
+    document.getElementById('inputSection').style.display = 'none';
+    document.getElementById('planSection').style.display = 'block';
+}
+
+function clearPlanDetails() {
+    document.getElementById('planTitle').textContent = '旅行计划';
+    ['budgetSummary', 'itinerary', 'accommodation', 'tips'].forEach(id => {
+        document.getElementById(id).innerHTML = '';
+    });
+}
+
+// 显示预算摘要
+function renderBudget(plan) {
     if (plan.budget_breakdown) {
         const budgetHtml = `
             <h3>预算概览</h3>
@@ -117,19 +339,49 @@ function displayPlan(plan) {
                 <li>购物：¥${plan.budget_breakdown.shopping || 0}</li>
                 <li>应急：¥${plan.budget_breakdown.emergency || 0}</li>
             </ul>
+            ${renderCostSummary(currentCostSummary)}
         `;
         document.getElementById('budgetSummary').innerHTML = budgetHtml;
     }
-    
-    // 显示行程
+}
+
+// 行程中列出的费用合计，以及与预算拆分不一致的地方
+const COST_ISSUE_MESSAGES = {
+    missing_breakdown: () => '计划缺少预算拆分',
+    category_exceeds_budget: (issue) => `${BUDGET_CATEGORY_NAMES[issue.category]}：行程费用 ¥${issue.itemized} 超出预算 ¥${issue.budgeted}`,
+    category_not_budgeted: (issue) => `${BUDGET_CATEGORY_NAMES[issue.category]}：行程费用 ¥${issue.itemized} 未列入预算`,
+    breakdown_total_mismatch: (issue) => `各项预算之和 ¥${issue.sum} 与总预算 ¥${issue.total} 不符`,
+    itemized_exceeds_total: (issue) => `行程费用合计 ¥${issue.itemized} 超出总预算 ¥${issue.total}`,
+    breakdown_exceeds_requested_budget: (issue) => `总预算 ¥${issue.total} 超出期望预算 ¥${issue.requested}`
+};
+
+function renderCostSummary(summary) {
+    if (!summary) return '';
+    const issues = (summary.issues || [])
+        .filter(issue => COST_ISSUE_MESSAGES[issue.type])
+        .map(issue => `<li>${COST_ISSUE_MESSAGES[issue.type](issue)}</li>`);
+    return `
+        <p><strong>行程费用合计：</strong>¥${summary.total}（${summary.item_count} 项）</p>
+        ${issues.length ? `<p><strong>⚠️ 预算不一致：</strong></p><ul>${issues.join('')}</ul>` : ''}
+    `;
+}
+
+// 显示行程
+function renderItinerary(plan) {
     if (plan.itinerary) {
         let itineraryHtml = '<h3>行程安排</h3>';
-        plan.itinerary.forEach(day => {
+        // 已保存的计划可以单独重新安排某一天
+        const editable = currentPlanId && plan === currentPlanData;
+        const dayTotals = editable && currentCostSummary ? currentCostSummary.by_day : [];
+        plan.itinerary.forEach((day, index) => {
             itineraryHtml += `
                 <div class="day-item">
-                    <h4>第 ${day.day} 天 ${day.date || ''}</h4>
+                    <h4>第 ${day.day} 天 ${day.date || ''}
+                        ${dayTotals[index] !== undefined ? `<small>当日 ¥${dayTotals[index]}</small>` : ''}
+                        ${editable ? `<button class="btn btn-secondary btn-small" onclick="regenerateDay(${index})">重新安排</button>` : ''}
+                    </h4>
                     <ul>
-                        ${day.activities.map(act => `
+                        ${(day.activities || []).map(act => `
                             <li>
                                 <strong>${act.time}</strong> - ${act.activity}
                                 <br><small>📍 ${act.location} | ¥${act.cost || 0}</small>
@@ -142,8 +394,38 @@ function displayPlan(plan) {
         });
         document.getElementById('itinerary').innerHTML = itineraryHtml;
     }
+}
+
+// 只重新生成某一天，服务端局部更新计划后返回新的当天行程
+async function regenerateDay(dayIndex) {
+    const instructions = prompt('想怎么调整这一天？（可留空）', '');
+    if (instructions === null) return;
     
-    // 显示住宿
+    try {
+        const response = await fetch(`/api/plan/${currentPlanId}/regenerate-day`, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({day_index: dayIndex, instructions: instructions})
+        });
+        const data = await response.json();
+        
+        if (data.success) {
+            currentPlanData.itinerary[dayIndex] = data.day;
+            currentCostSummary = data.cost_summary;
+            renderBudget(currentPlanData);
+            renderItinerary(currentPlanData);
+            initMapWithItinerary(currentPlanData);
+        } else {
+            alert(data.message || '重新安排失败，请重试');
+        }
+    } catch (error) {
+        console.error('重新安排行程错误:', error);
+        alert('重新安排失败，请检查网络连接');
+    }
+}
+
+// 显示住宿
+function renderAccommodation(plan) {
     if (plan.accommodation) {
         let accommodationHtml = '<h3>住宿安排</h3><ul>';
         plan.accommodation.forEach(hotel => {
@@ -157,8 +439,10 @@ function displayPlan(plan) {
         accommodationHtml += '</ul>';
         document.getElementById('accommodation').innerHTML = accommodationHtml;
     }
-    
-    // 显示建议
+}
+
+// 显示建议
+function renderTips(plan) {
     if (plan.tips) {
         let tipsHtml = '<h3>旅行建议</h3><ul>';
         plan.tips.forEach(tip => {
@@ -167,9 +451,6 @@ function displayPlan(plan) {
         tipsHtml += '</ul>';
         document.getElementById('tips').innerHTML = tipsHtml;
     }
-    
-    // 初始化地图并显示行程路线
-    initMapWithItinerary(plan);
 }
 
 // 初始化地图并显示行程路线
@@ -205,6 +486,7 @@ function initMapWithItinerary(plan) {
                         locations.push({
                             name: activity.activity,
                             location: activity.location,
+                            lnglat: activity.lnglat,
                             time: activity.time,
                             day: day.day,
                             cost: activity.cost,
@@ -223,6 +505,7 @@ function initMapWithItinerary(plan) {
                 locations.push({
                     name: hotel.name,
                     location: hotel.location,
+                    lnglat: hotel.lnglat,
                     type: 'hotel',
                     cost: hotel.cost,
                     nights: hotel.nights
@@ -233,106 +516,136 @@ function initMapWithItinerary(plan) {
     
     console.log('提取的位置信息:', locations);
     
+    if (plan.center) {
+        map.setCenter(plan.center);
+    }
+    
     // 如果有具体景点，逐个标记
     if (locations.length > 0) {
         geocodeAndMarkLocations(locations, destination);
+    } else if (plan.center) {
+        addDestinationMarker(destination, plan.center);
     } else {
         // 如果没有具体景点，只标记目的地
         geocodeDestination(destination);
     }
 }
 
-// 地理编码并标记所有位置
+// 标记所有位置：服务端已解析的坐标直接使用，其余地点再由浏览器地理编码
 function geocodeAndMarkLocations(locations, cityName) {
+    const markers = [];
+    const positions = new Array(locations.length).fill(null);
+    const pending = [];
+    
+    locations.forEach((loc, index) => {
+        if (loc.lnglat) {
+            positions[index] = loc.lnglat;
+            markers.push(addLocationMarker(loc, index, loc.lnglat));
+        } else {
+            pending.push(index);
+        }
+    });
+    
+    // 所有位置处理完成后，按行程顺序调整视野并绘制路线
+    const finish = () => {
+        const bounds = positions.filter(position => position);
+        if (bounds.length > 0) {
+            map.setFitView(markers, false, [50, 50, 50, 50]);
+            
+            // 如果有多个点，绘制路线
+            if (bounds.length > 1) {
+                drawRoute(bounds);
+            }
+        } else {
+            // 如果所有编码都失败，尝试搜索目的地
+            geocodeDestination(cityName);
+        }
+    };
+    
+    if (pending.length === 0) {
+        finish();
+        return;
+    }
+    
     const geocoder = new AMap.Geocoder({
         city: cityName
     });
-    
-    const markers = [];
-    const bounds = [];
     let completedCount = 0;
     
-    locations.forEach((loc, index) => {
-        // 尝试地理编码
+    pending.forEach(index => {
+        const loc = locations[index];
         geocoder.getLocation(loc.location, function(status, result) {
             completedCount++;
             
             if (status === 'complete' && result.info === 'OK' && result.geocodes.length > 0) {
                 const position = result.geocodes[0].location;
-                bounds.push([position.lng, position.lat]);
-                
-                // 根据类型选择图标颜色
-                let iconColor = loc.type === 'hotel' ? '#FF6B6B' : '#4ECDC4';
-                let label = loc.type === 'hotel' ? '🏨' : `${index + 1}`;
-                
-                // 创建标记
-                const marker = new AMap.Marker({
-                    position: [position.lng, position.lat],
-                    title: loc.name,
-                    label: {
-                        content: `<div style="background:${iconColor};color:white;padding:4px 8px;border-radius:12px;font-weight:bold;">${label}</div>`,
-                        offset: new AMap.Pixel(0, -30)
-                    },
-                    map: map
-                });
-                
-                // 创建信息窗体
-                let content = `
-                    <div style="padding:12px;min-width:200px;">
-                        <h4 style="margin:0 0 8px 0;color:#333;">${loc.name}</h4>
-                        <p style="margin:4px 0;color:#666;"><strong>📍 位置：</strong>${loc.location}</p>
-                `;
-                
-                if (loc.day) {
-                    content += `<p style="margin:4px 0;color:#666;"><strong>📅 第 ${loc.day} 天</strong></p>`;
-                }
-                if (loc.time) {
-                    content += `<p style="margin:4px 0;color:#666;"><strong>🕐 时间：</strong>${loc.time}</p>`;
-                }
-                if (loc.cost) {
-                    content += `<p style="margin:4px 0;color:#666;"><strong>💰 费用：</strong>¥${loc.cost}</p>`;
-                }
-                if (loc.nights) {
-                    content += `<p style="margin:4px 0;color:#666;"><strong>🌙 住宿：</strong>${loc.nights} 晚</p>`;
-                }
-                if (loc.notes) {
-                    content += `<p style="margin:4px 0;color:#999;font-size:12px;">${loc.notes}</p>`;
-                }
-                
-                content += '</div>';
-                
-                const infoWindow = new AMap.InfoWindow({
-                    content: content,
-                    offset: new AMap.Pixel(0, -30)
-                });
-                
-                marker.on('click', function() {
-                    infoWindow.open(map, marker.getPosition());
-                });
-                
-                markers.push(marker);
+                positions[index] = [position.lng, position.lat];
+                markers.push(addLocationMarker(loc, index, positions[index]));
             } else {
                 console.warn(`地理编码失败: ${loc.location}`, status, result);
             }
             
-            // 所有位置处理完成后，调整地图视野
-            if (completedCount === locations.length) {
-                if (bounds.length > 0) {
-                    map.setFitView(markers, false, [50, 50, 50, 50]);
-                    
-                    // 如果有多个点，绘制路线
-                    if (bounds.length > 1) {
-                        drawRoute(bounds);
-                    }
-                } else {
-                    // 如果所有编码都失败，尝试搜索目的地
-                    geocodeDestination(cityName);
-                }
+            if (completedCount === pending.length) {
+                finish();
             }
         });
     });
 }
 
+// 创建地点标记和信息窗体
+function addLocationMarker(loc, index, position) {
+    // 根据类型选择图标颜色
+    let iconColor = loc.type === 'hotel' ? '#FF6B6B' : '#4ECDC4';
+    let label = loc.type === 'hotel' ? '🏨' : `${index + 1}`;
+    
+    // 创建标记
+    const marker = new AMap.Marker({
+        position: position,
+        title: loc.name,
+        label: {
+            content: `<div style="background:${iconColor};color:white;padding:4px 8px;border-radius:12px;font-weight:bold;">${label}</div>`,
+            offset: new AMap.Pixel(0, -30)
+        },
+        map: map
+    });
+    
+    // 创建信息窗体
+    let content = `
+        <div style="padding:12px;min-width:200px;">
+            <h4 style="margin:0 0 8px 0;color:#333;">${loc.name}</h4>
+            <p style="margin:4px 0;color:#666;"><strong>📍 位置：</strong>${loc.location}</p>
+    `;
+    
+    if (loc.day) {
+        content += `<p style="margin:4px 0;color:#666;"><strong>📅 第 ${loc.day} 天</strong></p>`;
+    }
+    if (loc.time) {
+        content += `<p style="margin:4px 0;color:#666;"><strong>🕐 时间：</strong>${loc.time}</p>`;
+    }
+    if (loc.cost) {
+        content += `<p style="margin:4px 0;color:#666;"><strong>💰 费用：</strong>¥${loc.cost}</p>`;
+    }
+    if (loc.nights) {
+        content += `<p style="margin:4px 0;color:#666;"><strong>🌙 住宿：</strong>${loc.nights} 晚</p>`;
+    }
+    if (loc.notes) {
+        content += `<p style="margin:4px 0;color:#999;font-size:12px;">${loc.notes}</p>`;
+    }
+    
+    content += '</div>';
+    
+    const infoWindow = new AMap.InfoWindow({
+        content: content,
+        offset: new AMap.Pixel(0, -30)
+    });
+    
+    marker.on('click', function() {
+        infoWindow.open(map, marker.getPosition());
+    });
+    
+    return marker;
+}
+
 // 绘制路线
 function drawRoute(points) {
     if (points.length < 2) return;
@@ -362,23 +675,7 @@ function geocodeDestination(destination) {
     geocoder.getLocation(destination, function(status, result) {
         if (status === 'complete' && result.info === 'OK') {
             const location = result.geocodes[0].location;
-            
-            map.setCenter([location.lng, location.lat]);
-            map.setZoom(12);
-            
-            const marker = new AMap.Marker({
-                position: [location.lng, location.lat],
-                title: destination,
-                map: map
-            });
-            
-            const infoWindow = new AMap.InfoWindow({
-                content: `<div style="padding:10px;"><strong>${destination}</strong></div>`
-            });
-            
-            marker.on('click', function() {
-                infoWindow.open(map, marker.getPosition());
-            });
+            addDestinationMarker(destination, [location.lng, location.lat]);
         } else {
             console.warn('目的地地理编码失败:', status, result);
             searchLocation(destination);
@@ -386,6 +683,26 @@ function geocodeDestination(destination) {
     });
 }
 
+// 标记目的地
+function addDestinationMarker(destination, position) {
+    map.setCenter(position);
+    map.setZoom(12);
+    
+    const marker = new AMap.Marker({
+        position: position,
+        title: destination,
+        map: map
+    });
+    
+    const infoWindow = new AMap.InfoWindow({
+        content: `<div style="padding:10px;"><strong>${destination}</strong></div>`
+    });
+    
+    marker.on('click', function() {
+        infoWindow.open(map, marker.getPosition());
+    });
+}
+
 // 搜索位置（备用方案）
 function searchLocation(keyword) {
     AMap.plugin('AMap.PlaceSearch', function() {
@@ -418,8 +735,8 @@ function showInputSection() {
     document.getElementById('userInput').value = '';
 }
 
-// 添加费用记录
-async function addExpense(e) {
+// 添加费用记录：先进入本地队列，再批量提交（离线时保留在队列中）
+function addExpense(e) {
     e.preventDefault();
     
     if (!currentPlanId) {
@@ -427,30 +744,143 @@ async function addExpense(e) {
         return;
     }
     
-    const expenseData = {
+    const queue = readExpenseQueue();
+    queue.push({
         plan_id: currentPlanId,
         expense: {
+            client_id: `${Date.now()}-${Math.random().toString(36).slice(2, 8)}`,
             category: document.getElementById('expenseCategory').value,
             amount: parseFloat(document.getElementById('expenseAmount').value),
             description: document.getElementById('expenseDesc').value,
             date: document.getElementById('expenseDate').value
         }
-    };
+    });
+    writeExpenseQueue(queue);
+    document.getElementById('expenseForm').reset();
     
+    scheduleExpenseFlush(queue.length >= EXPENSE_BATCH_SIZE ? 0 : EXPENSE_FLUSH_DELAY);
+}
+
+function readExpenseQueue() {
     try {
-        const response = await fetch('/api/expense', {
+        return JSON.parse(localStorage.getItem(EXPENSE_QUEUE_KEY)) || [];
+    } catch (error) {
+        return [];
+    }
+}
+
+function writeExpenseQueue(queue) {
+    localStorage.setItem(EXPENSE_QUEUE_KEY, JSON.stringify(queue));
+}
+
+function scheduleExpenseFlush(delay) {
+    clearTimeout(expenseFlushTimer);
+    expenseFlushTimer = setTimeout(flushExpenseQueue, delay);
+}
+
+// 按计划分组批量提交队列中的费用
+async function flushExpenseQueue() {
+    if (expenseFlushing || !navigator.onLine) return;
+    
+    const queue = readExpenseQueue();
+    if (queue.length === 0) return;
+    
+    expenseFlushing = true;
+    const planId = queue[0].plan_id;
+    const batch = queue.filter(item => item.plan_id === planId).slice(0, EXPENSE_BATCH_SIZE);
+    const sentIds = new Set(batch.map(item => item.expense.client_id));
+    
+    try {
+        const response = await fetch('/api/expenses/batch', {
             method: 'POST',
             headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify(expenseData)
+            body: JSON.stringify({plan_id: planId, expenses: batch.map(item => item.expense)})
         });
+        if (response.status >= 500) {
+            throw new Error(`服务器错误 ${response.status}`);
+        }
         
         const data = await response.json();
-        if (data.success) {
-            alert('费用记录已添加');
-            document.getElementById('expenseForm').reset();
+        const failed = (data.results || []).filter(result => !result.success);
+        if (failed.length > 0) {
+            alert(`${failed.length} 条费用记录未保存：${failed[0].error || data.message}`);
+        }
+        
+        // 已处理（成功或校验失败）的条目移出队列，网络错误时保留等待重试
+        writeExpenseQueue(readExpenseQueue().filter(item => !sentIds.has(item.expense.client_id)));
+        if (planId === currentPlanId) {
+            loadExpenseSummary();
         }
     } catch (error) {
-        console.error('添加费用失败:', error);
+        console.error('提交费用失败，稍后重试:', error);
+        expenseFlushing = false;
+        scheduleExpenseFlush(EXPENSE_RETRY_DELAY);
+        return;
+    }
+    
+    expenseFlushing = false;
+    if (readExpenseQueue().length > 0) {
+        scheduleExpenseFlush(0);
+    }
+}
+
+// 加载当前计划的费用汇总
+async function loadExpenseSummary() {
+    const container = document.getElementById('expenseSummary');
+    if (!currentPlanId) {
+        container.innerHTML = '';
+        return;
+    }
+    
+    try {
+        const response = await fetch(`/api/plan/${currentPlanId}/expenses/summary`);
+        const data = await response.json();
+        if (!data.success) return;
+        
+        const summary = data.summary;
+        if (!summary.count) {
+            container.innerHTML = '<p><small>暂无费用记录</small></p>';
+            return;
+        }
+        
+        container.innerHTML = `
+            <p><strong>已花费：</strong>¥${summary.total}（${summary.count} 笔）</p>
+            <ul>
+                ${Object.entries(summary.by_category).map(([category, amount]) => `
+                    <li>${category}：¥${amount}</li>
+                `).join('')}
+            </ul>
+            <div id="budgetAnalysis"></div>
+        `;
+        loadBudgetAnalysis();
+    } catch (error) {
+        console.error('加载费用汇总失败:', error);
+    }
+}
+
+// 预算使用情况（本地计算，不调用模型）
+const BUDGET_CATEGORY_NAMES = {
+    transportation: '交通', accommodation: '住宿', food: '餐饮', activities: '活动',
+    shopping: '购物', emergency: '应急', other: '其他'
+};
+
+async function loadBudgetAnalysis() {
+    try {
+        const response = await fetch(`/api/plan/${currentPlanId}/budget-analysis`);
+        const data = await response.json();
+        const container = document.getElementById('budgetAnalysis');
+        if (!data.success || !container) return;
+        
+        const analysis = data.analysis;
+        const warnings = Object.entries(analysis.categories)
+            .filter(([, item]) => item.status === 'over' || item.status === 'unplanned')
+            .map(([key, item]) => `<li>${BUDGET_CATEGORY_NAMES[key] || key}：¥${item.spent}${item.planned ? ` / 预算 ¥${item.planned}` : '（预算外）'}</li>`);
+        container.innerHTML = `
+            ${analysis.used_ratio !== null ? `<p><strong>预算使用：</strong>${Math.round(analysis.used_ratio * 100)}%，剩余 ¥${analysis.remaining}</p>` : ''}
+            ${warnings.length ? `<p><strong>⚠️ 超出预算的类别：</strong></p><ul>${warnings.join('')}</ul>` : ''}
+        `;
+    } catch (error) {
+        console.error('加载预算分析失败:', error);
     }
 }
 
@@ -477,15 +907,113 @@ function initVoiceRecognition() {
             document.getElementById('voiceBtn').textContent = '🎤 语音输入';
         };
     } else {
-        console.warn('浏览器不支持语音识别');
-        document.getElementById('voiceBtn').disabled = true;
+        // 浏览器不支持语音识别时，检查服务端是否启用了音频中转
+        fetch('/api/voice-config')
+            .then(response => response.json())
+            .then(config => {
+                if (!config.relay || !navigator.mediaDevices) {
+                    console.warn('浏览器不支持语音识别');
+                    document.getElementById('voiceBtn').disabled = true;
+                }
+            })
+            .catch(() => {
+                document.getElementById('voiceBtn').disabled = true;
+            });
+    }
+}
+
+// 录音并经服务端中转识别：16k 单声道 PCM 分片上传，识别结果通过 SSE 返回
+async function startRelayRecording() {
+    const response = await fetch('/api/voice/sessions', { method: 'POST' });
+    const data = await response.json();
+    if (!data.success) {
+        alert(data.message || '语音识别暂不可用');
+        return;
     }
+    
+    const sessionId = data.session_id;
+    const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
+    const context = new AudioContext({ sampleRate: 16000 });
+    const source = context.createMediaStreamSource(stream);
+    const processor = context.createScriptProcessor(4096, 1, 1);
+    const recorder = { sessionId, stream, context, processor, buffers: [], sending: Promise.resolve() };
+    
+    processor.onaudioprocess = (event) => {
+        const input = event.inputBuffer.getChannelData(0);
+        const pcm = new Int16Array(input.length);
+        for (let i = 0; i < input.length; i++) {
+            pcm[i] = Math.max(-1, Math.min(1, input[i])) * 0x7fff;
+        }
+        recorder.buffers.push(pcm);
+    };
+    source.connect(processor);
+    processor.connect(context.destination);
+    recorder.timer = setInterval(() => sendRelayAudio(recorder, false), VOICE_SEND_INTERVAL);
+    
+    const events = new EventSource(`/api/voice/sessions/${sessionId}/events`);
+    events.addEventListener('partial', (event) => {
+        document.getElementById('userInput').value = JSON.parse(event.data).text;
+    });
+    events.addEventListener('final', (event) => {
+        document.getElementById('userInput').value = JSON.parse(event.data).text;
+        events.close();
+    });
+    events.addEventListener('error', (event) => {
+        if (event.data) {
+            console.error('语音识别错误:', JSON.parse(event.data).message);
+        }
+        events.close();
+    });
+    
+    relayRecorder = recorder;
+}
+
+// 按顺序上传已录制的音频；服务端返回 429 时稍后重发同一片
+function sendRelayAudio(recorder, last) {
+    const length = recorder.buffers.reduce((sum, buffer) => sum + buffer.length, 0);
+    const chunk = new Int16Array(length);
+    let offset = 0;
+    recorder.buffers.forEach(buffer => {
+        chunk.set(buffer, offset);
+        offset += buffer.length;
+    });
+    recorder.buffers = [];
+    if (!length && !last) {
+        return recorder.sending;
+    }
+    
+    const url = `/api/voice/sessions/${recorder.sessionId}/audio${last ? '?last=1' : ''}`;
+    const upload = async () => {
+        for (let attempt = 0; attempt < 5; attempt++) {
+            const response = await fetch(url, { method: 'POST', body: chunk.buffer });
+            if (response.status !== 429) {
+                return;
+            }
+            const retryAfter = parseInt(response.headers.get('Retry-After') || '1', 10);
+            await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+        }
+    };
+    recorder.sending = recorder.sending.then(upload).catch(error => console.error('上传音频失败:', error));
+    return recorder.sending;
+}
+
+function stopRelayRecording() {
+    const recorder = relayRecorder;
+    relayRecorder = null;
+    if (!recorder) {
+        return;
+    }
+    clearInterval(recorder.timer);
+    recorder.processor.disconnect();
+    recorder.stream.getTracks().forEach(track => track.stop());
+    recorder.context.close();
+    sendRelayAudio(recorder, true);
 }
 
 // 切换语音识别
 function toggleVoiceRecognition() {
     if (!recognition) {
-        alert('您的浏览器不支持语音识别功能');
+        toggleRelayRecording();
         return;
     }
     
@@ -498,6 +1026,24 @@ function toggleVoiceRecognition() {
     }
 }
 
+async function toggleRelayRecording() {
+    const button = document.getElementById('voiceBtn');
+    if (relayRecorder) {
+        stopRelayRecording();
+        button.textContent = '🎤 语音输入';
+        return;
+    }
+    try {
+        await startRelayRecording();
+        if (relayRecorder) {
+            button.textContent = '🔴 停止录音';
+        }
+    } catch (error) {
+        console.error('无法开始录音:', error);
+        alert('您的浏览器不支持语音识别功能');
+    }
+}
+
 // 删除旅行计划
 async function deletePlan(event, planId) {
     event.stopPropagation(); // 阻止事件冒泡，避免触发加载计划
@@ -523,7 +1069,7 @@ async function deletePlan(event, planId) {
             }
             
             // 重新加载计划列表
-            loadMyPlans();
+            refreshPlans();
         } else {
             alert(data.message || '删除失败，请重试');
         }
@@ -1,6 +1,9 @@
 -- Supabase 数据库表结构
 -- 在 Supabase SQL Editor 中执行此脚本
 
+-- 计划检索使用的三元组索引
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- 用户表
 CREATE TABLE IF NOT EXISTS users (
     id BIGSERIAL PRIMARY KEY,
@@ -16,10 +19,42 @@ CREATE TABLE IF NOT EXISTS travel_plans (
     user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
     title TEXT NOT NULL,
     plan_data JSONB NOT NULL,
+    destination TEXT,
+    duration INTEGER,
+    total_budget NUMERIC(12, 2),
+    day_count INTEGER,
+    cost_summary JSONB,
+    search_text TEXT,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- 旧版本升级：补充派生列，并修复被二次编码为 JSON 字符串的 plan_data
+ALTER TABLE travel_plans ADD COLUMN IF NOT EXISTS destination TEXT;
+ALTER TABLE travel_plans ADD COLUMN IF NOT EXISTS duration INTEGER;
+ALTER TABLE travel_plans ADD COLUMN IF NOT EXISTS total_budget NUMERIC(12, 2);
+ALTER TABLE travel_plans ADD COLUMN IF NOT EXISTS day_count INTEGER;
+-- 费用摘要由应用在保存时计算，旧计划下次保存时补上
+ALTER TABLE travel_plans ADD COLUMN IF NOT EXISTS cost_summary JSONB;
+-- 检索文本（活动、地点、住宿、小贴士）由应用在保存时生成，旧计划下次保存时补上
+ALTER TABLE travel_plans ADD COLUMN IF NOT EXISTS search_text TEXT;
+ALTER TABLE travel_plans ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', COALESCE(destination, '')), 'A') ||
+    setweight(to_tsvector('simple', COALESCE(search_text, '')), 'B')
+) STORED;
+
+UPDATE travel_plans SET plan_data = (plan_data #>> '{}')::jsonb
+WHERE jsonb_typeof(plan_data) = 'string';
+
+UPDATE travel_plans SET
+    destination = plan_data->>'destination',
+    day_count = COALESCE(jsonb_array_length(CASE WHEN jsonb_typeof(plan_data->'itinerary') = 'array'
+                                                 THEN plan_data->'itinerary' END), 0),
+    duration = NULLIF(substring(plan_data->>'duration' from '[0-9]+'), '')::INTEGER,
+    total_budget = NULLIF(substring(COALESCE(plan_data->'budget_breakdown'->>'total', plan_data->>'budget')
+                                    from '[0-9]+(?:\.[0-9]+)?'), '')::NUMERIC
+WHERE day_count IS NULL;
+
 -- 费用记录表
 CREATE TABLE IF NOT EXISTS expenses (
     id BIGSERIAL PRIMARY KEY,
@@ -32,8 +67,171 @@ CREATE TABLE IF NOT EXISTS expenses (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- 费用汇总表：按 (计划, 类别, 日期) 聚合，由触发器增量维护
+CREATE TABLE IF NOT EXISTS expense_summaries (
+    plan_id BIGINT NOT NULL REFERENCES travel_plans(id) ON DELETE CASCADE,
+    user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    category TEXT NOT NULL,
+    date DATE NOT NULL,
+    total DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (plan_id, category, date)
+);
+
+CREATE OR REPLACE FUNCTION apply_expense_summary_delta(
+    p_plan_id BIGINT, p_user_id BIGINT, p_category TEXT, p_date DATE, p_amount DECIMAL, p_count INTEGER
+) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO expense_summaries (plan_id, user_id, category, date, total, count)
+    VALUES (p_plan_id, p_user_id, p_category, p_date, p_amount, p_count)
+    ON CONFLICT (plan_id, category, date)
+    DO UPDATE SET total = expense_summaries.total + EXCLUDED.total,
+                  count = expense_summaries.count + EXCLUDED.count;
+
+    DELETE FROM expense_summaries
+    WHERE plan_id = p_plan_id AND category = p_category AND date = p_date AND count <= 0;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION maintain_expense_summaries() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        -- 计划被级联删除时汇总行也已级联删除，无需处理
+        IF EXISTS (SELECT 1 FROM travel_plans WHERE id = OLD.plan_id) THEN
+            PERFORM apply_expense_summary_delta(OLD.plan_id, OLD.user_id, OLD.category, OLD.date, -OLD.amount, -1);
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM apply_expense_summary_delta(NEW.plan_id, NEW.user_id, NEW.category, NEW.date, NEW.amount, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_expenses_summary ON expenses;
+CREATE TRIGGER trg_expenses_summary
+    AFTER INSERT OR UPDATE OR DELETE ON expenses
+    FOR EACH ROW EXECUTE FUNCTION maintain_expense_summaries();
+
+-- 首次创建汇总表时根据已有费用回填
+INSERT INTO expense_summaries (plan_id, user_id, category, date, total, count)
+SELECT plan_id, MIN(user_id), category, date, SUM(amount), COUNT(*)
+FROM expenses GROUP BY plan_id, category, date
+ON CONFLICT (plan_id, category, date) DO NOTHING;
+
+-- 局部修改计划（JSON Patch 子集：replace / add / remove），只传输变化的部分
+CREATE OR REPLACE FUNCTION apply_plan_patch(p_plan_id BIGINT, p_user_id BIGINT, p_ops JSONB)
+RETURNS BOOLEAN AS $$
+DECLARE
+    v_plan JSONB;
+    v_op JSONB;
+    v_path TEXT[];
+    v_last TEXT;
+BEGIN
+    SELECT plan_data INTO v_plan FROM travel_plans
+    WHERE id = p_plan_id AND user_id = p_user_id
+    FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN FALSE;
+    END IF;
+
+    FOR v_op IN SELECT * FROM jsonb_array_elements(p_ops) LOOP
+        v_path := string_to_array(substr(v_op->>'path', 2), '/');
+        v_last := v_path[array_length(v_path, 1)];
+        IF v_op->>'op' = 'remove' THEN
+            v_plan := v_plan #- v_path;
+        ELSIF v_op->>'op' = 'add' AND v_last = '-' THEN
+            v_path[array_length(v_path, 1)] := '-1';
+            v_plan := jsonb_insert(v_plan, v_path, v_op->'value', true);
+        ELSIF v_op->>'op' = 'add' AND v_last ~ '^[0-9]+$' THEN
+            v_plan := jsonb_insert(v_plan, v_path, v_op->'value');
+        ELSIF v_op->>'op' IN ('add', 'replace') THEN
+            v_plan := jsonb_set(v_plan, v_path, v_op->'value', true);
+        ELSE
+            RAISE EXCEPTION 'unsupported patch op: %', v_op->>'op';
+        END IF;
+    END LOOP;
+
+    UPDATE travel_plans SET
+        plan_data = v_plan,
+        title = COALESCE(v_plan->>'destination', '未命名计划'),
+        destination = v_plan->>'destination',
+        day_count = COALESCE(jsonb_array_length(CASE WHEN jsonb_typeof(v_plan->'itinerary') = 'array'
+                                                     THEN v_plan->'itinerary' END), 0),
+        duration = NULLIF(substring(v_plan->>'duration' from '[0-9]+'), '')::INTEGER,
+        total_budget = NULLIF(substring(COALESCE(v_plan->'budget_breakdown'->>'total', v_plan->>'budget')
+                                        from '[0-9]+(?:\.[0-9]+)?'), '')::NUMERIC,
+        updated_at = NOW()
+    WHERE id = p_plan_id;
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 检索已保存的计划：所有词都要出现在目的地或检索文本中（ILIKE 走三元组索引），
+-- 按全文相关度和目的地命中排序；分面按文本条件统计，不受 p_filters 影响
+CREATE OR REPLACE FUNCTION search_plans(
+    p_user_id BIGINT,
+    p_query TEXT DEFAULT '',
+    p_terms TEXT[] DEFAULT '{}',
+    p_filters JSONB DEFAULT '{}'::JSONB,
+    p_limit INTEGER DEFAULT 20,
+    p_offset INTEGER DEFAULT 0
+)
+RETURNS JSONB AS $$
+WITH matched AS (
+    SELECT p.id, p.title, p.destination, p.duration, p.total_budget, p.day_count,
+           p.created_at, p.updated_at, p.search_text, p.search_vector,
+           to_char(p.created_at AT TIME ZONE 'UTC', 'YYYY-MM') AS month
+    FROM travel_plans p
+    WHERE p.user_id = p_user_id
+      AND NOT EXISTS (
+          SELECT 1 FROM unnest(p_terms) AS t(pattern)
+          WHERE (COALESCE(p.destination, '') || ' ' || COALESCE(p.search_text, '')) NOT ILIKE t.pattern
+      )
+),
+filtered AS (
+    SELECT m.*,
+           ts_rank(m.search_vector, websearch_to_tsquery('simple', replace(p_query, ' ', ' or ')))
+           + CASE WHEN m.destination ILIKE ANY (p_terms) THEN 1 ELSE 0 END AS rank
+    FROM matched m
+    WHERE (p_filters->>'min_duration' IS NULL OR m.duration >= (p_filters->>'min_duration')::INTEGER)
+      AND (p_filters->>'max_duration' IS NULL OR m.duration <= (p_filters->>'max_duration')::INTEGER)
+      AND (p_filters->>'min_budget' IS NULL OR m.total_budget >= (p_filters->>'min_budget')::NUMERIC)
+      AND (p_filters->>'max_budget' IS NULL OR m.total_budget < (p_filters->>'max_budget')::NUMERIC)
+      AND (p_filters->>'month' IS NULL OR m.month = p_filters->>'month')
+)
+SELECT jsonb_build_object(
+    'total', (SELECT COUNT(*) FROM filtered),
+    'results', COALESCE((
+        SELECT jsonb_agg(r ORDER BY r.rank DESC, r.created_at DESC, r.id DESC) FROM (
+            SELECT id, title, destination, duration, total_budget, day_count, created_at, updated_at, search_text, rank
+            FROM filtered ORDER BY rank DESC, created_at DESC, id DESC
+            LIMIT p_limit OFFSET p_offset
+        ) r
+    ), '[]'::JSONB),
+    'facet_groups', COALESCE((
+        SELECT jsonb_agg(g) FROM (
+            SELECT duration, total_budget, month, COUNT(*) AS count FROM matched GROUP BY 1, 2, 3
+        ) g
+    ), '[]'::JSONB)
+);
+$$ LANGUAGE sql STABLE;
+
+-- 按原 id 导入备份后，把各表的自增序列推进到当前最大 id，避免之后插入时主键冲突
+CREATE OR REPLACE FUNCTION sync_id_sequences() RETURNS VOID AS $$
+BEGIN
+    PERFORM setval(pg_get_serial_sequence('users', 'id'), COALESCE((SELECT MAX(id) FROM users), 0) + 1, false);
+    PERFORM setval(pg_get_serial_sequence('travel_plans', 'id'), COALESCE((SELECT MAX(id) FROM travel_plans), 0) + 1, false);
+    PERFORM setval(pg_get_serial_sequence('expenses', 'id'), COALESCE((SELECT MAX(id) FROM expenses), 0) + 1, false);
+END;
+$$ LANGUAGE plpgsql;
+
 -- 创建索引以提高查询性能
 CREATE INDEX IF NOT EXISTS idx_travel_plans_user_id ON travel_plans(user_id);
+CREATE INDEX IF NOT EXISTS idx_travel_plans_search_vector ON travel_plans USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_travel_plans_search_trgm ON travel_plans
+    USING GIN ((COALESCE(destination, '') || ' ' || COALESCE(search_text, '')) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_travel_plans_user_created ON travel_plans(user_id, created_at DESC, id DESC);
 CREATE INDEX IF NOT EXISTS idx_expenses_plan_id ON expenses(plan_id);
 CREATE INDEX IF NOT EXISTS idx_expenses_user_id ON expenses(user_id);
 
@@ -41,10 +239,13 @@ CREATE INDEX IF NOT EXISTS idx_expenses_user_id ON expenses(user_id);
 ALTER TABLE users ENABLE ROW LEVEL SECURITY;
 ALTER TABLE travel_plans ENABLE ROW LEVEL SECURITY;
 ALTER TABLE expenses ENABLE ROW LEVEL SECURITY;
+ALTER TABLE expense_summaries ENABLE ROW LEVEL SECURITY;
 
 -- 删除已存在的策略（如果存在）
 DROP POLICY IF EXISTS "Users can view own data" ON users;
 DROP POLICY IF EXISTS "Users can insert own data" ON users;
+DROP POLICY IF EXISTS "Service role can update users" ON users;
+DROP POLICY IF EXISTS "Service role can delete users" ON users;
 DROP POLICY IF EXISTS "Users can view own plans" ON travel_plans;
 DROP POLICY IF EXISTS "Users can insert own plans" ON travel_plans;
 DROP POLICY IF EXISTS "Users can update own plans" ON travel_plans;
@@ -53,6 +254,8 @@ DROP POLICY IF EXISTS "Users can view own expenses" ON expenses;
 DROP POLICY IF EXISTS "Users can insert own expenses" ON expenses;
 DROP POLICY IF EXISTS "Users can update own expenses" ON expenses;
 DROP POLICY IF EXISTS "Users can delete own expenses" ON expenses;
+DROP POLICY IF EXISTS "Users can view own expense summaries" ON expense_summaries;
+DROP POLICY IF EXISTS "Expense triggers can write summaries" ON expense_summaries;
 
 -- 用户表策略：允许所有操作（因为使用的是 anon key）
 CREATE POLICY "Users can view own data" ON users
@@ -61,6 +264,14 @@ CREATE POLICY "Users can view own data" ON users
 CREATE POLICY "Users can insert own data" ON users
     FOR INSERT WITH CHECK (true);
 
+-- 登录时升级密码哈希、混合存储模式同步用户行需要更新和删除权限，
+-- 只授予服务端使用的 service_role，持有 anon key 的客户端不能改写密码哈希或删除用户
+CREATE POLICY "Service role can update users" ON users
+    FOR UPDATE TO service_role USING (true) WITH CHECK (true);
+
+CREATE POLICY "Service role can delete users" ON users
+    FOR DELETE TO service_role USING (true);
+
 -- 旅行计划表策略：允许所有操作
 CREATE POLICY "Users can view own plans" ON travel_plans
     FOR SELECT USING (true);
@@ -86,3 +297,10 @@ CREATE POLICY "Users can update own expenses" ON expenses
 
 CREATE POLICY "Users can delete own expenses" ON expenses
     FOR DELETE USING (true);
+
+-- 费用汇总表策略：读取开放，写入只来自触发器
+CREATE POLICY "Users can view own expense summaries" ON expense_summaries
+    FOR SELECT USING (true);
+
+CREATE POLICY "Expense triggers can write summaries" ON expense_summaries
+    FOR ALL USING (true) WITH CHECK (true);
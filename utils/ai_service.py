@@ -1,129 +1,318 @@
 import dashscope
 from dashscope import Generation
 from config import Config
-import json
+from utils.ai_stub import StubGeneration
+from utils.stream_parser import IncrementalPlanParser
+from utils.plan_cache import PlanCache
+from utils.budget_analysis import advice_cache_key, format_budget_for_prompt
+from utils.cache import TTLCache
+from utils.plan_schema import (PLAN_SCHEMA_VERSION, TravelPlan, DayPlan, PlanParseError, build_plan_prompt,
+                               build_day_prompt, build_day_context, parse_plan_text, supports_json_mode)
+from utils.llm_router import LLMRouter, parse_model_concurrency
+from utils.metrics import record_llm_call
+import threading
+import time
+
+# 修改提示词或返回格式时递增，使旧的缓存结果失效
+PROMPT_VERSION = PLAN_SCHEMA_VERSION
+
+TRAVEL_PLAN_PROMPT = build_plan_prompt()
+DAY_PLAN_PROMPT = build_day_prompt()
+BUDGET_ADVICE_PROMPT = (
+    '你是旅行预算分析专家。下面是多个旅行计划的预算分析（以“计划 #编号”分隔），'
+    '为每个计划给出 1-3 条简短的节省或调整建议。只输出一个 JSON 对象，键为计划编号，'
+    '值为建议字符串数组，例如 {"12":["建议一","建议二"]}'
+)
+
+
+def _usage_tokens(response):
+    """读取响应中的 token 用量，流式输出时最后一个分片为累计值"""
+    usage = getattr(response, 'usage', None)
+    try:
+        return int(usage.input_tokens or 0), int(usage.output_tokens or 0)
+    except (AttributeError, KeyError, TypeError):
+        return 0, 0
+
+
+class GenerationStats:
+    """计划生成的 token 用量和解析耗时统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.parse_failures = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.parse_ms = 0.0
+        self.max_parse_ms = 0.0
+
+    def record(self, prompt_tokens, completion_tokens, parse_ms, parsed):
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.parse_ms += parse_ms
+            self.max_parse_ms = max(self.max_parse_ms, parse_ms)
+            if not parsed:
+                self.parse_failures += 1
+
+    def stats(self):
+        with self._lock:
+            n = self.requests or 1
+            return {
+                'requests': self.requests,
+                'parse_failures': self.parse_failures,
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'avg_prompt_tokens': round(self.prompt_tokens / n, 1),
+                'avg_completion_tokens': round(self.completion_tokens / n, 1),
+                'avg_parse_ms': round(self.parse_ms / n, 3),
+                'max_parse_ms': round(self.max_parse_ms, 3)
+            }
+
 
 class AIService:
     def __init__(self):
         dashscope.api_key = Config.DASHSCOPE_API_KEY
         self.model = Config.QWEN_MODEL
+        # 离线压测时使用本地替身，避免真实调用产生费用
+        self.generation = StubGeneration if Config.DASHSCOPE_STUB else Generation
+        self.plan_cache = None
+        if Config.PLAN_CACHE_BACKEND != 'off':
+            self.plan_cache = PlanCache(
+                backend=Config.PLAN_CACHE_BACKEND,
+                maxsize=Config.PLAN_CACHE_SIZE,
+                ttl=Config.PLAN_CACHE_TTL,
+                db_path=Config.DATABASE_PATH
+            )
+        self.generation_stats = GenerationStats()
+        # 预算建议缓存：键为预算和费用汇总的哈希
+        self.budget_cache = TTLCache(maxsize=Config.BUDGET_CACHE_SIZE, ttl=Config.BUDGET_CACHE_TTL)
+        self.router = self._build_router()
+    
+    def _build_router(self):
+        if not Config.AI_ROUTING:
+            return LLMRouter(self.model, self.model, max_concurrency=Config.AI_MODEL_MAX_CONCURRENCY,
+                             breaker_failures=Config.AI_BREAKER_FAILURES, breaker_reset=Config.AI_BREAKER_RESET)
+        return LLMRouter(
+            simple_model=Config.QWEN_MODEL_SIMPLE,
+            complex_model=Config.QWEN_MODEL_COMPLEX,
+            hedge_model=Config.QWEN_HEDGE_MODEL or None,
+            fallback=[m.strip() for m in Config.QWEN_FALLBACK_MODELS.split(',')],
+            max_concurrency=Config.AI_MODEL_MAX_CONCURRENCY,
+            model_concurrency=parse_model_concurrency(Config.AI_MODEL_CONCURRENCY),
+            hedge_after=Config.AI_HEDGE_AFTER,
+            breaker_failures=Config.AI_BREAKER_FAILURES,
+            breaker_reset=Config.AI_BREAKER_RESET
+        )
+    
+    def _plan_params(self, model):
+        params = {'result_format': 'message', 'temperature': 0.7}
+        if Config.QWEN_JSON_MODE and supports_json_mode(model):
+            params['response_format'] = {'type': 'json_object'}
+        return params
+    
+    def _plan_messages(self, user_input):
+        return [
+            {"role": "system", "content": TRAVEL_PLAN_PROMPT},
+            {"role": "user", "content": user_input}
+        ]
+    
+    def _make_call(self, messages, kind='plan'):
+        """返回供路由器调用的函数：用指定模型发起一次非流式请求"""
+        def call(model):
+            start = time.perf_counter()
+            ok = False
+            usage = (0, 0)
+            try:
+                response = self.generation.call(model=model, messages=messages, **self._plan_params(model))
+                if response.status_code != 200:
+                    raise Exception(f"API 调用失败: {response.code} - {response.message}")
+                ok = True
+                usage = _usage_tokens(response)
+                return response
+            finally:
+                record_llm_call(model, kind, time.perf_counter() - start, ok, *usage)
+        return call
+    
+    def _parse_plan_content(self, content, usage=(0, 0)):
+        """解析并校验模型返回的计划文本，同时记录 token 用量和解析耗时"""
+        start = time.perf_counter()
+        try:
+            plan = TravelPlan.from_dict(parse_plan_text(content)).to_dict()
+        except PlanParseError as e:
+            print(f"计划解析错误: {e}")
+            plan = {"raw_response": content}
+        parse_ms = (time.perf_counter() - start) * 1000
+        self.generation_stats.record(usage[0], usage[1], parse_ms, 'raw_response' not in plan)
+        return plan
+    
+    def _error_plan(self, error):
+        return {
+            "error": str(error),
+            "destination": "未知",
+            "message": "生成计划时出错，请稍后重试"
+        }
+    
+    def _cache_key(self, user_input):
+        if not self.plan_cache:
+            return None
+        return self.plan_cache.make_key(user_input, self.router.choose(user_input), PROMPT_VERSION)
+    
+    def _cache_plan(self, cache_key, plan):
+        # 只缓存成功解析的计划
+        if cache_key and 'error' not in plan and 'raw_response' not in plan:
+            self.plan_cache.set(cache_key, plan)
     
     def generate_travel_plan(self, user_input):
         """根据用户输入生成旅行计划"""
-        system_prompt = """你是一个专业的旅行规划助手。根据用户的需求，生成详细的旅行计划。
-        
-请以 JSON 格式返回计划，包含以下字段：
-{
-  "destination": "目的地",
-  "duration": "天数",
-  "budget": "预算（元）",
-  "travelers": "人数",
-  "preferences": ["偏好1", "偏好2"],
-  "itinerary": [
-    {
-      "day": 1,
-      "date": "日期",
-      "activities": [
-        {
-          "time": "时间",
-          "activity": "活动",
-          "location": "地点",
-          "cost": 费用,
-          "notes": "备注"
-        }
-      ]
-    }
-  ],
-  "accommodation": [
-    {
-      "name": "酒店名称",
-      "location": "位置",
-      "nights": 晚数,
-      "cost": 费用
-    }
-  ],
-  "transportation": {
-    "to_destination": {"type": "交通方式", "cost": 费用},
-    "local": {"type": "交通方式", "cost": 费用},
-    "from_destination": {"type": "交通方式", "cost": 费用}
-  },
-  "budget_breakdown": {
-    "transportation": 费用,
-    "accommodation": 费用,
-    "food": 费用,
-    "activities": 费用,
-    "shopping": 费用,
-    "emergency": 费用,
-    "total": 总费用
-  },
-  "tips": ["建议1", "建议2"]
-}"""
+        cache_key = self._cache_key(user_input)
+        if cache_key:
+            cached = self.plan_cache.get(cache_key)
+            if cached is not None:
+                return cached
         
         try:
-            response = Generation.call(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_input}
-                ],
-                result_format='message',
-                temperature=0.7
-            )
-            
-            if response.status_code == 200:
-                content = response.output.choices[0].message.content
-            else:
-                raise Exception(f"API 调用失败: {response.code} - {response.message}")
-            
-            # 尝试解析 JSON
-            try:
-                plan = json.loads(content)
-            except json.JSONDecodeError:
-                # 如果不是纯 JSON，尝试提取 JSON 部分
-                import re
-                json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                if json_match:
-                    plan = json.loads(json_match.group())
-                else:
-                    plan = {"raw_response": content}
-            
+            # 由路由器选择模型，慢请求会向更快的模型发起对冲调用
+            response, _ = self.router.call(user_input, self._make_call(self._plan_messages(user_input)))
+            content = response.output.choices[0].message.content
+            plan = self._parse_plan_content(content, _usage_tokens(response))
+            self._cache_plan(cache_key, plan)
             return plan
             
         except Exception as e:
             print(f"AI 服务错误: {e}")
-            return {
-                "error": str(e),
-                "destination": "未知",
-                "message": "生成计划时出错，请稍后重试"
-            }
+            return self._error_plan(e)
     
-    def analyze_budget(self, expenses, budget):
-        """分析预算使用情况"""
-        prompt = f"""分析以下旅行开销情况：
-预算：{budget} 元
-已花费：{json.dumps(expenses, ensure_ascii=False)}
+    def stream_travel_plan(self, user_input):
+        """流式生成旅行计划
 
-请提供：
-1. 预算使用分析
-2. 各类别开销占比
-3. 节省建议
-4. 剩余预算建议"""
+        依次产出事件字典：顶层字段（field）、每个完整的行程天（itinerary）
+        和住宿条目（accommodation），最后产出完整计划（plan）。
+        """
+        cache_key = self._cache_key(user_input)
+        if cache_key:
+            cached = self.plan_cache.get(cache_key)
+            if cached is not None:
+                # 命中缓存时一次性推送全部条目
+                for key in ('itinerary', 'accommodation'):
+                    for item in cached.get(key) or []:
+                        yield {'type': key, 'data': item}
+                yield {'type': 'plan', 'data': cached}
+                return
         
+        parser = IncrementalPlanParser(watch=('itinerary', 'accommodation'))
+        # 流式输出已经推送给前端的内容无法撤回，因此只做模型选择、限流和熔断，不做对冲
+        slot = None
+        start = time.monotonic()
+        ok = True
+        usage = (0, 0)
         try:
-            response = Generation.call(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是一个旅行预算分析专家"},
-                    {"role": "user", "content": prompt}
-                ],
-                result_format='message',
-                temperature=0.7
+            slot = self.router.acquire(self.router.choose(user_input))
+            responses = self.generation.call(
+                model=slot.name,
+                messages=self._plan_messages(user_input),
+                stream=True,
+                incremental_output=True,
+                **self._plan_params(slot.name)
             )
             
-            if response.status_code == 200:
-                return response.output.choices[0].message.content
-            else:
-                return f"预算分析出错: {response.message}"
+            for response in responses:
+                if response.status_code != 200:
+                    raise Exception(f"API 调用失败: {response.code} - {response.message}")
+                delta = response.output.choices[0].message.content
+                usage = _usage_tokens(response)
+                for event in parser.feed(delta):
+                    yield event
             
+            plan = self._parse_plan_content(parser.text, usage)
+            self._cache_plan(cache_key, plan)
+        except Exception as e:
+            ok = False
+            print(f"AI 服务错误: {e}")
+            plan = self._error_plan(e)
+        finally:
+            if slot:
+                slot.release(time.monotonic() - start, ok)
+                record_llm_call(slot.name, 'stream', time.monotonic() - start, ok, *usage)
+        
+        yield {'type': 'plan', 'data': plan}
+    
+    def regenerate_day(self, plan_data, day_index, instructions=''):
+        """只重新生成计划中的某一天，返回新的当天行程；失败时返回 None
+
+        只发送计划概要和当天信息，输出也只有一天，token 和耗时远小于重新生成整个计划。
+        """
+        context = build_day_context(plan_data, day_index, instructions)
+        messages = [
+            {"role": "system", "content": DAY_PLAN_PROMPT},
+            {"role": "user", "content": context}
+        ]
+        original = plan_data['itinerary'][day_index]
+        try:
+            response, _ = self.router.call(context, self._make_call(messages, 'day'),
+                                           primary=self.router.simple_model)
+            content = response.output.choices[0].message.content
+            start = time.perf_counter()
+            day = DayPlan.from_dict(parse_plan_text(content), day_index).to_dict()
+            prompt_tokens, completion_tokens = _usage_tokens(response)
+            self.generation_stats.record(prompt_tokens, completion_tokens, (time.perf_counter() - start) * 1000, True)
+        except Exception as e:
+            print(f"重新生成行程错误: {e}")
+            return None
+        
+        # 天数编号和日期以原计划为准
+        day['day'] = original.get('day', day_index + 1)
+        day['date'] = day.get('date') or original.get('date', '')
+        return day
+    
+    def analyze_budgets(self, items):
+        """为多个计划生成预算建议，返回 {plan_id: [建议] 或 None（生成失败）}
+
+        items 为 (预算输入, analyze_locally 结果) 列表。建议按预算和费用汇总的哈希缓存，
+        未变化的计划不再调用模型；未命中的计划每 BUDGET_BATCH_SIZE 个合并为一次请求。
+        """
+        model = self.router.simple_model
+        advice = {}
+        pending = []
+        for item, analysis in items:
+            if not item['expenses']['count']:
+                # 还没有费用记录，没有可分析的内容
+                advice[item['id']] = []
+                continue
+            key = advice_cache_key(item, model)
+            cached = self.budget_cache.get(key)
+            if cached is not None:
+                advice[item['id']] = cached
+            else:
+                pending.append((key, item, analysis))
+        
+        batch_size = max(1, Config.BUDGET_BATCH_SIZE)
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            result = self._budget_advice_batch([(item, analysis) for _, item, analysis in batch], model)
+            for key, item, _ in batch:
+                tips = result.get(str(item['id'])) if result is not None else None
+                if isinstance(tips, str):
+                    tips = [tips]
+                if isinstance(tips, list):
+                    tips = [str(tip) for tip in tips if tip]
+                    self.budget_cache.set(key, tips)
+                else:
+                    tips = None
+                advice[item['id']] = tips
+        return advice
+    
+    def _budget_advice_batch(self, items, model):
+        """一次请求分析多个计划，返回 {计划编号: 建议}；失败时返回 None"""
+        content = '\n\n'.join(format_budget_for_prompt(item, analysis) for item, analysis in items)
+        messages = [
+            {"role": "system", "content": BUDGET_ADVICE_PROMPT},
+            {"role": "user", "content": content}
+        ]
+        try:
+            response, _ = self.router.call(content, self._make_call(messages, 'budget'), primary=model)
+            return parse_plan_text(response.output.choices[0].message.content)
         except Exception as e:
-            return f"预算分析出错: {e}"
+            print(f"预算分析错误: {e}")
+            return None
@@ -0,0 +1,125 @@
+"""DashScope Generation 的本地替身
+
+离线压测或开发调试时使用（设置 DASHSCOPE_STUB=1），
+按固定延迟返回与真实接口结构一致的响应，不产生任何 API 费用。
+"""
+import json
+import re
+import time
+from types import SimpleNamespace
+from config import Config
+
+
+def _build_stub_plan(user_input):
+    days_match = re.search(r'(\d+)\s*天', user_input)
+    days = int(days_match.group(1)) if days_match else 3
+    dest_match = re.search(r'去([一-龥A-Za-z]{2,8}?)(?:[，,。\s]|\d|玩|旅|$)', user_input)
+    destination = dest_match.group(1) if dest_match else '北京'
+
+    itinerary = []
+    for day in range(1, days + 1):
+        itinerary.append({
+            'day': day,
+            'date': f'第{day}天',
+            'activities': [
+                {'time': '09:00', 'activity': f'{destination}景点{day}-1', 'location': f'{destination}景点{day}-1',
+                 'cost': 100, 'notes': ''},
+                {'time': '14:00', 'activity': f'{destination}景点{day}-2', 'location': f'{destination}景点{day}-2',
+                 'cost': 80, 'notes': ''}
+            ]
+        })
+
+    return {
+        'destination': destination,
+        'duration': f'{days}天',
+        'budget': '5000',
+        'travelers': '2',
+        'preferences': ['美食'],
+        'itinerary': itinerary,
+        'accommodation': [
+            {'name': f'{destination}酒店', 'location': f'{destination}市中心', 'nights': max(days - 1, 1), 'cost': 400 * max(days - 1, 1)}
+        ],
+        'transportation': {
+            'to_destination': {'type': '高铁', 'cost': 500},
+            'local': {'type': '地铁', 'cost': 100},
+            'from_destination': {'type': '高铁', 'cost': 500}
+        },
+        'budget_breakdown': {
+            'transportation': 1100, 'accommodation': 400 * max(days - 1, 1), 'food': 600,
+            'activities': 180 * days, 'shopping': 300, 'emergency': 200,
+            'total': 1100 + 400 * max(days - 1, 1) + 600 + 180 * days + 300 + 200
+        },
+        'tips': ['提前预订门票', '注意天气变化']
+    }
+
+
+def _build_stub_day(context):
+    dest_match = re.search(r'"destination":"([^"]*)"', context)
+    day_match = re.search(r'"day":(\d+)', context)
+    destination = dest_match.group(1) if dest_match else '北京'
+    day = int(day_match.group(1)) if day_match else 1
+    return {
+        'day': day,
+        'date': f'第{day}天',
+        'activities': [
+            {'time': '10:00', 'activity': f'{destination}新景点{day}-1', 'location': f'{destination}新景点{day}-1',
+             'cost': 120, 'notes': '重新安排'},
+            {'time': '15:00', 'activity': f'{destination}新景点{day}-2', 'location': f'{destination}新景点{day}-2',
+             'cost': 60, 'notes': ''}
+        ]
+    }
+
+
+def _make_response(content, input_tokens=0, output_tokens=0):
+    return SimpleNamespace(
+        status_code=200,
+        code='',
+        message='',
+        output=SimpleNamespace(choices=[
+            SimpleNamespace(message=SimpleNamespace(role='assistant', content=content))
+        ]),
+        usage=SimpleNamespace(input_tokens=input_tokens, output_tokens=output_tokens)
+    )
+
+
+class StubGeneration:
+    """与 dashscope.Generation 接口兼容的替身"""
+
+    @classmethod
+    def call(cls, model=None, messages=None, stream=False, **kwargs):
+        if stream:
+            return cls._stream(messages, kwargs.get('incremental_output', False))
+
+        time.sleep(Config.DASHSCOPE_STUB_LATENCY)
+        return cls._complete(messages)
+
+    @classmethod
+    def _complete(cls, messages):
+        user_input = messages[-1]['content'] if messages else ''
+        system_prompt = messages[0]['content'] if messages else ''
+        if '预算分析' in system_prompt:
+            plan_ids = re.findall(r'计划 #(\d+)', user_input)
+            content = json.dumps({plan_id: ['预算使用正常，建议控制餐饮开销。'] for plan_id in plan_ids},
+                                 ensure_ascii=False)
+        elif '单日行程' in system_prompt:
+            content = json.dumps(_build_stub_day(user_input), ensure_ascii=False)
+        else:
+            content = json.dumps(_build_stub_plan(user_input), ensure_ascii=False)
+
+        prompt_chars = sum(len(m['content']) for m in messages or [])
+        return _make_response(content, input_tokens=prompt_chars, output_tokens=len(content))
+
+    @classmethod
+    def _stream(cls, messages, incremental_output, chunk_size=40):
+        """按固定大小切分完整响应，总耗时与非流式调用一致"""
+        full = cls._complete(messages)
+        content = full.output.choices[0].message.content
+        chunks = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)] or ['']
+        delay = Config.DASHSCOPE_STUB_LATENCY / len(chunks)
+
+        sent = ''
+        for chunk in chunks:
+            time.sleep(delay)
+            sent += chunk
+            yield _make_response(chunk if incremental_output else sent,
+                                 input_tokens=full.usage.input_tokens, output_tokens=len(sent))
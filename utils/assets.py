@@ -0,0 +1,230 @@
+"""静态资源构建：压缩空白、按内容哈希重命名、预先生成 gzip / brotli 版本
+
+构建结果写入 static/dist/，manifest.json 记录源文件到带哈希文件名的映射。
+模板通过 asset_url('js/main.js') 引用资源；没有构建结果时回退到原始文件。
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+
+try:
+    import brotli
+except ImportError:  # 可选依赖，没有安装时只生成 gzip 版本
+    brotli = None
+
+ASSET_FILES = ('css/style.css', 'js/main.js')
+DIST_DIR = 'dist'
+
+# 出现在这些字符之后的 / 是正则表达式的开头，而不是除号
+_REGEX_PREFIX = set('(,=:[!&|?{};+-*%<>~^')
+
+
+def minify_css(text):
+    """去掉注释和多余空白"""
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{}:;,>])\s*', r'\1', text)
+    return text.replace(';}', '}').strip()
+
+
+def minify_js(text):
+    """去掉注释、行首缩进和空行
+
+    保留换行，不依赖自动分号插入规则的细节；字符串、模板字符串
+    （包括 ${} 中嵌套的模板）和正则表达式里的内容原样保留。
+    """
+    out = []
+    i = 0
+    n = len(text)
+    # 模板字符串嵌套栈：元素为 ${ 表达式中未闭合的 { 个数
+    templates = []
+    in_template = False
+    last = ''
+    line_start = True
+
+    while i < n:
+        c = text[i]
+        if in_template:
+            if c == '\\':
+                out.append(text[i:i + 2])
+                i += 2
+                continue
+            if c == '`':
+                in_template = False
+                last = '`'
+            elif text.startswith('${', i):
+                templates.append(0)
+                in_template = False
+                out.append('${')
+                i += 2
+                last = '{'
+                continue
+            out.append(c)
+            i += 1
+            continue
+
+        if line_start and c in ' \t':
+            i += 1
+            continue
+        if c == '\n':
+            # 去掉行尾空白，跳过空行
+            while out and out[-1] in (' ', '\t'):
+                out.pop()
+            if out and out[-1] != '\n':
+                out.append('\n')
+            line_start = True
+            i += 1
+            continue
+        line_start = False
+
+        if text.startswith('//', i):
+            end = text.find('\n', i)
+            i = n if end < 0 else end
+            continue
+        if text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+            continue
+        if c in '\'"':
+            j = i + 1
+            while j < n and text[j] != c:
+                j += 2 if text[j] == '\\' else 1
+            out.append(text[i:j + 1])
+            i = j + 1
+            last = c
+            continue
+        if c == '`':
+            in_template = True
+            out.append(c)
+            i += 1
+            continue
+        if c == '/' and (last in _REGEX_PREFIX or last == ''):
+            j = i + 1
+            in_class = False
+            while j < n and text[j] != '\n':
+                if text[j] == '\\':
+                    j += 2
+                    continue
+                if text[j] == '[':
+                    in_class = True
+                elif text[j] == ']':
+                    in_class = False
+                elif text[j] == '/' and not in_class:
+                    break
+                j += 1
+            out.append(text[i:j + 1])
+            i = j + 1
+            last = '/'
+            continue
+        if templates:
+            if c == '{':
+                templates[-1] += 1
+            elif c == '}':
+                if templates[-1] == 0:
+                    templates.pop()
+                    in_template = True
+                    out.append(c)
+                    i += 1
+                    continue
+                templates[-1] -= 1
+        out.append(c)
+        if not c.isspace():
+            last = c
+        i += 1
+    return ''.join(out).strip() + '\n'
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+def build_assets(static_dir, files=ASSET_FILES, level=9):
+    """构建全部资源并写入 manifest，返回 manifest 字典"""
+    dist_dir = os.path.join(static_dir, DIST_DIR)
+    manifest = {}
+    for name in files:
+        with open(os.path.join(static_dir, name), encoding='utf-8') as f:
+            source = f.read()
+        root, ext = os.path.splitext(name)
+        minified = MINIFIERS.get(ext, lambda text: text)(source).encode('utf-8')
+        digest = hashlib.sha256(minified).hexdigest()[:10]
+        target = f'{DIST_DIR}/{root}.{digest}{ext}'
+        path = os.path.join(static_dir, target)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(minified)
+        # mtime 固定为 0，相同内容每次构建得到相同的 .gz 文件
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(minified, compresslevel=level, mtime=0))
+        if brotli:
+            with open(path + '.br', 'wb') as f:
+                f.write(brotli.compress(minified, quality=11))
+        manifest[name] = target
+        print(f"{name}: {len(source.encode('utf-8'))} -> {len(minified)} 字节 -> {target}")
+
+    os.makedirs(dist_dir, exist_ok=True)
+    with open(os.path.join(dist_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    _remove_stale(dist_dir, manifest)
+    return manifest
+
+
+def _remove_stale(dist_dir, manifest):
+    """删除旧版本的构建结果"""
+    current = {os.path.basename(target) for target in manifest.values()}
+    for root, _, names in os.walk(dist_dir):
+        for name in names:
+            base = name[:-3] if name.endswith(('.gz', '.br')) else name
+            if name != 'manifest.json' and base not in current:
+                os.remove(os.path.join(root, name))
+
+
+class AssetManifest:
+    """读取构建生成的 manifest，把源文件名映射为带哈希的文件名
+
+    manifest 文件变化时自动重新加载（重新构建后不需要重启进程）；
+    源文件比构建结果新时（开发时修改了代码）直接使用源文件。
+    """
+
+    def __init__(self, static_dir):
+        self.static_dir = static_dir
+        self.path = os.path.join(static_dir, DIST_DIR, 'manifest.json')
+        self._mtime = None
+        self._mapping = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, filename):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return filename
+        if mtime != self._mtime:
+            with self._lock:
+                try:
+                    with open(self.path, encoding='utf-8') as f:
+                        self._mapping = json.load(f)
+                    self._mtime = mtime
+                except (OSError, ValueError) as e:
+                    print(f"读取资源清单错误: {e}")
+        try:
+            if os.path.getmtime(os.path.join(self.static_dir, filename)) > mtime:
+                return filename
+        except OSError:
+            pass
+        return self._mapping.get(filename, filename)
+
+
+def choose_encoding(accept_encoding, path):
+    """根据 Accept-Encoding 选择预压缩版本，返回 (文件路径, Content-Encoding)"""
+    accept = accept_encoding or ''
+    if 'br' in accept and os.path.exists(path + '.br'):
+        return path + '.br', 'br'
+    if 'gzip' in accept and os.path.exists(path + '.gz'):
+        return path + '.gz', 'gzip'
+    return path, None
+
+
+if __name__ == '__main__':
+    build_assets(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static'))
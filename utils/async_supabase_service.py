@@ -0,0 +1,508 @@
+import asyncio
+import copy
+import json
+import random
+import threading
+import time
+from datetime import datetime
+import httpx
+from config import Config
+from utils.cache import TTLCache
+from utils.plan_utils import encode_cursor, decode_cursor
+from utils.plan_costs import extract_plan_columns
+from utils.plan_export import EXPORT_COLUMNS, prepare_import_row
+from utils.plan_patch import touches_costs, touches_search
+from utils.plan_search import format_search_response, like_pattern, split_terms
+from utils.expense_utils import build_expense_summary, validate_expenses
+from utils.budget_analysis import group_budget_inputs
+from utils.password_service import get_password_hasher
+from utils.metrics import SUPABASE_HTTP_SECONDS
+
+PLAN_LIST_COLUMNS = 'id,title,destination,duration,total_budget,day_count,created_at,updated_at'
+
+
+class SupabaseRequestError(Exception):
+    def __init__(self, status_code, body):
+        super().__init__(f'PostgREST {status_code}: {body}')
+        self.status_code = status_code
+        self.body = body
+
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PATCH', 'DELETE')
+# 连接没有建立（或没有拿到连接池中的连接），请求一定没有发出
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class AsyncSupabaseService:
+    """异步 Supabase 服务，接口与 DatabaseService 一致（方法均为协程）
+
+    直接调用 PostgREST REST 接口：
+    - 使用带连接池和 keep-alive 的 httpx.AsyncClient；
+    - 相同的并发读请求合并为一次 HTTP 调用；
+    - 每次请求有超时，网络错误、429 和 5xx 按指数退避重试；不幂等的 POST（插入、
+      rpc/apply_plan_patch）只在连接阶段失败、请求没有发出时重试，避免重复写入。
+    """
+
+    def __init__(self, url=None, key=None, timeout=None, max_retries=None, max_connections=None):
+        url = url or Config.SUPABASE_URL
+        key = key or Config.SUPABASE_KEY
+        self.rest_url = f"{url.rstrip('/')}/rest/v1"
+        self.headers = {'apikey': key, 'Authorization': f'Bearer {key}'}
+        self.timeout = timeout or Config.SUPABASE_TIMEOUT
+        self.max_retries = Config.SUPABASE_MAX_RETRIES if max_retries is None else max_retries
+        self.max_connections = max_connections or Config.SUPABASE_MAX_CONNECTIONS
+        self.retry_backoff = 0.2
+        self._client = None
+        self._inflight = {}
+        self.http_requests = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.plan_cache = TTLCache(maxsize=Config.PLAN_DETAIL_CACHE_SIZE, ttl=Config.PLAN_DETAIL_CACHE_TTL)
+
+    def _get_client(self):
+        # 在事件循环中首次使用时创建
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.rest_url,
+                headers=self.headers,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=30
+                )
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _request(self, method, table, params=None, payload=None, prefer=None, idempotent=None):
+        """idempotent 默认按方法判断：GET、HEAD、按主键的 PATCH 和 DELETE 可以安全重试，POST 不行"""
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        headers = {'Prefer': prefer} if prefer else None
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.http_requests += 1
+                start = time.perf_counter()
+                response = await self._get_client().request(
+                    method, f'/{table}', params=params, json=payload, headers=headers
+                )
+                SUPABASE_HTTP_SECONDS.observe(time.perf_counter() - start, method=method, table=table,
+                                              status=response.status_code)
+                if response.status_code == 429 or response.status_code >= 500:
+                    raise SupabaseRequestError(response.status_code, response.text)
+                if response.status_code >= 400:
+                    # 4xx 属于请求本身的问题，不重试
+                    raise SupabaseRequestError(response.status_code, response.text)
+                return response.json() if response.content else None
+            except (httpx.TransportError, SupabaseRequestError) as e:
+                if idempotent:
+                    retryable = not isinstance(e, SupabaseRequestError) or e.status_code == 429 or e.status_code >= 500
+                else:
+                    # 请求可能已经在服务端执行，只有确定没有发出时才重试
+                    retryable = isinstance(e, NOT_SENT_ERRORS)
+                if not retryable or attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                await asyncio.sleep(self.retry_backoff * (2 ** attempt) * (0.5 + random.random()))
+
+    async def _select(self, table, params):
+        """GET 查询：参数完全相同的并发请求共享同一次 HTTP 调用"""
+        key = (table, tuple(sorted(params.items())))
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._request('GET', table, params=params)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待者时标记异常已被处理
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def hash_password(self, password):
+        """密码哈希（scrypt，在独立的计算池中执行）"""
+        return get_password_hasher().hash(password)
+
+    def _decode_plan_data(self, plan_data):
+        if isinstance(plan_data, str):
+            return json.loads(plan_data)
+        return plan_data
+
+    async def create_user(self, username, email, password):
+        """创建用户"""
+        password_hash = await asyncio.wrap_future(get_password_hasher().submit_hash(password))
+        try:
+            await self._request('POST', 'users', payload={
+                'username': username,
+                'email': email,
+                'password_hash': password_hash
+            })
+            return True, '注册成功'
+        except SupabaseRequestError as e:
+            if e.status_code == 409 or 'duplicate' in e.body.lower():
+                return False, '用户名或邮箱已存在'
+            return False, f'注册失败: {e}'
+        except Exception as e:
+            return False, f'注册失败: {e}'
+
+    async def authenticate_user(self, username, password):
+        """验证用户；旧格式的密码哈希在登录成功时自动升级。哈希计算不占用事件循环"""
+        try:
+            rows = await self._request('GET', 'users', params={'select': '*', 'username': f'eq.{username}'})
+        except Exception as e:
+            print(f"认证错误: {e}")
+            return None
+
+        hasher = get_password_hasher()
+        if not rows:
+            await asyncio.wrap_future(hasher.dummy_verify(password))
+            return None
+        user = rows[0]
+        if not await asyncio.wrap_future(hasher.submit_verify(password, user['password_hash'])):
+            return None
+
+        if hasher.needs_rehash(user['password_hash']):
+            password_hash = await asyncio.wrap_future(hasher.submit_hash(password))
+            try:
+                rows = await self._request('PATCH', 'users', params={'id': f'eq.{user["id"]}', 'select': 'id'},
+                                           payload={'password_hash': password_hash},
+                                           prefer='return=representation')
+                if not rows:
+                    print("更新密码哈希失败: 没有更新到用户行（users 表的更新权限只授予 service_role）")
+            except Exception as e:
+                print(f"更新密码哈希错误: {e}")
+        return user
+
+    async def get_user_by_id(self, user_id):
+        """根据 ID 获取用户"""
+        try:
+            rows = await self._select('users', {'select': '*', 'id': f'eq.{user_id}'})
+            return rows[0] if rows else None
+        except Exception as e:
+            print(f"获取用户错误: {e}")
+            return None
+
+    async def save_travel_plan(self, user_id, plan_data):
+        """保存旅行计划"""
+        try:
+            rows = await self._request('POST', 'travel_plans', payload={
+                'user_id': user_id,
+                'title': plan_data.get('destination', '未命名计划'),
+                'plan_data': plan_data,
+                **extract_plan_columns(plan_data)
+            }, prefer='return=representation')
+            return rows[0]['id'] if rows else None
+        except Exception as e:
+            print(f"保存计划错误: {e}")
+            return None
+
+    async def get_user_plans(self, user_id):
+        """获取用户的所有计划"""
+        try:
+            return await self._select('travel_plans', {
+                'select': PLAN_LIST_COLUMNS,
+                'user_id': f'eq.{user_id}',
+                'order': 'created_at.desc,id.desc'
+            }) or []
+        except Exception as e:
+            print(f"获取计划列表错误: {e}")
+            return []
+
+    async def get_user_plans_page(self, user_id, limit, cursor=None):
+        """按 (created_at, id) 键集分页获取计划列表，返回 (plans, next_cursor)"""
+        params = {
+            'select': PLAN_LIST_COLUMNS,
+            'user_id': f'eq.{user_id}',
+            'order': 'created_at.desc,id.desc',
+            'limit': str(limit + 1)
+        }
+        if cursor:
+            created_at, plan_id = decode_cursor(cursor)
+            params['or'] = f'(created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{plan_id}))'
+
+        try:
+            rows = await self._select('travel_plans', params) or []
+        except Exception as e:
+            print(f"获取计划列表错误: {e}")
+            return [], None
+
+        plans = rows[:limit]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(plans[-1]['created_at'], plans[-1]['id'])
+        return plans, next_cursor
+
+    async def get_plan_by_id(self, plan_id, user_id):
+        """获取特定计划，已解析的结果会被缓存（返回副本，调用方修改不会影响缓存）"""
+        cached = self.plan_cache.get(int(plan_id))
+        if cached is not None:
+            return copy.deepcopy(cached) if str(cached['user_id']) == str(user_id) else None
+
+        try:
+            rows = await self._select('travel_plans', {
+                'select': '*', 'id': f'eq.{plan_id}', 'user_id': f'eq.{user_id}'
+            })
+            if rows:
+                plan = rows[0]
+                plan['plan_data'] = self._decode_plan_data(plan['plan_data'])
+                self.plan_cache.set(int(plan['id']), copy.deepcopy(plan))
+                return plan
+            return None
+        except Exception as e:
+            print(f"获取计划详情错误: {e}")
+            return None
+
+    async def get_plan_day(self, plan_id, user_id, day_index):
+        """通过 JSONB 路径查询只取出某一天的行程"""
+        try:
+            rows = await self._select('travel_plans', {
+                'select': f'day:plan_data->itinerary->{int(day_index)}',
+                'id': f'eq.{plan_id}',
+                'user_id': f'eq.{user_id}'
+            })
+            return rows[0]['day'] if rows else None
+        except Exception as e:
+            print(f"获取行程天错误: {e}")
+            return None
+
+    async def update_plan(self, plan_id, user_id, plan_data):
+        """更新旅行计划"""
+        try:
+            rows = await self._request('PATCH', 'travel_plans', params={
+                'id': f'eq.{plan_id}', 'user_id': f'eq.{user_id}', 'select': 'id'
+            }, payload={
+                'title': plan_data.get('destination', '未命名计划'),
+                'plan_data': plan_data,
+                'updated_at': datetime.utcnow().isoformat(),
+                **extract_plan_columns(plan_data)
+            }, prefer='return=representation')
+            self.plan_cache.delete(int(plan_id))
+            # 计划不存在或不属于该用户时没有更新到任何行
+            return bool(rows)
+        except Exception as e:
+            print(f"更新计划错误: {e}")
+            return False
+
+    async def apply_plan_patch(self, plan_id, user_id, ops):
+        """按 JSON Patch 局部修改计划，由数据库函数 apply_plan_patch 在服务端合并"""
+        try:
+            result = await self._request('POST', 'rpc/apply_plan_patch', payload={
+                'p_plan_id': plan_id, 'p_user_id': user_id, 'p_ops': ops
+            })
+            if result and (touches_costs(ops) or touches_search(ops)):
+                await self._refresh_derived_columns(plan_id)
+            self.plan_cache.delete(int(plan_id))
+            return bool(result)
+        except Exception as e:
+            print(f"局部更新计划错误: {e}")
+            return False
+
+    async def _refresh_derived_columns(self, plan_id):
+        """数据库函数无法生成费用摘要和检索文本，补丁改动相关字段后读回计划重新计算"""
+        rows = await self._request('GET', 'travel_plans', params={'select': 'plan_data', 'id': f'eq.{plan_id}'})
+        if rows:
+            columns = extract_plan_columns(rows[0]['plan_data'])
+            await self._request('PATCH', 'travel_plans', params={'id': f'eq.{plan_id}'}, payload={
+                'cost_summary': columns['cost_summary'], 'search_text': columns['search_text']
+            })
+
+    async def delete_plan(self, plan_id, user_id):
+        """删除旅行计划"""
+        try:
+            await self._request('DELETE', 'travel_plans', params={
+                'id': f'eq.{plan_id}', 'user_id': f'eq.{user_id}'
+            })
+            self.plan_cache.delete(int(plan_id))
+            return True
+        except Exception as e:
+            print(f"删除计划错误: {e}")
+            return False
+
+    async def add_expense(self, plan_id, user_id, expense_data):
+        """添加费用记录"""
+        try:
+            await self._request('POST', 'expenses', payload={
+                'plan_id': plan_id,
+                'user_id': user_id,
+                'category': expense_data['category'],
+                'amount': expense_data['amount'],
+                'description': expense_data.get('description', ''),
+                'date': expense_data['date']
+            })
+            return True
+        except Exception as e:
+            print(f"添加费用记录错误: {e}")
+            return False
+
+    async def add_expenses(self, plan_id, user_id, expenses):
+        """批量添加费用记录：一次 HTTP 请求批量插入，返回每条的结果"""
+        valid, results = validate_expenses(expenses)
+        if not valid:
+            return results
+
+        try:
+            owner = await self._request('GET', 'travel_plans', params={
+                'select': 'id', 'id': f'eq.{plan_id}', 'user_id': f'eq.{user_id}'
+            })
+            if not owner:
+                error = '计划不存在'
+            else:
+                rows = [{'plan_id': plan_id, 'user_id': user_id, **expense} for _, expense in valid]
+                await self._request('POST', 'expenses', payload=rows)
+                error = None
+        except Exception as e:
+            print(f"批量添加费用记录错误: {e}")
+            error = '保存失败'
+
+        if error:
+            for index, _ in valid:
+                results[index].update(success=False, error=error)
+        return results
+
+    async def get_plan_expenses(self, plan_id, user_id):
+        """获取计划的所有费用记录"""
+        try:
+            return await self._select('expenses', {
+                'select': '*', 'plan_id': f'eq.{plan_id}', 'user_id': f'eq.{user_id}', 'order': 'date.desc'
+            }) or []
+        except Exception as e:
+            print(f"获取费用记录错误: {e}")
+            return []
+
+    async def delete_expense(self, expense_id, user_id):
+        """删除费用记录"""
+        try:
+            rows = await self._request('DELETE', 'expenses', params={
+                'id': f'eq.{expense_id}', 'user_id': f'eq.{user_id}'
+            }, prefer='return=representation')
+            return bool(rows)
+        except Exception as e:
+            print(f"删除费用记录错误: {e}")
+            return False
+
+    async def get_expense_summary(self, plan_id, user_id):
+        """从汇总表读取计划的费用总计、分类合计和每日合计"""
+        try:
+            rows = await self._select('expense_summaries', {
+                'select': 'category,date,total,count', 'plan_id': f'eq.{plan_id}', 'user_id': f'eq.{user_id}'
+            })
+            return build_expense_summary(rows or [])
+        except Exception as e:
+            print(f"获取费用汇总错误: {e}")
+            return build_expense_summary([])
+
+    async def get_budget_inputs(self, plan_ids, user_id):
+        """批量读取多个计划的预算拆分和费用汇总，两条查询并发执行"""
+        plan_ids = [int(plan_id) for plan_id in plan_ids]
+        if not plan_ids:
+            return []
+        ids = f'in.({",".join(str(plan_id) for plan_id in plan_ids)})'
+        try:
+            plans, rows = await asyncio.gather(
+                self._select('travel_plans', {
+                    'select': 'id,destination,total_budget,cost_summary,budget_breakdown:plan_data->budget_breakdown',
+                    'user_id': f'eq.{user_id}', 'id': ids
+                }),
+                self._select('expense_summaries', {
+                    'select': 'plan_id,category,date,total,count', 'user_id': f'eq.{user_id}', 'plan_id': ids
+                })
+            )
+            return group_budget_inputs(plan_ids, plans or [], rows or [])
+        except Exception as e:
+            print(f"获取预算数据错误: {e}")
+            return []
+
+    async def search_plans(self, user_id, query='', filters=None, limit=20, offset=0):
+        """由数据库函数 search_plans 完成全文检索和分面统计，返回摘要而不读取 plan_data"""
+        terms = split_terms(query)
+        try:
+            data = await self._request('POST', 'rpc/search_plans', idempotent=True, payload={
+                'p_user_id': user_id,
+                'p_query': ' '.join(terms),
+                'p_terms': [like_pattern(term) for term in terms],
+                'p_filters': filters or {},
+                'p_limit': limit,
+                'p_offset': offset
+            })
+            return format_search_response(data or {}, terms)
+        except Exception as e:
+            print(f"检索计划错误: {e}")
+            return None
+
+    async def export_rows(self, table, after_id=0, limit=1000, user_id=None):
+        """按 id 顺序读取 after_id 之后的一批行，失败时抛出异常"""
+        params = {'select': ','.join(EXPORT_COLUMNS[table]), 'id': f'gt.{after_id}', 'order': 'id', 'limit': limit}
+        if user_id is not None:
+            params['user_id'] = f'eq.{user_id}'
+        rows = await self._request('GET', table, params=params) or []
+        if table == 'travel_plans':
+            for row in rows:
+                row['plan_data'] = self._decode_plan_data(row['plan_data'])
+        return rows
+
+    async def import_rows(self, table, rows, keep_ids=True):
+        """一次请求批量写入，返回各行的 id；keep_ids 为真时保留原 id，已存在的行跳过，失败时抛出异常"""
+        payload = [prepare_import_row(table, row, keep_ids) for row in rows]
+        if keep_ids:
+            # 按原 id 写入、已存在的跳过，重复执行结果相同
+            await self._request('POST', table, params={'on_conflict': 'id'}, payload=payload,
+                                prefer='resolution=ignore-duplicates,return=minimal', idempotent=True)
+            return [row['id'] for row in payload]
+        result = await self._request('POST', table, params={'select': 'id'}, payload=payload,
+                                     prefer='return=representation')
+        return [row['id'] for row in result]
+
+    async def sync_id_sequences(self):
+        """按原 id 导入后把自增序列推进到各表的最大 id"""
+        await self._request('POST', 'rpc/sync_id_sequences', payload={}, idempotent=True)
+
+    def stats(self):
+        return {
+            'http_requests': self.http_requests,
+            'coalesced': self.coalesced,
+            'retries': self.retries,
+            'inflight': len(self._inflight)
+        }
+
+
+class BlockingServiceAdapter:
+    """在后台线程的事件循环中运行异步服务，供同步的 Flask 视图调用
+
+    所有请求共享同一个事件循环和 HTTP 连接池，因此不同 worker 线程
+    对同一数据的并发读取也能被合并。
+    """
+
+    def __init__(self, async_service):
+        self.async_service = async_service
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='supabase-loop', daemon=True)
+        self._thread.start()
+
+    def __getattr__(self, name):
+        attr = getattr(self.async_service, name)
+        if not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            future = asyncio.run_coroutine_threadsafe(attr(*args, **kwargs), self._loop)
+            return future.result()
+
+        call.__name__ = name
+        return call
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.async_service.close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
@@ -0,0 +1,162 @@
+"""预算分析：按计划的预算拆分和费用汇总在本地计算占比和超支标记
+
+比例、剩余预算和超支判断都在本地完成，大模型只用于生成节省建议；
+建议按 (预算, 费用汇总) 的哈希缓存，多个计划合并到一次模型请求中。
+"""
+import hashlib
+import json
+from utils.expense_utils import build_expense_summary, format_summary_for_prompt
+from utils.plan_utils import parse_number
+
+# 修改分析规则或建议提示词时递增，使旧的缓存结果失效
+BUDGET_ANALYSIS_VERSION = '1'
+
+BUDGET_CATEGORIES = ('transportation', 'accommodation', 'food', 'activities', 'shopping', 'emergency')
+
+# 费用类别是用户自由输入的文本，按关键词归入计划的预算类别
+_CATEGORY_KEYWORDS = (
+    ('transportation', ('交通', '机票', '飞机', '高铁', '火车', '动车', '打车', '出租', '地铁', '公交', '租车', '油费', '车')),
+    ('accommodation', ('住宿', '酒店', '民宿', '宾馆', '旅馆', '房')),
+    ('food', ('餐', '饮', '吃', '食', '饭', '咖啡', '茶', '小吃', '零食')),
+    ('activities', ('门票', '景点', '活动', '娱乐', '演出', '游玩', '体验', '导游', '票')),
+    ('shopping', ('购物', '纪念品', '特产', '礼物', '衣服')),
+    ('emergency', ('应急', '医疗', '药', '保险'))
+)
+
+
+def budget_category(expense_category):
+    """把费用类别映射到预算类别，无法归类的返回 'other'"""
+    text = str(expense_category or '').strip().lower()
+    if text in BUDGET_CATEGORIES:
+        return text
+    for category, keywords in _CATEGORY_KEYWORDS:
+        if any(keyword in text for keyword in keywords):
+            return category
+    return 'other'
+
+
+def group_budget_inputs(plan_ids, plans, summary_rows):
+    """把计划行和费用汇总行合并为预算分析的输入，按 plan_ids 的顺序返回（不属于用户的计划不出现）"""
+    rows_by_plan = {}
+    for row in summary_rows:
+        rows_by_plan.setdefault(int(row['plan_id']), []).append(row)
+
+    plans_by_id = {int(plan['id']): plan for plan in plans}
+    inputs = []
+    for plan_id in plan_ids:
+        plan = plans_by_id.get(int(plan_id))
+        if not plan:
+            continue
+        breakdown = _json_value(plan.get('budget_breakdown'))
+        cost_summary = _json_value(plan.get('cost_summary'))
+        inputs.append({
+            'id': int(plan_id),
+            'destination': plan.get('destination'),
+            'total_budget': plan.get('total_budget'),
+            'budget_breakdown': breakdown if isinstance(breakdown, dict) else {},
+            'cost_summary': cost_summary if isinstance(cost_summary, dict) else None,
+            'expenses': build_expense_summary(rows_by_plan.get(int(plan_id), []))
+        })
+    return inputs
+
+
+def _json_value(value):
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return None
+    return value
+
+
+def analyze_locally(item, warn_ratio=0.8):
+    """计算总预算和各类别的使用比例、占比及超支标记"""
+    breakdown = item['budget_breakdown']
+    expenses = item['expenses']
+    budget = parse_number(breakdown.get('total'), 0) or parse_number(item.get('total_budget'), 0) or 0
+    spent = expenses['total']
+
+    spent_by_category = {}
+    for name, amount in expenses['by_category'].items():
+        key = budget_category(name)
+        spent_by_category[key] = spent_by_category.get(key, 0.0) + amount
+
+    categories = {}
+    flags = []
+    for key in BUDGET_CATEGORIES + ('other',):
+        planned = 0 if key == 'other' else parse_number(breakdown.get(key), 0) or 0
+        category_spent = round(spent_by_category.get(key, 0.0), 2)
+        if not planned and not category_spent:
+            continue
+        status = _status(category_spent, planned, warn_ratio)
+        categories[key] = {
+            'planned': planned,
+            'spent': category_spent,
+            'used_ratio': round(category_spent / planned, 4) if planned else None,
+            'share': round(category_spent / spent, 4) if spent else 0.0,
+            'status': status
+        }
+        if status in ('over', 'unplanned'):
+            flags.append(f'{status}:{key}')
+
+    # 保存计划时预先计算的行程费用，用于对照实际花费
+    cost_summary = item.get('cost_summary') or {}
+    for key, amount in (cost_summary.get('by_category') or {}).items():
+        if key in categories:
+            categories[key]['itemized'] = amount
+
+    overall = _status(spent, budget, warn_ratio)
+    if overall == 'over':
+        flags.insert(0, 'over_budget')
+    elif overall == 'warning':
+        flags.insert(0, 'near_budget')
+    return {
+        'plan_id': item['id'],
+        'destination': item.get('destination'),
+        'budget': budget,
+        'spent': spent,
+        'remaining': round(budget - spent, 2) if budget else None,
+        'used_ratio': round(spent / budget, 4) if budget else None,
+        'status': overall,
+        'expense_count': expenses['count'],
+        'categories': categories,
+        'itemized_total': cost_summary.get('total'),
+        'plan_issues': cost_summary.get('issues') or [],
+        'flags': flags
+    }
+
+
+def _status(spent, planned, warn_ratio):
+    if not planned:
+        return 'unplanned' if spent else 'ok'
+    if spent > planned:
+        return 'over'
+    if spent >= planned * warn_ratio:
+        return 'warning'
+    return 'ok'
+
+
+def advice_cache_key(item, model):
+    """建议缓存的键：目的地、预算和费用汇总不变时键不变"""
+    raw = json.dumps({
+        'destination': item.get('destination'),
+        'budget': item['budget_breakdown'],
+        'total_budget': item.get('total_budget'),
+        'expenses': item['expenses'],
+        'model': model,
+        'version': BUDGET_ANALYSIS_VERSION
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def format_budget_for_prompt(item, analysis):
+    """一个计划的预算和费用汇总，压缩成几行文本放进批量请求"""
+    lines = [f"计划 #{item['id']}（{item.get('destination') or '未知目的地'}）：预算 {analysis['budget']} 元"]
+    planned = [f'{key} {value}' for key, value in item['budget_breakdown'].items()
+               if key in BUDGET_CATEGORIES and parse_number(value, 0)]
+    if planned:
+        lines.append('预算拆分：' + '；'.join(planned))
+    lines.append(format_summary_for_prompt(item['expenses']))
+    if analysis['flags']:
+        lines.append('标记：' + '，'.join(analysis['flags']))
+    return '\n'.join(lines)
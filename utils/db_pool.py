@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+from queue import LifoQueue, Empty, Full
+
+
+class ConnectionPool:
+    """线程安全的 SQLite 连接池
+
+    连接在创建时统一设置 WAL 日志模式和性能相关的 PRAGMA，
+    用完后归还到池中复用，避免每次查询都重新 connect/close。
+    连接长期存活，sqlite3 内置的预编译语句缓存（cached_statements）
+    因此可以跨请求复用。
+    """
+
+    def __init__(self, db_path, max_size=8, cache_size_kb=8192,
+                 mmap_size=64 * 1024 * 1024, statement_cache=128, busy_timeout=5.0,
+                 trace_callback=None):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.statement_cache = statement_cache
+        self.busy_timeout = busy_timeout
+        # 每条 SQL 执行前调用，用于统计语句数
+        self.trace_callback = trace_callback
+        self._idle = LifoQueue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self._created = 0
+        # fork 之后子进程不能继续使用父进程的连接
+        if hasattr(os, 'register_at_fork'):
+            ref = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: ref() and ref()._discard_after_fork())
+
+    def _create_connection(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout,
+            check_same_thread=False,
+            cached_statements=self.statement_cache
+        )
+        conn.row_factory = sqlite3.Row
+
+        # WAL 模式下读写互不阻塞；synchronous=NORMAL 在 WAL 下仍能保证一致性
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{int(self.cache_size_kb)}')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        if self.trace_callback:
+            conn.set_trace_callback(self.trace_callback)
+
+        with self._lock:
+            self._created += 1
+        return conn
+
+    def acquire(self):
+        """取出一个空闲连接，池为空时新建"""
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            return self._create_connection()
+
+    def release(self, conn):
+        """归还连接，池已满时直接关闭"""
+        try:
+            self._idle.put_nowait(conn)
+        except Full:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        """获取连接：正常结束时提交，出现异常时回滚"""
+        conn = self.acquire()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        """关闭池中所有空闲连接"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                break
+            conn.close()
+
+    def _discard_after_fork(self):
+        """子进程中丢弃继承来的空闲连接
+
+        不调用 close：关闭与父进程共享的连接可能影响父进程持有的文件锁，
+        这些连接对象只保留引用，由父进程负责关闭。
+        """
+        self._inherited = []
+        while True:
+            try:
+                self._inherited.append(self._idle.get_nowait())
+            except Empty:
+                break
+        self._lock = threading.Lock()
+
+    def stats(self):
+        return {
+            'created': self._created,
+            'idle': self._idle.qsize(),
+            'max_size': self.max_size
+        }
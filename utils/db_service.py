@@ -1,23 +1,80 @@
 import sqlite3
-import hashlib
+import copy
 import json
+from contextlib import contextmanager
 from datetime import datetime
 from config import Config
+from utils.db_pool import ConnectionPool
+from utils.cache import TTLCache
+from utils.plan_utils import encode_cursor, decode_cursor
+from utils.plan_costs import extract_plan_columns
+from utils.expense_utils import build_expense_summary, validate_expenses
+from utils.budget_analysis import group_budget_inputs
+from utils.password_service import get_password_hasher
+from utils.plan_patch import apply_patch, needs_array_insert, sqlite_path, touches_costs, touches_search, touches_summary
+from utils.plan_export import EXPORT_COLUMNS, prepare_import_row, sqlite_timestamp
+from utils.plan_search import TRIGRAM_MIN_LENGTH, format_search_response, fts_match_expression, like_pattern, split_terms
+from utils.metrics import sqlite_trace_callback
+
+# 计划表的派生列：列表和摘要视图直接读取，无需解析 plan_data
+PLAN_SUMMARY_COLUMNS = {
+    'destination': 'TEXT',
+    'duration': 'INTEGER',
+    'total_budget': 'REAL',
+    'day_count': 'INTEGER',
+    # 保存时预先计算的费用摘要（JSON）
+    'cost_summary': 'TEXT',
+    # 活动、地点、住宿和小贴士，由 FTS5 索引 plan_search 引用
+    'search_text': 'TEXT'
+}
+
+
+# 检索的筛选条件（取值由 plan_search.parse_filters 给出）
+SEARCH_FILTER_CLAUSES = {
+    'min_duration': 'p.duration >= ?',
+    'max_duration': 'p.duration <= ?',
+    'min_budget': 'p.total_budget >= ?',
+    'max_budget': 'p.total_budget < ?',
+    'month': 'substr(p.created_at, 1, 7) = ?'
+}
+
+
+def _dump_cost_summary(summary):
+    cost_summary = summary.get('cost_summary')
+    return json.dumps(cost_summary, ensure_ascii=False) if cost_summary is not None else None
 
 class DatabaseService:
-    def __init__(self):
-        self.db_path = Config.DATABASE_PATH
+    def __init__(self, db_path=None):
+        self.db_path = db_path or Config.DATABASE_PATH
+        self.pool = ConnectionPool(
+            self.db_path,
+            max_size=Config.SQLITE_POOL_SIZE,
+            cache_size_kb=Config.SQLITE_CACHE_SIZE_KB,
+            mmap_size=Config.SQLITE_MMAP_SIZE,
+            statement_cache=Config.SQLITE_STATEMENT_CACHE,
+            trace_callback=sqlite_trace_callback if Config.METRICS_ENABLED else None
+        )
+        # 已解析的计划详情缓存，更新/删除时失效
+        self.plan_cache = TTLCache(maxsize=Config.PLAN_DETAIL_CACHE_SIZE, ttl=Config.PLAN_DETAIL_CACHE_TTL)
+        # 是否有 FTS5 全文索引，init_db 时确定（未初始化的进程在首次检索时检查）
+        self.fts_enabled = None
     
-    def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+    @contextmanager
+    def connection(self):
+        """从连接池获取连接，正常结束时自动提交，异常时回滚"""
+        with self.pool.connection() as conn:
+            yield conn
     
     def init_db(self):
         """初始化数据库表"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
+        with self.connection() as conn:
+            self._create_tables(conn.cursor())
+            self._migrate_plan_columns(conn)
+            self._create_indexes(conn)
+            self._create_expense_summaries(conn)
+            self._create_search_index(conn)
+    
+    def _create_tables(self, cursor):
         # 用户表
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -57,28 +114,150 @@ class DatabaseService:
                 FOREIGN KEY (user_id) REFERENCES users (id)
             )
         ''')
+    
+    def _create_indexes(self, conn):
+        """列表分页和费用查询使用的索引"""
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_travel_plans_user_created ON travel_plans (user_id, created_at DESC, id DESC)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_expenses_plan_id ON expenses (plan_id)')
+    
+    def _create_expense_summaries(self, conn):
+        """费用汇总表：按 (计划, 类别, 日期) 聚合，由触发器在增删改费用时增量维护"""
+        created = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'expense_summaries'"
+        ).fetchone() is None
         
-        conn.commit()
-        conn.close()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS expense_summaries (
+                plan_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                category TEXT NOT NULL,
+                date TEXT NOT NULL,
+                total REAL NOT NULL DEFAULT 0,
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (plan_id, category, date)
+            )
+        ''')
+        conn.executescript('''
+            CREATE TRIGGER IF NOT EXISTS trg_expenses_summary_insert AFTER INSERT ON expenses
+            BEGIN
+                INSERT INTO expense_summaries (plan_id, user_id, category, date, total, count)
+                VALUES (NEW.plan_id, NEW.user_id, NEW.category, NEW.date, NEW.amount, 1)
+                ON CONFLICT (plan_id, category, date)
+                DO UPDATE SET total = total + excluded.total, count = count + 1;
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS trg_expenses_summary_delete AFTER DELETE ON expenses
+            BEGIN
+                UPDATE expense_summaries SET total = total - OLD.amount, count = count - 1
+                WHERE plan_id = OLD.plan_id AND category = OLD.category AND date = OLD.date;
+                DELETE FROM expense_summaries
+                WHERE plan_id = OLD.plan_id AND category = OLD.category AND date = OLD.date AND count <= 0;
+            END;
+            
+            CREATE TRIGGER IF NOT EXISTS trg_expenses_summary_update AFTER UPDATE OF plan_id, category, amount, date ON expenses
+            BEGIN
+                UPDATE expense_summaries SET total = total - OLD.amount, count = count - 1
+                WHERE plan_id = OLD.plan_id AND category = OLD.category AND date = OLD.date;
+                DELETE FROM expense_summaries
+                WHERE plan_id = OLD.plan_id AND category = OLD.category AND date = OLD.date AND count <= 0;
+                INSERT INTO expense_summaries (plan_id, user_id, category, date, total, count)
+                VALUES (NEW.plan_id, NEW.user_id, NEW.category, NEW.date, NEW.amount, 1)
+                ON CONFLICT (plan_id, category, date)
+                DO UPDATE SET total = total + excluded.total, count = count + 1;
+            END;
+        ''')
+        
+        if created:
+            self._rebuild_expense_summaries(conn)
+    
+    def _create_search_index(self, conn):
+        """计划的全文索引：FTS5 外部内容表（trigram 分词），内容取自 travel_plans，由触发器同步"""
+        created = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'plan_search'"
+        ).fetchone() is None
+        try:
+            conn.executescript('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS plan_search USING fts5(
+                    destination, search_text,
+                    content = 'travel_plans', content_rowid = 'id', tokenize = 'trigram'
+                );
+                
+                CREATE TRIGGER IF NOT EXISTS trg_plan_search_insert AFTER INSERT ON travel_plans
+                BEGIN
+                    INSERT INTO plan_search (rowid, destination, search_text)
+                    VALUES (NEW.id, NEW.destination, NEW.search_text);
+                END;
+                
+                CREATE TRIGGER IF NOT EXISTS trg_plan_search_delete AFTER DELETE ON travel_plans
+                BEGIN
+                    INSERT INTO plan_search (plan_search, rowid, destination, search_text)
+                    VALUES ('delete', OLD.id, OLD.destination, OLD.search_text);
+                END;
+                
+                CREATE TRIGGER IF NOT EXISTS trg_plan_search_update AFTER UPDATE OF destination, search_text ON travel_plans
+                BEGIN
+                    INSERT INTO plan_search (plan_search, rowid, destination, search_text)
+                    VALUES ('delete', OLD.id, OLD.destination, OLD.search_text);
+                    INSERT INTO plan_search (rowid, destination, search_text)
+                    VALUES (NEW.id, NEW.destination, NEW.search_text);
+                END;
+            ''')
+        except sqlite3.OperationalError as e:
+            # SQLite 3.34 之前没有 trigram 分词，检索退回到 LIKE
+            print(f"创建全文索引错误: {e}")
+            self.fts_enabled = False
+            return
+        self.fts_enabled = True
+        if created:
+            conn.execute("INSERT INTO plan_search (plan_search) VALUES ('rebuild')")
+    
+    def _rebuild_expense_summaries(self, conn):
+        """根据费用明细重新计算汇总表"""
+        conn.execute('DELETE FROM expense_summaries')
+        conn.execute('''
+            INSERT INTO expense_summaries (plan_id, user_id, category, date, total, count)
+            SELECT plan_id, MIN(user_id), category, date, SUM(amount), COUNT(*)
+            FROM expenses GROUP BY plan_id, category, date
+        ''')
+    
+    def _migrate_plan_columns(self, conn):
+        """为旧数据库补充派生列，并回填已有计划"""
+        existing = {row['name'] for row in conn.execute('PRAGMA table_info(travel_plans)')}
+        missing = [name for name in PLAN_SUMMARY_COLUMNS if name not in existing]
+        for name in missing:
+            conn.execute(f'ALTER TABLE travel_plans ADD COLUMN {name} {PLAN_SUMMARY_COLUMNS[name]}')
+        
+        if missing:
+            rows = conn.execute('SELECT id, plan_data FROM travel_plans').fetchall()
+            updates = []
+            for row in rows:
+                try:
+                    summary = extract_plan_columns(json.loads(row['plan_data']))
+                except (ValueError, AttributeError):
+                    continue
+                updates.append((summary['destination'], summary['duration'], summary['total_budget'],
+                                summary['day_count'], _dump_cost_summary(summary), summary['search_text'], row['id']))
+            conn.executemany(
+                '''UPDATE travel_plans SET destination = ?, duration = ?, total_budget = ?, day_count = ?,
+                   cost_summary = ?, search_text = ? WHERE id = ?''',
+                updates
+            )
     
     def hash_password(self, password):
-        """密码哈希"""
-        return hashlib.sha256(password.encode()).hexdigest()
+        """密码哈希（scrypt，在独立的计算池中执行）"""
+        return get_password_hasher().hash(password)
     
     def create_user(self, username, email, password):
         """创建用户"""
+        password_hash = self.hash_password(password)
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            password_hash = self.hash_password(password)
-            cursor.execute(
-                'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
-                (username, email, password_hash)
-            )
-            
-            conn.commit()
-            conn.close()
+            with self.connection() as conn:
+                conn.execute(
+                    'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
+                    (username, email, password_hash)
+                )
             return True, '注册成功'
         except sqlite3.IntegrityError:
             return False, '用户名或邮箱已存在'
@@ -86,31 +265,33 @@ class DatabaseService:
             return False, f'注册失败: {str(e)}'
     
     def authenticate_user(self, username, password):
-        """验证用户"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        password_hash = self.hash_password(password)
-        cursor.execute(
-            'SELECT * FROM users WHERE username = ? AND password_hash = ?',
-            (username, password_hash)
-        )
+        """验证用户；旧格式的密码哈希在登录成功时自动升级"""
+        with self.connection() as conn:
+            user = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
         
-        user = cursor.fetchone()
-        conn.close()
+        hasher = get_password_hasher()
+        if not user:
+            hasher.dummy_verify(password).result()
+            return None
+        if not hasher.verify(password, user['password_hash']):
+            return None
         
-        if user:
-            return dict(user)
-        return None
+        user = dict(user)
+        if hasher.needs_rehash(user['password_hash']):
+            self._update_password_hash(user['id'], hasher.hash(password))
+        return user
+    
+    def _update_password_hash(self, user_id, password_hash):
+        try:
+            with self.connection() as conn:
+                conn.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
+        except Exception as e:
+            print(f"更新密码哈希错误: {e}")
     
     def get_user_by_id(self, user_id):
         """根据 ID 获取用户"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
-        user = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
         
         if user:
             return dict(user)
@@ -118,71 +299,163 @@ class DatabaseService:
     
     def save_travel_plan(self, user_id, plan_data):
         """保存旅行计划"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         title = plan_data.get('destination', '未命名计划')
         plan_json = json.dumps(plan_data, ensure_ascii=False)
+        summary = extract_plan_columns(plan_data)
         
-        cursor.execute(
-            'INSERT INTO travel_plans (user_id, title, plan_data) VALUES (?, ?, ?)',
-            (user_id, title, plan_json)
-        )
-        
-        plan_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.execute(
+                '''INSERT INTO travel_plans (user_id, title, plan_data, destination, duration, total_budget, day_count,
+                   cost_summary, search_text) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                (user_id, title, plan_json, summary['destination'], summary['duration'],
+                 summary['total_budget'], summary['day_count'], _dump_cost_summary(summary), summary['search_text'])
+            )
+            plan_id = cursor.lastrowid
         
         return plan_id
     
     def get_user_plans(self, user_id):
-        """获取用户的所有计划"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            'SELECT id, title, created_at, updated_at FROM travel_plans WHERE user_id = ? ORDER BY created_at DESC',
-            (user_id,)
-        )
+        """获取用户的所有计划（只读派生列，不解析计划内容）"""
+        with self.connection() as conn:
+            rows = conn.execute(
+                '''SELECT id, title, destination, duration, total_budget, day_count, created_at, updated_at
+                   FROM travel_plans WHERE user_id = ? ORDER BY created_at DESC, id DESC''',
+                (user_id,)
+            ).fetchall()
         
-        plans = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        return [dict(row) for row in rows]
+    
+    def get_user_plans_page(self, user_id, limit, cursor=None):
+        """按 (created_at, id) 键集分页获取计划列表，返回 (plans, next_cursor)"""
+        columns = 'id, title, destination, duration, total_budget, day_count, created_at, updated_at'
+        with self.connection() as conn:
+            if cursor:
+                created_at, plan_id = decode_cursor(cursor)
+                rows = conn.execute(
+                    f'''SELECT {columns} FROM travel_plans
+                        WHERE user_id = ? AND (created_at, id) < (?, ?)
+                        ORDER BY created_at DESC, id DESC LIMIT ?''',
+                    (user_id, created_at, plan_id, limit + 1)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    f'''SELECT {columns} FROM travel_plans
+                        WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT ?''',
+                    (user_id, limit + 1)
+                ).fetchall()
         
-        return plans
+        plans = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = plans[-1]
+            next_cursor = encode_cursor(last['created_at'], last['id'])
+        return plans, next_cursor
     
     def get_plan_by_id(self, plan_id, user_id):
-        """获取特定计划"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            'SELECT * FROM travel_plans WHERE id = ? AND user_id = ?',
-            (plan_id, user_id)
-        )
+        """获取特定计划，已解析的结果会被缓存（返回副本，调用方修改不会影响缓存）"""
+        cached = self.plan_cache.get(int(plan_id))
+        if cached is not None:
+            return copy.deepcopy(cached) if str(cached['user_id']) == str(user_id) else None
         
-        plan = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            plan = conn.execute(
+                'SELECT * FROM travel_plans WHERE id = ? AND user_id = ?',
+                (plan_id, user_id)
+            ).fetchone()
         
         if plan:
             plan_dict = dict(plan)
             plan_dict['plan_data'] = json.loads(plan_dict['plan_data'])
+            plan_dict['cost_summary'] = json.loads(plan_dict['cost_summary']) if plan_dict.get('cost_summary') else None
+            self.plan_cache.set(plan_dict['id'], copy.deepcopy(plan_dict))
             return plan_dict
         return None
     
+    def get_plan_day(self, plan_id, user_id, day_index):
+        """通过 JSON1 路径查询只取出某一天的行程"""
+        with self.connection() as conn:
+            row = conn.execute(
+                'SELECT json_extract(plan_data, ?) AS day FROM travel_plans WHERE id = ? AND user_id = ?',
+                (f'$.itinerary[{int(day_index)}]', plan_id, user_id)
+            ).fetchone()
+        
+        if row and row['day']:
+            return json.loads(row['day'])
+        return None
+    
+    def update_plan(self, plan_id, user_id, plan_data):
+        """整体更新旅行计划"""
+        summary = extract_plan_columns(plan_data)
+        try:
+            with self.connection() as conn:
+                cursor = conn.execute(
+                    '''UPDATE travel_plans SET title = ?, plan_data = ?, destination = ?, duration = ?,
+                       total_budget = ?, day_count = ?, cost_summary = ?, search_text = ?,
+                       updated_at = CURRENT_TIMESTAMP WHERE id = ? AND user_id = ?''',
+                    (plan_data.get('destination', '未命名计划'), json.dumps(plan_data, ensure_ascii=False),
+                     summary['destination'], summary['duration'], summary['total_budget'], summary['day_count'],
+                     _dump_cost_summary(summary), summary['search_text'], plan_id, user_id)
+                )
+            self.plan_cache.delete(int(plan_id))
+            return cursor.rowcount > 0
+        except Exception as e:
+            print(f"更新计划错误: {e}")
+            return False
+    
+    def apply_plan_patch(self, plan_id, user_id, ops):
+        """按 JSON Patch 局部修改计划：用 JSON1 函数只改写变化的路径，并更新 updated_at"""
+        if needs_array_insert(ops):
+            # json_insert 不能在数组中间插入，退回到整体更新
+            plan = self.get_plan_by_id(plan_id, user_id)
+            if not plan:
+                return False
+            return self.update_plan(plan_id, user_id, apply_patch(plan['plan_data'], ops))
+        
+        expression, params = 'plan_data', []
+        for op in ops:
+            path = sqlite_path(op['path'])
+            if op['op'] == 'remove':
+                expression = f'json_remove({expression}, ?)'
+                params.append(path)
+            else:
+                function = 'json_insert' if path.endswith('[#]') else 'json_set'
+                expression = f'{function}({expression}, ?, json(?))'
+                params.extend([path, json.dumps(op['value'], ensure_ascii=False)])
+        
+        try:
+            with self.connection() as conn:
+                cursor = conn.execute(
+                    f'''UPDATE travel_plans SET plan_data = {expression}, updated_at = CURRENT_TIMESTAMP
+                        WHERE id = ? AND user_id = ?''',
+                    params + [plan_id, user_id]
+                )
+                if cursor.rowcount and (touches_summary(ops) or touches_costs(ops) or touches_search(ops)):
+                    row = conn.execute('SELECT plan_data FROM travel_plans WHERE id = ?', (plan_id,)).fetchone()
+                    plan_data = json.loads(row['plan_data'])
+                    summary = extract_plan_columns(plan_data)
+                    conn.execute(
+                        '''UPDATE travel_plans SET title = ?, destination = ?, duration = ?, total_budget = ?,
+                           day_count = ?, cost_summary = ?, search_text = ? WHERE id = ?''',
+                        (plan_data.get('destination', '未命名计划'), summary['destination'], summary['duration'],
+                         summary['total_budget'], summary['day_count'], _dump_cost_summary(summary),
+                         summary['search_text'], plan_id)
+                    )
+            self.plan_cache.delete(int(plan_id))
+            return cursor.rowcount > 0
+        except Exception as e:
+            print(f"局部更新计划错误: {e}")
+            return False
+    
     def delete_plan(self, plan_id, user_id):
         """删除旅行计划"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            # 先删除关联的费用记录
-            cursor.execute('DELETE FROM expenses WHERE plan_id = ? AND user_id = ?', (plan_id, user_id))
-            
-            # 再删除计划
-            cursor.execute('DELETE FROM travel_plans WHERE id = ? AND user_id = ?', (plan_id, user_id))
-            
-            conn.commit()
-            conn.close()
+            with self.connection() as conn:
+                # 先删除关联的费用记录
+                conn.execute('DELETE FROM expenses WHERE plan_id = ? AND user_id = ?', (plan_id, user_id))
+                
+                # 再删除计划
+                conn.execute('DELETE FROM travel_plans WHERE id = ? AND user_id = ?', (plan_id, user_id))
+            self.plan_cache.delete(int(plan_id))
             return True
         except Exception as e:
             print(f"删除计划失败: {e}")
@@ -191,19 +464,193 @@ class DatabaseService:
     def add_expense(self, plan_id, user_id, expense_data):
         """添加费用记录"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                '''INSERT INTO expenses (plan_id, user_id, category, amount, description, date)
-                   VALUES (?, ?, ?, ?, ?, ?)''',
-                (plan_id, user_id, expense_data['category'], expense_data['amount'],
-                 expense_data.get('description', ''), expense_data['date'])
-            )
-            
-            conn.commit()
-            conn.close()
+            with self.connection() as conn:
+                conn.execute(
+                    '''INSERT INTO expenses (plan_id, user_id, category, amount, description, date)
+                       VALUES (?, ?, ?, ?, ?, ?)''',
+                    (plan_id, user_id, expense_data['category'], expense_data['amount'],
+                     expense_data.get('description', ''), expense_data['date'])
+                )
             return True
         except Exception as e:
             print(f"添加费用记录失败: {e}")
             return False
+    
+    def add_expenses(self, plan_id, user_id, expenses):
+        """批量添加费用记录：一次事务内 executemany 写入，返回每条的结果"""
+        valid, results = validate_expenses(expenses)
+        if not valid:
+            return results
+        
+        try:
+            with self.connection() as conn:
+                owner = conn.execute(
+                    'SELECT 1 FROM travel_plans WHERE id = ? AND user_id = ?', (plan_id, user_id)
+                ).fetchone()
+                if not owner:
+                    error = '计划不存在'
+                else:
+                    conn.executemany(
+                        '''INSERT INTO expenses (plan_id, user_id, category, amount, description, date)
+                           VALUES (?, ?, ?, ?, ?, ?)''',
+                        [(plan_id, user_id, e['category'], e['amount'], e['description'], e['date'])
+                         for _, e in valid]
+                    )
+                    error = None
+        except Exception as e:
+            print(f"批量添加费用记录失败: {e}")
+            error = '保存失败'
+        
+        if error:
+            for index, _ in valid:
+                results[index].update(success=False, error=error)
+        return results
+    
+    def get_plan_expenses(self, plan_id, user_id):
+        """获取计划的所有费用记录"""
+        with self.connection() as conn:
+            rows = conn.execute(
+                'SELECT * FROM expenses WHERE plan_id = ? AND user_id = ? ORDER BY date DESC, id DESC',
+                (plan_id, user_id)
+            ).fetchall()
+        return [dict(row) for row in rows]
+    
+    def delete_expense(self, expense_id, user_id):
+        """删除费用记录（汇总表由触发器同步更新）"""
+        try:
+            with self.connection() as conn:
+                cursor = conn.execute('DELETE FROM expenses WHERE id = ? AND user_id = ?', (expense_id, user_id))
+            return cursor.rowcount > 0
+        except Exception as e:
+            print(f"删除费用记录失败: {e}")
+            return False
+    
+    def get_expense_summary(self, plan_id, user_id):
+        """从汇总表读取计划的费用总计、分类合计和每日合计"""
+        with self.connection() as conn:
+            rows = conn.execute(
+                'SELECT category, date, total, count FROM expense_summaries WHERE plan_id = ? AND user_id = ?',
+                (plan_id, user_id)
+            ).fetchall()
+        return build_expense_summary(rows)
+    
+    def search_plans(self, user_id, query='', filters=None, limit=20, offset=0):
+        """全文检索用户的计划，返回按相关度排序的摘要、命中总数和分面计数"""
+        filters = filters or {}
+        terms = split_terms(query)
+        try:
+            with self.connection() as conn:
+                if self.fts_enabled is None:
+                    self.fts_enabled = conn.execute(
+                        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'plan_search'"
+                    ).fetchone() is not None
+                
+                # 足够长的词走 FTS5 MATCH，短词（如两个字的城市名）退回到 LIKE
+                match = fts_match_expression(terms) if self.fts_enabled else None
+                like_terms = [term for term in terms if not match or len(term) < TRIGRAM_MIN_LENGTH]
+                joins = 'JOIN plan_search ON plan_search.rowid = p.id' if match else ''
+                where, params = ['p.user_id = ?'], [user_id]
+                if match:
+                    where.append('plan_search MATCH ?')
+                    params.append(match)
+                for term in like_terms:
+                    where.append("(p.destination LIKE ? ESCAPE '\\' OR p.search_text LIKE ? ESCAPE '\\')")
+                    params.extend([like_pattern(term)] * 2)
+                
+                # 分面只按文本条件统计，不受分面筛选本身影响
+                groups = conn.execute(
+                    f'''SELECT p.duration, p.total_budget, substr(p.created_at, 1, 7) AS month, COUNT(*) AS count
+                        FROM travel_plans p {joins} WHERE {' AND '.join(where)} GROUP BY 1, 2, 3''',
+                    params
+                ).fetchall()
+                
+                for key, clause in SEARCH_FILTER_CLAUSES.items():
+                    if filters.get(key) is not None:
+                        where.append(clause)
+                        params.append(filters[key])
+                condition = ' AND '.join(where)
+                
+                total = conn.execute(
+                    f'SELECT COUNT(*) FROM travel_plans p {joins} WHERE {condition}', params
+                ).fetchone()[0]
+                if match:
+                    rank, rank_params = 'bm25(plan_search, 10.0, 1.0)', []
+                elif like_terms:
+                    rank, rank_params = "CASE WHEN p.destination LIKE ? ESCAPE '\\' THEN 0 ELSE 1 END", [like_pattern(like_terms[0])]
+                else:
+                    rank, rank_params = '0', []
+                rows = conn.execute(
+                    f'''SELECT p.id, p.title, p.destination, p.duration, p.total_budget, p.day_count,
+                               p.created_at, p.updated_at, p.search_text, {rank} AS rank
+                        FROM travel_plans p {joins} WHERE {condition}
+                        ORDER BY rank, p.created_at DESC, p.id DESC LIMIT ? OFFSET ?''',
+                    rank_params + params + [limit, offset]
+                ).fetchall()
+        except Exception as e:
+            print(f"检索计划错误: {e}")
+            return None
+        
+        return format_search_response(
+            {'results': rows, 'total': total, 'facet_groups': [dict(group) for group in groups]}, terms
+        )
+    
+    def export_rows(self, table, after_id=0, limit=1000, user_id=None):
+        """按 id 顺序读取 after_id 之后的一批行（导出用），plan_data 解析为字典"""
+        where, params = 'id > ?', [after_id]
+        if user_id is not None:
+            where += ' AND user_id = ?'
+            params.append(user_id)
+        with self.connection() as conn:
+            rows = conn.execute(
+                f'SELECT {", ".join(EXPORT_COLUMNS[table])} FROM {table} WHERE {where} ORDER BY id LIMIT ?',
+                params + [limit]
+            ).fetchall()
+        rows = [dict(row) for row in rows]
+        if table == 'travel_plans':
+            for row in rows:
+                row['plan_data'] = json.loads(row['plan_data'])
+        return rows
+    
+    def import_rows(self, table, rows, keep_ids=True):
+        """在一个事务中批量写入导入的行，返回各行的 id；keep_ids 为真时保留原 id，已存在的行跳过"""
+        prepared = [prepare_import_row(table, row, keep_ids) for row in rows]
+        if not prepared:
+            return []
+        for row in prepared:
+            for key in ('created_at', 'updated_at'):
+                if key in row:
+                    row[key] = sqlite_timestamp(row[key])
+            if table == 'travel_plans':
+                row['plan_data'] = json.dumps(row['plan_data'], ensure_ascii=False)
+                row['cost_summary'] = _dump_cost_summary(row)
+        
+        columns = list(prepared[0])
+        sql = (f'INSERT {"OR IGNORE " if keep_ids else ""}INTO {table} ({", ".join(columns)}) '
+               f'VALUES ({", ".join("?" * len(columns))})')
+        values = [tuple(row[column] for column in columns) for row in prepared]
+        with self.connection() as conn:
+            if keep_ids:
+                conn.executemany(sql, values)
+                return [row['id'] for row in prepared]
+            # 需要新分配的 id，逐行执行（仍在同一个事务中）
+            return [conn.execute(sql, value).lastrowid for value in values]
+    
+    def get_budget_inputs(self, plan_ids, user_id):
+        """批量读取多个计划的预算拆分和费用汇总（两条查询），供预算分析使用"""
+        plan_ids = [int(plan_id) for plan_id in plan_ids]
+        if not plan_ids:
+            return []
+        placeholders = ','.join('?' * len(plan_ids))
+        with self.connection() as conn:
+            plans = conn.execute(
+                f'''SELECT id, destination, total_budget, cost_summary,
+                           json_extract(plan_data, '$.budget_breakdown') AS budget_breakdown
+                    FROM travel_plans WHERE user_id = ? AND id IN ({placeholders})''',
+                [user_id] + plan_ids
+            ).fetchall()
+            rows = conn.execute(
+                f'''SELECT plan_id, category, date, total, count FROM expense_summaries
+                    WHERE user_id = ? AND plan_id IN ({placeholders})''',
+                [user_id] + plan_ids
+            ).fetchall()
+        return group_budget_inputs(plan_ids, [dict(row) for row in plans], rows)
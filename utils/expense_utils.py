@@ -0,0 +1,93 @@
+from datetime import date as date_type
+
+MAX_DESCRIPTION_LENGTH = 500
+
+
+def validate_expense(expense):
+    """校验并规范化单条费用，返回 (expense, None) 或 (None, 错误信息)"""
+    if not isinstance(expense, dict):
+        return None, '费用格式错误'
+
+    category = str(expense.get('category') or '').strip()
+    if not category:
+        return None, '缺少费用类别'
+
+    try:
+        amount = float(expense.get('amount'))
+    except (TypeError, ValueError):
+        return None, '金额必须是数字'
+    if amount < 0 or amount != amount or amount == float('inf'):
+        return None, '金额无效'
+
+    try:
+        expense_date = date_type.fromisoformat(str(expense.get('date') or '')).isoformat()
+    except ValueError:
+        return None, '日期格式应为 YYYY-MM-DD'
+
+    description = str(expense.get('description') or '')
+    if len(description) > MAX_DESCRIPTION_LENGTH:
+        return None, f'描述不能超过 {MAX_DESCRIPTION_LENGTH} 字'
+
+    return {
+        'category': category,
+        'amount': round(amount, 2),
+        'description': description,
+        'date': expense_date
+    }, None
+
+
+def validate_expenses(expenses):
+    """批量校验，返回 (有效费用列表及其下标, 每条的结果列表)"""
+    valid = []
+    results = []
+    for index, expense in enumerate(expenses):
+        cleaned, error = validate_expense(expense)
+        result = {'index': index, 'success': error is None}
+        if isinstance(expense, dict) and expense.get('client_id') is not None:
+            result['client_id'] = expense['client_id']
+        if error:
+            result['error'] = error
+        else:
+            valid.append((index, cleaned))
+        results.append(result)
+    return valid, results
+
+
+def build_expense_summary(rows):
+    """把 (category, date, total, count) 汇总行合并成计划级别的费用摘要"""
+    by_category = {}
+    by_day = {}
+    total = 0.0
+    count = 0
+
+    for row in rows:
+        amount = float(row['total'] or 0)
+        by_category[row['category']] = by_category.get(row['category'], 0.0) + amount
+        by_day[str(row['date'])] = by_day.get(str(row['date']), 0.0) + amount
+        total += amount
+        count += int(row['count'] or 0)
+
+    return {
+        'total': round(total, 2),
+        'count': count,
+        'by_category': {k: round(v, 2) for k, v in sorted(by_category.items(), key=lambda item: -item[1])},
+        'by_day': {k: round(v, 2) for k, v in sorted(by_day.items())}
+    }
+
+
+def format_summary_for_prompt(summary):
+    """把费用摘要压缩成几行文本，供大模型分析使用"""
+    total = summary['total']
+    lines = [f"合计 {total} 元，共 {summary['count']} 笔"]
+
+    if summary['by_category']:
+        parts = []
+        for category, amount in summary['by_category'].items():
+            ratio = amount / total * 100 if total else 0
+            parts.append(f"{category} {amount}({ratio:.0f}%)")
+        lines.append('分类：' + '；'.join(parts))
+
+    if summary['by_day']:
+        lines.append('按天：' + '；'.join(f"{day} {amount}" for day, amount in summary['by_day'].items()))
+
+    return '\n'.join(lines)
@@ -0,0 +1,302 @@
+"""行程地点的服务端地理编码
+
+保存计划时提取全部地点（活动、住宿和目的地本身），先查共享缓存，未命中的按批
+交给地理编码器解析，坐标以 [lng, lat] 写入对应对象的 lnglat 字段（目的地写入
+计划的 center 字段），前端直接用坐标打点，不再逐个调用高德地理编码。
+
+地理编码器可替换：AmapGeocoder 调用高德 Web 服务接口，FixtureGeocoder 读取本地
+JSON 数据，用于离线测试和压测。
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from utils.cache import TTLCache
+from utils.db_pool import ConnectionPool
+
+AMAP_GEOCODE_URL = 'https://restapi.amap.com/v3/geocode/geo'
+AMAP_PLACE_URL = 'https://restapi.amap.com/v3/place/text'
+# 高德对无法识别的地址常退回到行政区中心，这些级别的结果再用 POI 搜索确认
+COARSE_LEVELS = {'国家', '省', '市', '区县', '开发区', '乡镇', '村庄', '未知'}
+
+DEFAULT_FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'geocode_fixture.json')
+
+
+def normalize_name(name):
+    """统一空白并去掉高德批量接口用作分隔符的 |"""
+    return re.sub(r'\s+', ' ', str(name or '').replace('|', ' ')).strip()
+
+
+def cache_key(city, name):
+    return f'{normalize_name(city)}|{normalize_name(name)}'
+
+
+def iter_plan_locations(plan_data):
+    """遍历计划中带 location 的活动和住宿，返回 (对象, 地点名)"""
+    for day in plan_data.get('itinerary') or []:
+        yield from iter_day_locations(day)
+    for hotel in plan_data.get('accommodation') or []:
+        if isinstance(hotel, dict) and normalize_name(hotel.get('location')):
+            yield hotel, normalize_name(hotel['location'])
+
+
+def iter_day_locations(day):
+    if not isinstance(day, dict):
+        return
+    for activity in day.get('activities') or []:
+        if isinstance(activity, dict) and normalize_name(activity.get('location')):
+            yield activity, normalize_name(activity['location'])
+
+
+class GeocoderError(Exception):
+    """地理编码服务不可用（网络错误、配额用尽等），结果不写入缓存"""
+
+
+class AmapGeocoder:
+    """高德 Web 服务地理编码：每次请求最多解析 10 个地址，粗粒度结果再用 POI 搜索"""
+
+    name = 'amap'
+    batch_size = 10
+
+    def __init__(self, key, timeout=5, session=None):
+        import requests
+        self.key = key
+        self.timeout = timeout
+        self.session = session or requests.Session()
+
+    def _get(self, url, params):
+        try:
+            response = self.session.get(url, params=dict(params, key=self.key), timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            raise GeocoderError(f'高德接口请求失败: {e}')
+        if data.get('status') != '1':
+            raise GeocoderError(f"高德接口返回错误: {data.get('info')}")
+        return data
+
+    @staticmethod
+    def _parse(location):
+        if not location or not isinstance(location, str):
+            return None
+        lng, _, lat = location.partition(',')
+        try:
+            return [round(float(lng), 6), round(float(lat), 6)]
+        except ValueError:
+            return None
+
+    def geocode_batch(self, names, city=''):
+        """返回与 names 等长的列表，元素为 [lng, lat] 或 None（查无此地）"""
+        data = self._get(AMAP_GEOCODE_URL, {'address': '|'.join(names), 'city': city, 'batch': 'true'})
+        geocodes = data.get('geocodes') or []
+        results = []
+        for index, name in enumerate(names):
+            item = geocodes[index] if index < len(geocodes) else {}
+            point = self._parse(item.get('location'))
+            if point and city and item.get('level') in COARSE_LEVELS:
+                point = self.search_poi(name, city) or point
+            results.append(point)
+        return results
+
+    def search_poi(self, keyword, city):
+        data = self._get(AMAP_PLACE_URL, {'keywords': keyword, 'city': city, 'citylimit': 'true', 'offset': 1})
+        pois = data.get('pois') or []
+        return self._parse(pois[0].get('location')) if pois else None
+
+
+class FixtureGeocoder:
+    """从本地 JSON 读取坐标的地理编码器，用于测试和离线压测
+
+    fixture 的键为 "城市|地点" 或 "地点"，值为 [lng, lat]。synthesize=True 时，
+    地点名以 fixture 中已知城市开头但没有收录的，按名称哈希在城市中心附近生成
+    固定坐标（配合 DASHSCOPE_STUB 生成的“杭州景点1-1”这类地点）。
+    """
+
+    name = 'fixture'
+    batch_size = 50
+
+    def __init__(self, path=None, synthesize=False, latency=0.0):
+        with open(path or DEFAULT_FIXTURE_PATH, encoding='utf-8') as f:
+            self.points = {cache_key(*key.split('|', 1)) if '|' in key else normalize_name(key): value
+                           for key, value in json.load(f).items()}
+        self.synthesize = synthesize
+        self.latency = latency
+        self.calls = 0
+
+    def geocode_batch(self, names, city=''):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._lookup(name, city) for name in names]
+
+    def _lookup(self, name, city):
+        point = self.points.get(cache_key(city, name)) or self.points.get(normalize_name(name))
+        if point or not self.synthesize:
+            return point
+        for known in (city, name[:2], name[:3]):
+            center = self.points.get(normalize_name(known))
+            if known and center and name.startswith(known):
+                digest = hashlib.md5(name.encode('utf-8')).digest()
+                return [round(center[0] + (digest[0] - 128) / 2000, 6), round(center[1] + (digest[1] - 128) / 2000, 6)]
+        return None
+
+
+class GeocodeCache:
+    """地点坐标缓存：进程内 LRU + 共享 SQLite 表（所有用户、所有 worker 共用）
+
+    查不到的地点也会缓存（lng/lat 为空，miss_ttl 较短），避免反复请求高德。
+    """
+
+    def __init__(self, path, ttl=30 * 86400, miss_ttl=86400, maxsize=20000):
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self._memory = TTLCache(maxsize=maxsize, ttl=min(ttl, 3600))
+        self._lock = threading.Lock()
+        self.shared_hits = 0
+        self.loads = 0
+        self._pool = ConnectionPool(path, max_size=4)
+        with self._pool.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS geocode_cache (
+                    key TEXT PRIMARY KEY,
+                    lng REAL,
+                    lat REAL,
+                    source TEXT,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+
+    def get_many(self, keys):
+        """返回 {key: [lng, lat] 或 None}，未缓存的 key 不出现在结果中"""
+        found = {}
+        pending = []
+        for key in keys:
+            value = self._memory.get(key)
+            if value is not None:
+                found[key] = value or None
+            else:
+                pending.append(key)
+
+        now = time.time()
+        for start in range(0, len(pending), 500):
+            chunk = pending[start:start + 500]
+            with self._pool.connection() as conn:
+                rows = conn.execute(
+                    f'''SELECT key, lng, lat, expires_at FROM geocode_cache
+                        WHERE key IN ({",".join("?" * len(chunk))}) AND expires_at > ?''',
+                    chunk + [now]
+                ).fetchall()
+            for row in rows:
+                point = [row['lng'], row['lat']] if row['lng'] is not None else None
+                found[row['key']] = point
+                # 内存层用空列表表示“查无此地”，与未缓存的 None 区分
+                self._memory.set(row['key'], point or [], ttl=min(row['expires_at'] - now, self._memory.ttl))
+        with self._lock:
+            self.shared_hits += sum(1 for key in pending if key in found)
+        return found
+
+    def set_many(self, points, source=''):
+        """写入 {key: [lng, lat] 或 None}"""
+        if not points:
+            return
+        now = time.time()
+        rows = []
+        for key, point in points.items():
+            ttl = self.ttl if point else self.miss_ttl
+            rows.append((key, point[0] if point else None, point[1] if point else None, source, now + ttl))
+            self._memory.set(key, point or [], ttl=min(ttl, self._memory.ttl))
+        with self._lock:
+            self.loads += len(points)
+        with self._pool.connection() as conn:
+            conn.executemany(
+                '''INSERT INTO geocode_cache (key, lng, lat, source, expires_at) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(key) DO UPDATE SET lng = excluded.lng, lat = excluded.lat,
+                   source = excluded.source, expires_at = excluded.expires_at''',
+                rows
+            )
+
+    def purge_expired(self):
+        with self._pool.connection() as conn:
+            return conn.execute('DELETE FROM geocode_cache WHERE expires_at <= ?', (time.time(),)).rowcount
+
+    def stats(self):
+        stats = self._memory.stats()
+        stats['shared_hits'] = self.shared_hits
+        stats['loads'] = self.loads
+        requests = stats['hits'] + self.shared_hits + self.loads
+        stats['hit_ratio'] = round((stats['hits'] + self.shared_hits) / requests, 4) if requests else 0.0
+        return stats
+
+
+class GeocodingService:
+    """把计划中的地点解析为坐标并写回计划"""
+
+    def __init__(self, geocoder, cache):
+        self.geocoder = geocoder
+        self.cache = cache
+        self.geocoder_calls = 0
+        self.errors = 0
+
+    def resolve(self, names, city='', cache_only=False):
+        """批量解析地点，返回 {地点名: [lng, lat]}，解析不到的地点不出现在结果中"""
+        keys = {}
+        for name in names:
+            if normalize_name(name):
+                keys.setdefault(cache_key(city, name), normalize_name(name))
+        found = self.cache.get_many(list(keys))
+
+        missing = [key for key in keys if key not in found]
+        if missing and not cache_only and self.geocoder:
+            batch_size = self.geocoder.batch_size
+            for start in range(0, len(missing), batch_size):
+                chunk = missing[start:start + batch_size]
+                try:
+                    points = self.geocoder.geocode_batch([keys[key] for key in chunk], city)
+                except GeocoderError as e:
+                    # 服务不可用时不缓存，剩下的地点交给前端处理
+                    self.errors += 1
+                    print(f"地理编码错误: {e}")
+                    break
+                self.geocoder_calls += 1
+                resolved = dict(zip(chunk, points))
+                self.cache.set_many(resolved, source=self.geocoder.name)
+                found.update(resolved)
+
+        return {keys[key]: point for key, point in found.items() if point and key in keys}
+
+    def annotate_plan(self, plan_data, cache_only=False):
+        """为计划中的地点和目的地写入坐标，返回写入坐标的地点数"""
+        if not isinstance(plan_data, dict):
+            return 0
+        city = normalize_name(plan_data.get('destination'))
+        count = self._annotate(list(iter_plan_locations(plan_data)), city, cache_only)
+        if city and not plan_data.get('center'):
+            center = self.resolve([city], cache_only=cache_only).get(city)
+            if center:
+                plan_data['center'] = center
+        return count
+
+    def annotate_day(self, day, city, cache_only=False):
+        """为单日行程中的活动写入坐标（重新生成某一天时使用）"""
+        return self._annotate(list(iter_day_locations(day)), normalize_name(city), cache_only)
+
+    def _annotate(self, targets, city, cache_only):
+        pending = [(item, name) for item, name in targets if not item.get('lnglat')]
+        if not pending:
+            return 0
+        points = self.resolve([name for _, name in pending], city, cache_only)
+        count = 0
+        for item, name in pending:
+            if name in points:
+                item['lnglat'] = points[name]
+                count += 1
+        return count
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats['geocoder'] = self.geocoder.name if self.geocoder else None
+        stats['geocoder_calls'] = self.geocoder_calls
+        stats['geocoder_errors'] = self.errors
+        return stats
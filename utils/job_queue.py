@@ -0,0 +1,141 @@
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from utils.db_pool import ConnectionPool
+
+
+class JobQueue:
+    """后台任务队列
+
+    耗时任务（如调用大模型生成计划）交给有界线程池执行，
+    请求线程只负责提交任务并立即返回任务 ID，客户端再通过 ID 轮询结果。
+    多 worker 进程部署时轮询请求可能落到其他进程，配置 shared_path 后任务状态
+    同时写入本机共享的 SQLite 文件，任意进程都能查到。
+    """
+
+    def __init__(self, max_workers=4, max_pending=100, ttl=3600, shared_path=None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._pool = None
+
+        if shared_path:
+            self._pool = ConnectionPool(shared_path, max_size=4)
+            with self._pool.connection() as conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        id TEXT PRIMARY KEY,
+                        owner_id TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        result TEXT,
+                        error TEXT,
+                        created_at REAL NOT NULL,
+                        finished_at REAL
+                    )
+                ''')
+
+    def submit(self, owner_id, func, *args, **kwargs):
+        """提交任务，队列已满时返回 None"""
+        with self._lock:
+            self._purge_expired()
+            active = sum(1 for job in self._jobs.values() if job['status'] in ('pending', 'running'))
+            if active >= self.max_pending:
+                return None
+
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                'id': job_id,
+                'owner_id': str(owner_id),
+                'status': 'pending',
+                'result': None,
+                'error': None,
+                'created_at': time.time(),
+                'finished_at': None
+            }
+            job = dict(self._jobs[job_id])
+
+        self._save_shared(job)
+        self._executor.submit(self._run, job_id, func, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, func, args, kwargs):
+        self._update(job_id, status='running')
+        try:
+            result = func(*args, **kwargs)
+            self._update(job_id, status='done', result=result, finished_at=time.time())
+        except Exception as e:
+            print(f"后台任务失败: {e}")
+            self._update(job_id, status='error', error=str(e), finished_at=time.time())
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return
+            job.update(fields)
+            job = dict(job)
+        self._save_shared(job)
+
+    def _save_shared(self, job):
+        if not self._pool:
+            return
+        try:
+            with self._pool.connection() as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO jobs (id, owner_id, status, result, error, created_at, finished_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (job['id'], job['owner_id'], job['status'],
+                     json.dumps(job['result'], ensure_ascii=False) if job['result'] is not None else None,
+                     job['error'], job['created_at'], job['finished_at'])
+                )
+        except Exception as e:
+            print(f"保存任务状态错误: {e}")
+
+    def _get_shared(self, job_id):
+        try:
+            with self._pool.connection() as conn:
+                row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        except Exception as e:
+            print(f"读取任务状态错误: {e}")
+            return None
+        if not row:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def _purge_expired(self):
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job['finished_at'] and now - job['finished_at'] > self.ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        if self._pool and expired:
+            with self._pool.connection() as conn:
+                conn.execute('DELETE FROM jobs WHERE finished_at < ?', (now - self.ttl,))
+
+    def get(self, job_id, owner_id):
+        """获取任务状态，只有提交者本人可以查看"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            job = dict(job) if job else None
+        if job is None and self._pool:
+            job = self._get_shared(job_id)
+        if not job or job['owner_id'] != str(owner_id):
+            return None
+        return job
+
+    def stats(self):
+        with self._lock:
+            counts = {'pending': 0, 'running': 0, 'done': 0, 'error': 0}
+            for job in self._jobs.values():
+                counts[job['status']] += 1
+        counts['max_workers'] = self.max_workers
+        return counts
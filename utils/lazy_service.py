@@ -0,0 +1,49 @@
+import os
+import threading
+import weakref
+
+_instances = weakref.WeakSet()
+
+
+class LazyService:
+    """首次访问属性时才调用 factory 创建服务对象
+
+    导入 app 时不再创建数据库连接、HTTP 客户端和线程池；fork 之后子进程
+    会丢弃父进程中已创建的对象，在子进程里重新创建（线程和连接不能跨 fork 使用）。
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+        _instances.add(self)
+
+    def _get(self):
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+                instance = self._instance
+        return instance
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    @property
+    def initialized(self):
+        return self._instance is not None
+
+    def reset(self):
+        """丢弃已创建的对象，下次访问时重新创建"""
+        self._instance = None
+        self._lock = threading.Lock()
+
+
+def _reset_after_fork():
+    for service in list(_instances):
+        service.reset()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,253 @@
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utils.plan_cache import normalize_request
+
+# 多城市行程的标志：城市之间的连接符或明确的多地描述
+_MULTI_CITY = re.compile(r'去[^，,。\s]{1,6}[和、][^，,。\s]{1,6}|→|->|再去|再到|然后去|多城|环线|串联|连游|自驾')
+
+
+class RouterUnavailableError(Exception):
+    """所有候选模型都处于熔断或满载状态"""
+
+
+def classify_request(user_input, complex_days=5, complex_length=120):
+    """粗略判断需求复杂度：多城市、长行程、要求较多的请求返回 'complex'"""
+    fields = normalize_request(user_input)
+    if fields['days'] and fields['days'] >= complex_days:
+        return 'complex'
+    if len(user_input) >= complex_length or len(fields['preferences']) >= 3:
+        return 'complex'
+    if _MULTI_CITY.search(user_input):
+        return 'complex'
+    return 'simple'
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后断开，reset_timeout 秒后放行一个试探请求"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+
+class ModelSlot:
+    """单个模型的并发上限、熔断器和延迟统计"""
+
+    def __init__(self, name, max_concurrency, breaker, window=200):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.breaker = breaker
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+
+    def try_acquire(self, timeout=0):
+        acquired = self._semaphore.acquire(timeout=timeout) if timeout else self._semaphore.acquire(blocking=False)
+        if not acquired:
+            return False
+        # 先占名额再问熔断器，避免半开状态的试探机会被白白消耗
+        if not self.breaker.allow():
+            self._semaphore.release()
+            return False
+        with self._lock:
+            self.in_flight += 1
+            self.calls += 1
+        return True
+
+    def release(self, elapsed, ok):
+        with self._lock:
+            self.in_flight -= 1
+            if ok:
+                self._latencies.append(elapsed)
+            else:
+                self.failures += 1
+        self._semaphore.release()
+        if ok:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def p95(self, min_samples=20):
+        """最近请求耗时的 p95（秒），样本不足时返回 None"""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < min_samples:
+            return None
+        return samples[int(len(samples) * 0.95) - 1]
+
+    def stats(self):
+        p95 = self.p95()
+        return {
+            'in_flight': self.in_flight,
+            'max_concurrency': self.max_concurrency,
+            'calls': self.calls,
+            'failures': self.failures,
+            'breaker': self.breaker.state,
+            'p95_ms': round(p95 * 1000) if p95 else None
+        }
+
+
+class LLMRouter:
+    """按请求复杂度选择模型，并对慢请求发起对冲调用
+
+    - 简单请求用 simple_model，复杂请求用 complex_model；
+    - 首选模型熔断或满载时依次尝试 fallback 中的模型；
+    - 首选调用超过对冲预算（该模型近期 p95，样本不足时用 hedge_after）仍未返回时，
+      向 hedge_model 再发一次请求，取先成功的结果。
+    """
+
+    def __init__(self, simple_model, complex_model, hedge_model=None, fallback=(),
+                 max_concurrency=4, model_concurrency=None, hedge_after=20.0,
+                 breaker_failures=5, breaker_reset=30, queue_timeout=30.0):
+        self.simple_model = simple_model
+        self.complex_model = complex_model
+        self.hedge_model = hedge_model
+        self.fallback = [m for m in fallback if m]
+        self.hedge_after = hedge_after
+        self.queue_timeout = queue_timeout
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+        names = [simple_model, complex_model, hedge_model] + self.fallback
+        model_concurrency = model_concurrency or {}
+        self.slots = {}
+        for name in names:
+            if name and name not in self.slots:
+                self.slots[name] = ModelSlot(
+                    name, model_concurrency.get(name, max_concurrency),
+                    CircuitBreaker(breaker_failures, breaker_reset)
+                )
+        total = sum(slot.max_concurrency for slot in self.slots.values())
+        self._executor = ThreadPoolExecutor(max_workers=total, thread_name_prefix='llm-call')
+
+    def choose(self, user_input):
+        """返回首选模型名（同时用于计划缓存的键）"""
+        if classify_request(user_input) == 'complex':
+            return self.complex_model
+        return self.simple_model
+
+    def _candidates(self, primary):
+        seen = []
+        for name in [primary] + self.fallback + [self.simple_model, self.complex_model]:
+            if name and name not in seen:
+                seen.append(name)
+        return seen
+
+    def acquire(self, primary):
+        """取得一个可用模型的调用名额，返回 ModelSlot；调用方负责 release"""
+        candidates = self._candidates(primary)
+        for name in candidates:
+            slot = self.slots[name]
+            if slot.try_acquire():
+                return slot
+        # 都满载时在首选模型上排队等待
+        slot = self.slots[primary]
+        if slot.try_acquire(timeout=self.queue_timeout):
+            return slot
+        raise RouterUnavailableError(f'模型 {", ".join(candidates)} 均不可用')
+
+    def _run(self, slot, func):
+        start = time.monotonic()
+        ok = False
+        try:
+            result = func(slot.name)
+            ok = True
+            return result
+        finally:
+            slot.release(time.monotonic() - start, ok)
+
+    def hedge_budget(self, slot):
+        return slot.p95() or self.hedge_after
+
+    def call(self, user_input, func, primary=None):
+        """调用 func(model_name) 完成一次请求，返回 (结果, 实际使用的模型)
+
+        primary 不为空时跳过复杂度判断直接使用该模型；func 失败时应抛出异常，以便计入熔断器。
+        """
+        primary = self.acquire(primary or self.choose(user_input))
+        futures = {self._executor.submit(self._run, primary, func): primary.name}
+        done, _ = wait(futures, timeout=self.hedge_budget(primary))
+
+        if not done and self.hedge_model and self.hedge_model != primary.name:
+            hedge = self.slots[self.hedge_model]
+            if hedge.try_acquire():
+                with self._lock:
+                    self.hedges += 1
+                futures[self._executor.submit(self._run, hedge, func)] = hedge.name
+
+        error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                model = futures[future]
+                if model != primary.name:
+                    with self._lock:
+                        self.hedge_wins += 1
+                # 落后的请求继续在后台完成，只是结果被丢弃
+                return result, model
+        raise error
+
+    def stats(self):
+        return {
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'models': {name: slot.stats() for name, slot in self.slots.items()}
+        }
+
+
+def parse_model_concurrency(text):
+    """解析 "qwen-plus:4,qwen-turbo:8" 形式的配置"""
+    limits = {}
+    for item in (text or '').split(','):
+        name, _, value = item.strip().partition(':')
+        if name and value.isdigit():
+            limits[name] = int(value)
+    return limits
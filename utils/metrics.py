@@ -0,0 +1,222 @@
+"""进程内性能指标，按 Prometheus 文本格式输出
+
+不依赖 prometheus_client：计数器和直方图都很简单，自己实现可以少一个依赖。
+多 worker 部署时每个进程各自计数，由 Prometheus 按实例分别抓取。
+"""
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from config import Config
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LLM_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+# 当前正在执行的数据库方法，用于把 SQLite 语句计入对应的方法
+current_db_method = contextvars.ContextVar('current_db_method', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, [le])} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+class CallbackGauge:
+    """抓取时才调用 func 取值，func 返回 [(标签字典, 数值), ...]"""
+
+    def __init__(self, name, documentation, func, metric_type='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+        self.metric_type = metric_type
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        try:
+            samples = self.func()
+        except Exception as e:
+            print(f"采集指标 {self.name} 错误: {e}")
+            samples = []
+        for labels, value in samples:
+            if value is None:
+                continue
+            lines.append(f'{self.name}{_format_labels(labels.keys(), labels.values())} {value}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge_callback(self, name, documentation, func, metric_type='gauge'):
+        return self.register(CallbackGauge(name, documentation, func, metric_type))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'http_request_duration_seconds', 'HTTP 请求处理耗时（流式响应只计到开始输出）', ('route', 'method', 'status'))
+DB_CALL_SECONDS = REGISTRY.histogram(
+    'db_call_duration_seconds', '数据库服务方法耗时', ('backend', 'method'))
+DB_CALL_ERRORS = REGISTRY.counter(
+    'db_call_errors_total', '数据库服务方法抛出的异常数', ('backend', 'method'))
+DB_STATEMENTS = REGISTRY.counter(
+    'db_statements_total', '各数据库方法执行的 SQLite 语句数', ('method',))
+SUPABASE_HTTP_SECONDS = REGISTRY.histogram(
+    'supabase_http_duration_seconds', '异步客户端发往 PostgREST 的单次 HTTP 请求耗时（含重试中的每一次）',
+    ('method', 'table', 'status'))
+LLM_CALL_SECONDS = REGISTRY.histogram(
+    'llm_call_duration_seconds', '大模型调用耗时', ('model', 'kind'), buckets=LLM_BUCKETS)
+LLM_CALLS = REGISTRY.counter(
+    'llm_calls_total', '大模型调用次数', ('model', 'kind', 'outcome'))
+LLM_TOKENS = REGISTRY.counter(
+    'llm_tokens_total', '大模型 token 用量', ('model', 'type'))
+
+
+def record_llm_call(model, kind, seconds, ok, prompt_tokens=0, completion_tokens=0):
+    if not Config.METRICS_ENABLED:
+        return
+    LLM_CALL_SECONDS.observe(seconds, model=model, kind=kind)
+    LLM_CALLS.inc(model=model, kind=kind, outcome='ok' if ok else 'error')
+    if prompt_tokens:
+        LLM_TOKENS.inc(prompt_tokens, model=model, type='prompt')
+    if completion_tokens:
+        LLM_TOKENS.inc(completion_tokens, model=model, type='completion')
+
+
+def sqlite_trace_callback(statement):
+    """注册到 SQLite 连接上，统计每个数据库方法执行的语句数"""
+    DB_STATEMENTS.inc(method=current_db_method.get() or 'other')
+
+
+class InstrumentedService:
+    """包装数据库服务，记录每个公开方法的耗时和异常数，其余属性原样转发"""
+
+    # 返回上下文管理器的方法，计时没有意义
+    SKIP = ('connection',)
+
+    def __init__(self, service, backend):
+        self._service = service
+        self._backend = backend
+        self._wrappers = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self._service, name)
+        if name.startswith('_') or name in self.SKIP or not callable(attr):
+            return attr
+        wrapper = self._wrappers.get(name)
+        if wrapper is None:
+            wrapper = self._wrappers[name] = self._wrap(name)
+        return wrapper
+
+    def _wrap(self, name):
+        backend = self._backend
+
+        def call(*args, **kwargs):
+            token = current_db_method.set(name)
+            start = time.perf_counter()
+            try:
+                return getattr(self._service, name)(*args, **kwargs)
+            except Exception:
+                DB_CALL_ERRORS.inc(backend=backend, method=name)
+                raise
+            finally:
+                DB_CALL_SECONDS.observe(time.perf_counter() - start, backend=backend, method=name)
+                current_db_method.reset(token)
+
+        call.__name__ = name
+        return call
+
+
+def cache_samples(caches):
+    """把 {名称: 带 stats() 的缓存} 转成命中数、未命中数和命中率三组样本
+
+    用户缓存的共享层命中也算命中，真正回源数据库的次数（loads）算未命中。
+    """
+    hits, misses, ratios = [], [], []
+    for name, cache in caches.items():
+        if cache is None:
+            continue
+        stats = cache.stats()
+        labels = {'cache': name}
+        hits.append((labels, stats.get('hits', 0) + stats.get('shared_hits', 0)))
+        misses.append((labels, stats['loads'] if 'loads' in stats else stats.get('misses', 0)))
+        ratios.append((labels, stats.get('hit_ratio', 0)))
+    return hits, misses, ratios
@@ -0,0 +1,153 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from config import Config
+
+SCRYPT_PREFIX = 'scrypt'
+
+
+class HasherBusyError(Exception):
+    """待处理的哈希任务已满，调用方应返回 503 让客户端稍后重试"""
+
+
+def _scrypt(password, salt, n, r, p):
+    # 模块级函数，进程池可以序列化调用
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r * p + 1024 * 1024, dklen=32)
+
+
+def _b64encode(data):
+    return base64.b64encode(data).decode().rstrip('=')
+
+
+def _b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def is_legacy_hash(stored):
+    """早期版本保存的是不加盐的 SHA-256 十六进制串"""
+    return len(stored) == 64 and all(c in '0123456789abcdef' for c in stored)
+
+
+class PasswordHasher:
+    """scrypt 密码哈希
+
+    存储格式为 scrypt$n$r$p$salt$hash，参数随哈希一起保存，调整成本参数后
+    旧哈希仍可验证，并在用户下次登录时按新参数重新计算。
+    scrypt 会释放 GIL，默认在线程池中计算；也可以配置为进程池。
+    同时进行的任务数有上限，超出时抛出 HasherBusyError，避免登录洪峰拖垮所有 worker。
+    """
+
+    def __init__(self, n=None, r=None, p=None, workers=None, executor=None, max_pending=None):
+        self.n = n or Config.PASSWORD_SCRYPT_N
+        self.r = r or Config.PASSWORD_SCRYPT_R
+        self.p = p or Config.PASSWORD_SCRYPT_P
+        workers = workers or Config.PASSWORD_HASH_WORKERS or os.cpu_count() or 1
+        executor = executor or Config.PASSWORD_HASH_EXECUTOR
+        if executor == 'process':
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(max_pending or Config.PASSWORD_HASH_MAX_PENDING)
+
+    def _submit(self, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusyError('密码校验任务过多')
+        try:
+            future = self._executor.submit(_scrypt, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def submit_hash(self, password):
+        """返回 Future，结果为存储格式的哈希字符串"""
+        salt = os.urandom(16)
+        future = self._submit(password, salt, self.n, self.r, self.p)
+        return _chain(future, lambda digest: '$'.join(
+            (SCRYPT_PREFIX, str(self.n), str(self.r), str(self.p), _b64encode(salt), _b64encode(digest))
+        ))
+
+    def submit_verify(self, password, stored):
+        """返回 Future，结果为密码是否匹配"""
+        if not stored:
+            return _done(False)
+        if is_legacy_hash(stored):
+            # SHA-256 计算很快，直接在当前线程完成
+            legacy = hashlib.sha256(password.encode()).hexdigest()
+            return _done(hmac.compare_digest(legacy, stored))
+        try:
+            prefix, n, r, p, salt, expected = stored.split('$')
+            if prefix != SCRYPT_PREFIX:
+                return _done(False)
+            n, r, p = int(n), int(r), int(p)
+            salt, expected = _b64decode(salt), _b64decode(expected)
+        except ValueError:
+            return _done(False)
+        future = self._submit(password, salt, n, r, p)
+        return _chain(future, lambda digest: hmac.compare_digest(digest, expected))
+
+    def hash(self, password):
+        return self.submit_hash(password).result()
+
+    def verify(self, password, stored):
+        return self.submit_verify(password, stored).result()
+
+    def needs_rehash(self, stored):
+        """旧的 SHA-256 哈希或成本参数与当前配置不同时需要重新计算"""
+        if is_legacy_hash(stored):
+            return True
+        parts = stored.split('$')
+        return len(parts) != 6 or parts[1:4] != [str(self.n), str(self.r), str(self.p)]
+
+    def dummy_verify(self, password):
+        """用户不存在时也做一次同等成本的计算，避免通过响应时间判断用户名是否存在"""
+        return self._submit(password, b'\0' * 16, self.n, self.r, self.p)
+
+
+def _done(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def _chain(future, transform):
+    result = Future()
+
+    def callback(done):
+        try:
+            result.set_result(transform(done.result()))
+        except Exception as e:
+            result.set_exception(e)
+
+    future.add_done_callback(callback)
+    return result
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+def get_password_hasher():
+    """进程内共享的哈希器，首次使用时创建（进程池不能在 fork 前创建）"""
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                _hasher = PasswordHasher()
+    return _hasher
+
+
+def _reset_after_fork():
+    # 父进程的计算池线程或子进程在 fork 后不可用
+    global _hasher, _hasher_lock
+    _hasher = None
+    _hasher_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
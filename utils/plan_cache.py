@@ -0,0 +1,194 @@
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from utils.cache import TTLCache
+from utils.db_pool import ConnectionPool
+
+_CN_DIGITS = {'零': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4, '五': 5,
+              '六': 6, '七': 7, '八': 8, '九': 9}
+_NUM = r'(\d+|[零一二两三四五六七八九十]+)'
+
+_BUDGET_PATTERNS = [
+    re.compile(r'预算\s*(?:约|大概|为|是)?\s*(\d+(?:\.\d+)?)\s*(万|千|[kKwW])?\s*(?:元|块|人民币)?'),
+    re.compile(r'(\d+(?:\.\d+)?)\s*(万|千)?\s*(?:元|块)')
+]
+_DAYS_PATTERN = re.compile(_NUM + r'\s*(?:天|日)')
+_NIGHTS_PATTERN = re.compile(_NUM + r'\s*晚')
+_TRAVELERS_PATTERN = re.compile(_NUM + r'\s*(?:个|位)?\s*(?:人|大人|成人)')
+
+# 偏好关键词 -> 归一化标签
+_PREFERENCES = {
+    '美食': '美食', '购物': '购物', '动漫': '动漫', '历史': '历史', '文化': '文化',
+    '自然': '自然', '风景': '自然', '海边': '海滨', '海滩': '海滨', '海岛': '海滨', '爬山': '户外',
+    '徒步': '户外', '户外': '户外', '摄影': '摄影', '拍照': '摄影', '博物馆': '博物馆', '夜景': '夜景',
+    '温泉': '温泉', '滑雪': '滑雪', '休闲': '休闲', '放松': '休闲', '亲子': '亲子', '带孩子': '亲子',
+    '带小孩': '亲子', '老人': '长辈', '父母': '长辈', '蜜月': '蜜月', '情侣': '情侣', '穷游': '经济',
+    '省钱': '经济', '豪华': '豪华', '网红': '网红'
+}
+
+# 不影响计划内容的填充词
+_STOPWORDS = sorted([
+    '我想', '我们', '我要', '想要', '想', '打算', '计划', '准备', '去', '到', '玩', '旅游', '旅行', '游玩',
+    '出游', '自由行', '一趟', '喜欢', '和', '带', '的', '左右', '大概', '预算', '元', '块', '人民币',
+    '请', '帮我', '安排', '规划', '一下', '行程', '一共', '共', '个', '人'
+], key=len, reverse=True)
+_SPLIT = re.compile(r'[\s|，,。.、；;！!？?：:（）()\-—~～]+')
+
+
+def _to_int(text):
+    if text.isdigit():
+        return int(text)
+    if text == '十':
+        return 10
+    if '十' in text:
+        tens, _, ones = text.partition('十')
+        return (_CN_DIGITS.get(tens, 1) if tens else 1) * 10 + (_CN_DIGITS.get(ones, 0) if ones else 0)
+    return _CN_DIGITS.get(text, 0)
+
+
+def _budget_band(amount):
+    """把预算映射到约 20% 宽的几何区间，预算相近的请求归入同一档"""
+    if not amount or amount <= 0:
+        return None
+    return int(math.log(amount) / math.log(1.2))
+
+
+def normalize_request(user_input):
+    """从自然语言需求中抽取目的地、天数、人数、预算档位和偏好
+
+    无法归类的剩余文本保留在 extra 字段中，保证附加约束不同的请求不会共用缓存。
+    """
+    text = user_input.strip()
+    fields = {'destination': None, 'days': None, 'travelers': None, 'budget_band': None,
+              'preferences': [], 'extra': ''}
+
+    for pattern in _BUDGET_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            amount = float(match.group(1))
+            unit = (match.group(2) or '').lower()
+            amount *= {'万': 10000, 'w': 10000, '千': 1000, 'k': 1000}.get(unit, 1)
+            fields['budget_band'] = _budget_band(amount)
+            text = text[:match.start()] + '|' + text[match.end():]
+            break
+
+    match = _DAYS_PATTERN.search(text)
+    if match:
+        fields['days'] = _to_int(match.group(1))
+        text = text[:match.start()] + '|' + text[match.end():]
+    else:
+        match = _NIGHTS_PATTERN.search(text)
+        if match:
+            fields['days'] = _to_int(match.group(1)) + 1
+            text = text[:match.start()] + '|' + text[match.end():]
+
+    match = _TRAVELERS_PATTERN.search(text)
+    if match:
+        fields['travelers'] = _to_int(match.group(1))
+        text = text[:match.start()] + '|' + text[match.end():]
+
+    preferences = set()
+    for keyword in sorted(_PREFERENCES, key=len, reverse=True):
+        if keyword in text:
+            preferences.add(_PREFERENCES[keyword])
+            text = text.replace(keyword, '|')
+    fields['preferences'] = sorted(preferences)
+
+    for word in _STOPWORDS:
+        text = text.replace(word, '|')
+
+    chunks = [chunk.lower() for chunk in _SPLIT.split(text) if chunk]
+    if chunks:
+        fields['destination'] = chunks[0]
+        fields['extra'] = ' '.join(sorted(chunks[1:]))
+    return fields
+
+
+class PlanCache:
+    """AI 旅行计划响应缓存
+
+    以归一化后的请求（加上模型名和提示词版本）作为键，
+    支持进程内 LRU 存储或 SQLite 表存储（多进程共享），均带过期时间。
+    """
+
+    def __init__(self, backend='memory', maxsize=1000, ttl=7 * 24 * 3600, db_path=None):
+        self.backend = backend
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if backend == 'sqlite':
+            self._pool = ConnectionPool(db_path, max_size=4)
+            with self._pool.connection() as conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS ai_plan_cache (
+                        cache_key TEXT PRIMARY KEY,
+                        plan_json TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        last_used REAL NOT NULL
+                    )
+                ''')
+        else:
+            self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def make_key(self, user_input, model, prompt_version):
+        fields = normalize_request(user_input)
+        fields['model'] = model
+        fields['prompt_version'] = prompt_version
+        raw = json.dumps(fields, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """返回缓存的计划（每次返回新的对象），未命中返回 None"""
+        if self.backend == 'sqlite':
+            now = time.time()
+            with self._pool.connection() as conn:
+                row = conn.execute(
+                    'SELECT plan_json FROM ai_plan_cache WHERE cache_key = ? AND created_at > ?',
+                    (key, now - self.ttl)
+                ).fetchone()
+                if row:
+                    conn.execute('UPDATE ai_plan_cache SET last_used = ? WHERE cache_key = ?', (now, key))
+            plan_json = row['plan_json'] if row else None
+        else:
+            plan_json = self._memory.get(key)
+
+        with self._lock:
+            if plan_json is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(plan_json)
+
+    def set(self, key, plan):
+        plan_json = json.dumps(plan, ensure_ascii=False)
+        if self.backend == 'sqlite':
+            now = time.time()
+            with self._pool.connection() as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO ai_plan_cache (cache_key, plan_json, created_at, last_used) VALUES (?, ?, ?, ?)',
+                    (key, plan_json, now, now)
+                )
+                # 超出容量时按最近使用时间淘汰
+                conn.execute(
+                    '''DELETE FROM ai_plan_cache WHERE cache_key IN (
+                           SELECT cache_key FROM ai_plan_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                       )''',
+                    (self.maxsize,)
+                )
+        else:
+            self._memory.set(key, plan_json)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'backend': self.backend,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0
+        }
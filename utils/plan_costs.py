@@ -0,0 +1,144 @@
+"""计划费用模型：保存计划时把所有费用项展开为列式数组，一次遍历算出每天和各类别合计
+
+活动、住宿和交通的费用分散在嵌套的 JSON 中，查看、对比和预算分析都要重新遍历。
+这里在保存时计算一次，结果作为 cost_summary 与计划一起存储，并对照 budget_breakdown
+标记不一致的地方（分项超出预算、拆分之和与总额不符等）。
+"""
+from array import array
+from config import Config
+from utils.plan_utils import extract_plan_summary, parse_number
+from utils.plan_search import build_search_text
+
+# 修改计算规则时递增，读取时可据此判断是否需要重算
+COST_SUMMARY_VERSION = 1
+
+COST_CATEGORIES = ('transportation', 'accommodation', 'food', 'activities')
+_CATEGORY_INDEX = {name: index for index, name in enumerate(COST_CATEGORIES)}
+BREAKDOWN_CATEGORIES = COST_CATEGORIES + ('shopping', 'emergency')
+
+# 活动名称包含这些词时计入餐饮，其余计入活动
+_FOOD_KEYWORDS = ('餐', '饭', '吃', '美食', '小吃', '早茶', '下午茶', '夜宵', '宵夜', '咖啡', '火锅', '烤鸭')
+# 不属于某一天的费用项（住宿、往返交通）
+NO_DAY = -1
+
+
+class CostColumns:
+    """计划中全部费用项的列式表示：三列按下标一一对应"""
+
+    __slots__ = ('day', 'category', 'amount')
+
+    def __init__(self):
+        self.day = array('h')
+        self.category = array('B')
+        self.amount = array('d')
+
+    def append(self, day, category, amount):
+        self.day.append(day)
+        self.category.append(_CATEGORY_INDEX[category])
+        self.amount.append(amount)
+
+    def __len__(self):
+        return len(self.amount)
+
+
+def _cost(value):
+    amount = parse_number(value, 0) or 0
+    return float(amount) if amount > 0 else 0.0
+
+
+def _activity_category(activity):
+    text = f"{activity.get('activity') or ''}{activity.get('notes') or ''}"
+    return 'food' if any(keyword in text for keyword in _FOOD_KEYWORDS) else 'activities'
+
+
+def flatten_costs(plan_data):
+    """把活动、住宿和交通费用展开为 CostColumns，返回 (columns, 行程天数)"""
+    columns = CostColumns()
+    itinerary = plan_data.get('itinerary')
+    itinerary = itinerary if isinstance(itinerary, list) else []
+    for day_index, day in enumerate(itinerary):
+        if not isinstance(day, dict):
+            continue
+        for activity in day.get('activities') or []:
+            if isinstance(activity, dict):
+                columns.append(day_index, _activity_category(activity), _cost(activity.get('cost')))
+
+    for hotel in plan_data.get('accommodation') or []:
+        if isinstance(hotel, dict):
+            columns.append(NO_DAY, 'accommodation', _cost(hotel.get('cost')))
+
+    transportation = plan_data.get('transportation')
+    if isinstance(transportation, dict):
+        for leg in transportation.values():
+            if isinstance(leg, dict):
+                columns.append(NO_DAY, 'transportation', _cost(leg.get('cost')))
+    return columns, len(itinerary)
+
+
+def summarize_costs(columns, day_count):
+    """一次遍历列数组，返回 (每天合计, 未分配到天的合计, 各类别合计)"""
+    by_day = array('d', bytes(8 * day_count))
+    by_category = array('d', bytes(8 * len(COST_CATEGORIES)))
+    unassigned = 0.0
+    for day, category, amount in zip(columns.day, columns.category, columns.amount):
+        by_category[category] += amount
+        if day == NO_DAY:
+            unassigned += amount
+        else:
+            by_day[day] += amount
+    return by_day, unassigned, by_category
+
+
+def check_consistency(plan_data, itemized, total, tolerance):
+    """对照 budget_breakdown 检查分项合计，返回问题列表"""
+    breakdown = plan_data.get('budget_breakdown')
+    if not isinstance(breakdown, dict) or not breakdown:
+        return [{'type': 'missing_breakdown'}]
+
+    issues = []
+    for category in COST_CATEGORIES:
+        budgeted = _cost(breakdown.get(category))
+        spent = itemized[category]
+        if budgeted and spent > budgeted * (1 + tolerance):
+            issues.append({'type': 'category_exceeds_budget', 'category': category,
+                           'itemized': spent, 'budgeted': budgeted})
+        elif spent and not budgeted:
+            issues.append({'type': 'category_not_budgeted', 'category': category, 'itemized': spent})
+
+    budget_total = _cost(breakdown.get('total'))
+    parts = round(sum(_cost(breakdown.get(category)) for category in BREAKDOWN_CATEGORIES), 2)
+    if budget_total and parts and abs(parts - budget_total) > budget_total * tolerance:
+        issues.append({'type': 'breakdown_total_mismatch', 'sum': parts, 'total': budget_total})
+    if budget_total and total > budget_total * (1 + tolerance):
+        issues.append({'type': 'itemized_exceeds_total', 'itemized': total, 'total': budget_total})
+
+    requested = _cost(plan_data.get('budget'))
+    if requested and budget_total > requested * (1 + tolerance):
+        issues.append({'type': 'breakdown_exceeds_requested_budget', 'total': budget_total, 'requested': requested})
+    return issues
+
+
+def compute_cost_summary(plan_data, tolerance=None):
+    """计算计划的费用摘要：每天合计、各类别合计、费用项数和不一致标记"""
+    tolerance = Config.PLAN_COST_TOLERANCE if tolerance is None else tolerance
+    columns, day_count = flatten_costs(plan_data)
+    by_day, unassigned, by_category = summarize_costs(columns, day_count)
+    itemized = {name: round(by_category[index], 2) for index, name in enumerate(COST_CATEGORIES)}
+    total = round(sum(by_category), 2)
+    return {
+        'version': COST_SUMMARY_VERSION,
+        'total': total,
+        'by_category': itemized,
+        'by_day': [round(amount, 2) for amount in by_day],
+        'unassigned': round(unassigned, 2),
+        'item_count': len(columns),
+        'issues': check_consistency(plan_data, itemized, total, tolerance)
+    }
+
+
+def extract_plan_columns(plan_data, tolerance=None):
+    """保存计划时写入的全部派生列：摘要字段、cost_summary 和检索用的 search_text"""
+    columns = extract_plan_summary(plan_data)
+    columns['cost_summary'] = compute_cost_summary(plan_data, tolerance) if isinstance(plan_data, dict) else None
+    columns['search_text'] = build_search_text(plan_data) if isinstance(plan_data, dict) else None
+    return columns
@@ -0,0 +1,275 @@
+"""计划和费用的流式导出 / 批量导入
+
+导出按 id 分批读取（每批 batch_size 行），逐条编码成字节块，内存占用与数据量无关；
+格式为每行一条 JSON 的 NDJSON，或 MessagePack（需要安装 msgpack），可选 gzip 或
+zstd（需要安装 zstandard）压缩。导入同样流式解码，按批写入 DatabaseService 或
+SupabaseService，可用于备份恢复，也可以在 SQLite 和 Supabase 之间迁移数据。
+
+记录的 type 为 header / user / plan / expense，派生列（目的地、费用摘要、检索文本等）
+不导出，导入时重新计算。
+"""
+import gzip
+import io
+import json
+import time
+import zlib
+from datetime import datetime, timezone
+from utils.plan_costs import extract_plan_columns
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖，没有安装时只能使用 NDJSON
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖，没有安装时只能使用 gzip 压缩
+    zstandard = None
+
+EXPORT_VERSION = 1
+EXPORT_TABLES = ('users', 'travel_plans', 'expenses')
+# 导出的列；导入时只写入这些列，派生列由 extract_plan_columns 重新计算
+EXPORT_COLUMNS = {
+    'users': ('id', 'username', 'email', 'password_hash', 'created_at'),
+    'travel_plans': ('id', 'user_id', 'title', 'plan_data', 'created_at', 'updated_at'),
+    'expenses': ('id', 'plan_id', 'user_id', 'category', 'amount', 'description', 'date', 'created_at')
+}
+RECORD_TYPES = {'users': 'user', 'travel_plans': 'plan', 'expenses': 'expense'}
+RECORD_TABLES = {value: key for key, value in RECORD_TYPES.items()}
+
+FORMATS = ('ndjson', 'msgpack')
+COMPRESSIONS = ('none', 'gzip', 'zstd')
+_EXTENSIONS = {'.ndjson': 'ndjson', '.jsonl': 'ndjson', '.msgpack': 'msgpack', '.mpk': 'msgpack'}
+_COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+# 累积到这么多字节再交给压缩器，减少小块压缩的开销
+CHUNK_SIZE = 64 * 1024
+
+
+class ExportFormatError(ValueError):
+    """格式不支持或缺少对应的可选依赖"""
+
+
+def detect_format(filename):
+    """按扩展名判断 (格式, 压缩)，如 backup.msgpack.zst -> ('msgpack', 'zstd')"""
+    name = filename.lower()
+    compression = 'none'
+    for extension, value in _COMPRESSION_EXTENSIONS.items():
+        if name.endswith(extension):
+            compression = value
+            name = name[:-len(extension)]
+    for extension, value in _EXTENSIONS.items():
+        if name.endswith(extension):
+            return value, compression
+    return 'ndjson', compression
+
+
+def file_extension(fmt, compression):
+    extension = '.ndjson' if fmt == 'ndjson' else '.msgpack'
+    return extension + {'gzip': '.gz', 'zstd': '.zst'}.get(compression, '')
+
+
+def check_format(fmt, compression):
+    """检查格式和压缩方式是否可用，不可用时抛出 ExportFormatError"""
+    if fmt not in FORMATS:
+        raise ExportFormatError(f'不支持的格式: {fmt}')
+    if compression not in COMPRESSIONS:
+        raise ExportFormatError(f'不支持的压缩方式: {compression}')
+    if fmt == 'msgpack' and msgpack is None:
+        raise ExportFormatError('MessagePack 格式需要安装 msgpack')
+    if compression == 'zstd' and zstandard is None:
+        raise ExportFormatError('zstd 压缩需要安装 zstandard')
+
+
+def iter_records(service, user_id=None, batch_size=1000):
+    """按表、按 id 分批读取，逐条生成导出记录；user_id 为空时导出整个数据库（含用户表）"""
+    yield {
+        'type': 'header',
+        'version': EXPORT_VERSION,
+        'scope': 'all' if user_id is None else 'user',
+        'exported_at': datetime.now(timezone.utc).isoformat()
+    }
+    tables = EXPORT_TABLES if user_id is None else EXPORT_TABLES[1:]
+    for table in tables:
+        record_type = RECORD_TYPES[table]
+        after_id = 0
+        while True:
+            rows = service.export_rows(table, after_id, batch_size, user_id)
+            for row in rows:
+                row['type'] = record_type
+                yield row
+            if len(rows) < batch_size:
+                break
+            after_id = rows[-1]['id']
+
+
+def _packer(fmt):
+    if fmt == 'msgpack':
+        return msgpack.Packer(use_bin_type=True, default=str).pack
+    return lambda record: (json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str) + '\n').encode('utf-8')
+
+
+def _compressor(compression, level=None):
+    if compression == 'gzip':
+        # wbits=31 输出带 gzip 头的流
+        return zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 31)
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+    return None
+
+
+def encode_records(records, fmt='ndjson', compression='none', level=None):
+    """把记录流编码为字节块（生成器），可直接写入文件或作为流式响应"""
+    check_format(fmt, compression)
+    pack = _packer(fmt)
+    compressor = _compressor(compression, level)
+    buffer = bytearray()
+    for record in records:
+        buffer += pack(record)
+        if len(buffer) >= CHUNK_SIZE:
+            data = compressor.compress(bytes(buffer)) if compressor else bytes(buffer)
+            buffer.clear()
+            if data:
+                yield data
+    data = compressor.compress(bytes(buffer)) + compressor.flush() if compressor else bytes(buffer)
+    if data:
+        yield data
+
+
+def decode_records(stream, fmt='ndjson', compression='none'):
+    """从二进制流中逐条解码记录（生成器）"""
+    check_format(fmt, compression)
+    if compression == 'gzip':
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    elif compression == 'zstd':
+        stream = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(stream))
+    if fmt == 'msgpack':
+        yield from msgpack.Unpacker(stream, raw=False)
+        return
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def import_records(service, records, user_id=None, batch_size=500):
+    """把记录流按批写入 service，返回各表处理的行数（恢复时已存在而跳过的行也计入）
+
+    user_id 为空时按原 id 恢复（已存在的 id 跳过，用户表一并导入）；否则全部计划和费用
+    导入到该用户名下并重新分配 id，费用按旧计划 id 对应到新计划。
+    """
+    counts = {table: 0 for table in EXPORT_TABLES}
+    counts['skipped'] = 0
+    pending = {table: [] for table in EXPORT_TABLES}
+    # 旧计划 id -> 新计划 id（只在导入到指定用户时使用）
+    plan_ids = {}
+
+    def flush(table):
+        # 先写入排在前面的表，保证费用写入时对应的计划已经存在
+        for earlier in EXPORT_TABLES[:EXPORT_TABLES.index(table)]:
+            if pending[earlier]:
+                flush(earlier)
+        rows = pending[table]
+        pending[table] = []
+        if not rows:
+            return
+        if user_id is None:
+            service.import_rows(table, rows, keep_ids=True)
+        elif table == 'travel_plans':
+            old_ids = [row['id'] for row in rows]
+            for row in rows:
+                row['user_id'] = user_id
+            plan_ids.update(zip(old_ids, service.import_rows(table, rows, keep_ids=False)))
+        else:
+            matched = []
+            for row in rows:
+                if row['plan_id'] in plan_ids:
+                    row['plan_id'] = plan_ids[row['plan_id']]
+                    row['user_id'] = user_id
+                    matched.append(row)
+            counts['skipped'] += len(rows) - len(matched)
+            rows = matched
+            if rows:
+                service.import_rows(table, rows, keep_ids=False)
+        counts[table] += len(rows)
+
+    for record in records:
+        record_type = record.pop('type', None)
+        if record_type == 'header':
+            if record.get('version', EXPORT_VERSION) > EXPORT_VERSION:
+                raise ExportFormatError(f"导出文件版本 {record.get('version')} 高于当前支持的版本")
+            continue
+        table = RECORD_TABLES.get(record_type)
+        if table is None or (table == 'users' and user_id is not None):
+            counts['skipped'] += 1
+            continue
+        pending[table].append(record)
+        if len(pending[table]) >= batch_size:
+            flush(table)
+    for table in EXPORT_TABLES:
+        flush(table)
+
+    if user_id is None and hasattr(service, 'sync_id_sequences'):
+        # 按原 id 写入后，让数据库的自增序列跳过已使用的 id
+        service.sync_id_sequences()
+    return counts
+
+
+def export_to_file(service, path, user_id=None, fmt=None, compression=None, batch_size=1000):
+    """导出到文件（格式默认按扩展名判断），返回 (记录数（不含文件头）, 字节数, 耗时秒)"""
+    detected = detect_format(path)
+    fmt, compression = fmt or detected[0], compression or detected[1]
+    count = 0
+    size = 0
+    start = time.perf_counter()
+
+    def counted(records):
+        nonlocal count
+        for record in records:
+            count += record['type'] != 'header'
+            yield record
+
+    with open(path, 'wb') as f:
+        for chunk in encode_records(counted(iter_records(service, user_id, batch_size)), fmt, compression):
+            f.write(chunk)
+            size += len(chunk)
+    return count, size, time.perf_counter() - start
+
+
+def import_from_file(service, path, user_id=None, fmt=None, compression=None, batch_size=500):
+    """从文件导入（格式默认按扩展名判断），返回 (各表行数, 耗时秒)"""
+    detected = detect_format(path)
+    fmt, compression = fmt or detected[0], compression or detected[1]
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        counts = import_records(service, decode_records(f, fmt, compression), user_id, batch_size)
+    return counts, time.perf_counter() - start
+
+
+def prepare_import_row(table, row, keep_ids=True):
+    """整理一行导入数据：只保留导出的列，计划补上派生列（plan_data 和 cost_summary 为字典）"""
+    columns = EXPORT_COLUMNS[table] if keep_ids else EXPORT_COLUMNS[table][1:]
+    prepared = {column: row.get(column) for column in columns}
+    if table == 'travel_plans':
+        plan_data = prepared['plan_data']
+        if isinstance(plan_data, str):
+            plan_data = json.loads(plan_data)
+        prepared['plan_data'] = plan_data
+        prepared['title'] = prepared['title'] or (plan_data or {}).get('destination') or '未命名计划'
+        prepared.update(extract_plan_columns(plan_data))
+    # 批量写入要求每行的列相同，缺少的时间取当前时间
+    for key in ('created_at', 'updated_at'):
+        if key in prepared and not prepared[key]:
+            prepared[key] = datetime.now(timezone.utc).isoformat()
+    return prepared
+
+
+def sqlite_timestamp(value):
+    """把 ISO 8601 时间（Supabase 导出的带时区时间）转换为 SQLite 使用的 UTC 'YYYY-MM-DD HH:MM:SS'"""
+    if not value or not isinstance(value, str) or 'T' not in value:
+        return value
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return value
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
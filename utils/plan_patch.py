@@ -0,0 +1,98 @@
+"""计划的局部修改（JSON Patch 子集）
+
+只支持 replace、add、remove 三种操作，path 使用 JSON Pointer 形式（如 /itinerary/2）。
+数据库只写入变化的部分：SQLite 用 json_set / json_insert / json_remove，
+Supabase 通过 apply_plan_patch 函数用 jsonb_set / jsonb_insert / #- 在服务端完成。
+"""
+import copy
+
+# 这些字段变化时需要重新计算列表视图使用的派生列
+SUMMARY_FIELDS = ('destination', 'duration', 'budget', 'budget_breakdown')
+# 这些字段变化时需要重新计算费用摘要（cost_summary）
+COST_FIELDS = ('itinerary', 'accommodation', 'transportation', 'budget', 'budget_breakdown')
+# 这些字段变化时需要重新生成检索文本（search_text）
+SEARCH_FIELDS = ('itinerary', 'accommodation', 'tips')
+
+
+class PatchError(ValueError):
+    pass
+
+
+def parse_path(path):
+    """'/itinerary/2/activities' -> ['itinerary', 2, 'activities']"""
+    if not isinstance(path, str) or not path.startswith('/'):
+        raise PatchError(f'无效的路径: {path}')
+    parts = []
+    for part in path[1:].split('/'):
+        part = part.replace('~1', '/').replace('~0', '~')
+        parts.append(int(part) if part.isdigit() else part)
+    return parts
+
+
+def apply_patch(plan_data, ops):
+    """在内存中应用补丁，返回新的计划字典（不修改原对象）"""
+    result = copy.deepcopy(plan_data)
+    for op in ops:
+        parts = parse_path(op['path'])
+        target = result
+        for part in parts[:-1]:
+            target = target[part]
+        last = parts[-1]
+        if op['op'] == 'remove':
+            del target[last]
+        elif op['op'] == 'add' and isinstance(target, list):
+            if last == '-':
+                target.append(op['value'])
+            else:
+                target.insert(last, op['value'])
+        else:
+            target[last] = op['value']
+    return result
+
+
+def touches_summary(ops):
+    """补丁是否会影响派生列（目的地、天数、总预算、行程天数）"""
+    for op in ops:
+        parts = parse_path(op['path'])
+        if parts[0] in SUMMARY_FIELDS:
+            return True
+        if parts[0] == 'itinerary' and (len(parts) == 1 or (len(parts) == 2 and op['op'] != 'replace')):
+            return True
+    return False
+
+
+def touches_costs(ops):
+    """补丁是否可能改变费用摘要（活动、住宿、交通的费用或预算拆分）"""
+    return any(parse_path(op['path'])[0] in COST_FIELDS for op in ops)
+
+
+def touches_search(ops):
+    """补丁是否可能改变检索文本（活动、地点、住宿或小贴士）"""
+    return any(parse_path(op['path'])[0] in SEARCH_FIELDS for op in ops)
+
+
+def sqlite_path(path):
+    """'/itinerary/2' -> '$.itinerary[2]'；'-' 表示数组末尾"""
+    result = '$'
+    for part in parse_path(path):
+        if isinstance(part, int):
+            result += f'[{part}]'
+        elif part == '-':
+            result += '[#]'
+        else:
+            result += '."' + part.replace('"', '\\"') + '"'
+    return result
+
+
+def postgres_path(path):
+    """'/itinerary/2' -> ['itinerary', '2']，供 jsonb_set 的 text[] 参数使用"""
+    return [str(part) for part in parse_path(path)]
+
+
+def needs_array_insert(ops):
+    """是否包含在数组中间插入的操作（SQLite 的 JSON 函数无法原地完成）"""
+    return any(op['op'] == 'add' and isinstance(parse_path(op['path'])[-1], int) for op in ops)
+
+
+def make_day_patch(day_index, day):
+    return [{'op': 'replace', 'path': f'/itinerary/{int(day_index)}', 'value': day}]
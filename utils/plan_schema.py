@@ -0,0 +1,307 @@
+"""旅行计划的紧凑 schema、提示词构建、容错解析和类型化校验
+
+输出给前端和数据库的键名与早期版本完全一致，只是提示词中的模板去掉了
+缩进和冗长说明，模型输出也经过校验后再返回。
+"""
+import json
+from dataclasses import dataclass, field, fields
+from utils.plan_utils import parse_number
+
+# 修改 schema 或提示词时递增，使旧的缓存结果失效
+PLAN_SCHEMA_VERSION = '2'
+
+# 支持 response_format={'type': 'json_object'} 的模型前缀
+JSON_MODE_MODELS = ('qwen-max', 'qwen-plus', 'qwen-turbo', 'qwen2.5', 'qwen3')
+
+PLAN_TEMPLATE = {
+    'destination': '目的地',
+    'duration': 'N天',
+    'budget': '总预算',
+    'travelers': '人数',
+    'preferences': ['偏好'],
+    'itinerary': [{
+        'day': 1,
+        'date': '日期',
+        'activities': [{'time': 'HH:MM', 'activity': '活动', 'location': '具体地点', 'cost': 0, 'notes': '备注'}]
+    }],
+    'accommodation': [{'name': '酒店', 'location': '位置', 'nights': 1, 'cost': 0}],
+    'transportation': {
+        'to_destination': {'type': '方式', 'cost': 0},
+        'local': {'type': '方式', 'cost': 0},
+        'from_destination': {'type': '方式', 'cost': 0}
+    },
+    'budget_breakdown': {
+        'transportation': 0, 'accommodation': 0, 'food': 0, 'activities': 0,
+        'shopping': 0, 'emergency': 0, 'total': 0
+    },
+    'tips': ['建议']
+}
+
+
+def build_plan_prompt():
+    """生成系统提示词：模板压缩为单行 JSON，减少每次调用的输入 token"""
+    template = json.dumps(PLAN_TEMPLATE, ensure_ascii=False, separators=(',', ':'))
+    return (
+        '你是专业的旅行规划助手。根据用户需求生成详细旅行计划，'
+        '只输出一个 JSON 对象，不要任何解释，结构如下（数值字段填数字，单位元）：\n'
+        + template
+    )
+
+
+DAY_PROMPT_MARKER = '单日行程'
+
+
+def build_day_prompt():
+    """重新生成单日行程的系统提示词，只包含一天的结构"""
+    template = json.dumps(PLAN_TEMPLATE['itinerary'][0], ensure_ascii=False, separators=(',', ':'))
+    return (
+        f'你是专业的旅行规划助手。根据计划概要和修改要求重新安排其中一天的{DAY_PROMPT_MARKER}，'
+        '不要与其他天重复，只输出一个 JSON 对象，不要任何解释，结构如下（cost 填数字，单位元）：\n'
+        + template
+    )
+
+
+def build_day_context(plan_data, day_index, instructions='', max_other=40):
+    """生成单日重排的用户消息：计划概要、当天原安排和其他天的活动名，不发送完整计划"""
+    itinerary = plan_data.get('itinerary') or []
+    day = itinerary[day_index]
+    other = [a.get('activity') for i, d in enumerate(itinerary) if i != day_index
+             for a in (d.get('activities') or []) if a.get('activity')]
+    context = {
+        'destination': plan_data.get('destination'),
+        'duration': plan_data.get('duration'),
+        'budget': plan_data.get('budget'),
+        'travelers': plan_data.get('travelers'),
+        'preferences': plan_data.get('preferences') or [],
+        'hotel': [h.get('name') for h in plan_data.get('accommodation') or []],
+        'day': day.get('day', day_index + 1),
+        'date': day.get('date', ''),
+        'current': [f"{a.get('time', '')} {a.get('activity', '')}".strip() for a in day.get('activities') or []],
+        'other_days': other[:max_other]
+    }
+    text = json.dumps(context, ensure_ascii=False, separators=(',', ':'))
+    return f'计划概要：{text}\n修改要求：{instructions or "换一些不同的安排"}'
+
+
+def supports_json_mode(model):
+    return bool(model) and model.startswith(JSON_MODE_MODELS)
+
+
+class PlanParseError(ValueError):
+    pass
+
+
+def repair_json_text(text):
+    """单次扫描修复模型输出，返回可直接 json.loads 的文本
+
+    - 跳过第一个 { 之前的说明文字和代码块标记，顶层对象闭合后忽略其余内容；
+    - 去掉 } 和 ] 之前多余的逗号；
+    - 输出被截断时丢弃最后一个不完整的元素并补齐括号。
+    """
+    start = text.find('{')
+    if start < 0:
+        raise PlanParseError('没有找到 JSON 对象')
+
+    out = []
+    stack = []
+    in_string = False
+    escape = False
+    # 截断时回退到的位置：(输出长度, 当时的括号栈)
+    checkpoint = None
+
+    for c in text[start:]:
+        if in_string:
+            out.append(c)
+            if escape:
+                escape = False
+            elif c == '\\':
+                escape = True
+            elif c == '"':
+                in_string = False
+            continue
+
+        if c == '"':
+            in_string = True
+            out.append(c)
+        elif c in '{[':
+            in_array = bool(stack) and stack[-1] == ']'
+            stack.append('}' if c == '{' else ']')
+            out.append(c)
+            # 数组中未写完的对象整个丢弃，不留下空对象
+            if not (c == '{' and in_array):
+                checkpoint = (len(out), ''.join(stack))
+        elif c in '}]':
+            while out and out[-1] in ' \t\r\n':
+                out.pop()
+            if out and out[-1] == ',':
+                out.pop()
+            if not stack:
+                break
+            out.append(stack.pop())
+            if not stack:
+                return ''.join(out)
+            checkpoint = (len(out), ''.join(stack))
+        elif c == ',':
+            checkpoint = (len(out), ''.join(stack))
+            out.append(c)
+        else:
+            out.append(c)
+
+    if checkpoint is None:
+        raise PlanParseError('JSON 内容不完整')
+    length, open_brackets = checkpoint
+    repaired = ''.join(out[:length]).rstrip()
+    if repaired.endswith(','):
+        repaired = repaired[:-1]
+    return repaired + open_brackets[::-1]
+
+
+def parse_plan_text(text):
+    """解析模型输出的计划文本，返回字典；无法解析时抛出 PlanParseError"""
+    try:
+        data = json.loads(repair_json_text(text))
+    except json.JSONDecodeError as e:
+        raise PlanParseError(f'JSON 解析失败: {e}')
+    if not isinstance(data, dict):
+        raise PlanParseError('计划不是 JSON 对象')
+    return data
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def _number(value):
+    number = parse_number(value, 0)
+    if isinstance(number, float) and number.is_integer():
+        return int(number)
+    return number
+
+
+def _int(value, default=0):
+    return int(parse_number(value, default))
+
+
+def _items(value):
+    return value if isinstance(value, list) else []
+
+
+def _extra(data, cls):
+    """保留模型额外返回的字段，输出时原样带回"""
+    known = {f.name for f in fields(cls)}
+    return {k: v for k, v in data.items() if k not in known}
+
+
+@dataclass
+class Activity:
+    time: str = ''
+    activity: str = ''
+    location: str = ''
+    cost: float = 0
+    notes: str = ''
+    extra: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(time=_text(data.get('time')), activity=_text(data.get('activity')),
+                   location=_text(data.get('location')), cost=_number(data.get('cost')),
+                   notes=_text(data.get('notes')), extra=_extra(data, cls))
+
+    def to_dict(self):
+        return {**self.extra, 'time': self.time, 'activity': self.activity,
+                'location': self.location, 'cost': self.cost, 'notes': self.notes}
+
+
+@dataclass
+class DayPlan:
+    day: int = 0
+    date: str = ''
+    activities: list = field(default_factory=list)
+    extra: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data, index=0):
+        return cls(day=_int(data.get('day'), index + 1), date=_text(data.get('date')),
+                   activities=[Activity.from_dict(a) for a in _items(data.get('activities')) if isinstance(a, dict)],
+                   extra=_extra(data, cls))
+
+    def to_dict(self):
+        return {**self.extra, 'day': self.day, 'date': self.date,
+                'activities': [a.to_dict() for a in self.activities]}
+
+
+@dataclass
+class Accommodation:
+    name: str = ''
+    location: str = ''
+    nights: int = 0
+    cost: float = 0
+    extra: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(name=_text(data.get('name')), location=_text(data.get('location')),
+                   nights=_int(data.get('nights')), cost=_number(data.get('cost')), extra=_extra(data, cls))
+
+    def to_dict(self):
+        return {**self.extra, 'name': self.name, 'location': self.location,
+                'nights': self.nights, 'cost': self.cost}
+
+
+@dataclass
+class TravelPlan:
+    destination: str = ''
+    duration: str = ''
+    budget: str = ''
+    travelers: str = ''
+    preferences: list = field(default_factory=list)
+    itinerary: list = field(default_factory=list)
+    accommodation: list = field(default_factory=list)
+    transportation: dict = field(default_factory=dict)
+    budget_breakdown: dict = field(default_factory=dict)
+    tips: list = field(default_factory=list)
+    extra: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data):
+        """校验并规整模型输出：数值字段转为数字，列表字段保证是列表"""
+        transport = data.get('transportation')
+        transportation = {}
+        if isinstance(transport, dict):
+            for key, value in transport.items():
+                if isinstance(value, dict):
+                    transportation[key] = {**value, 'type': _text(value.get('type')), 'cost': _number(value.get('cost'))}
+        budget = data.get('budget_breakdown')
+        budget_breakdown = {k: _number(v) for k, v in budget.items()} if isinstance(budget, dict) else {}
+        return cls(
+            destination=_text(data.get('destination')),
+            duration=_text(data.get('duration')),
+            budget=_text(data.get('budget')),
+            travelers=_text(data.get('travelers')),
+            preferences=[_text(p) for p in _items(data.get('preferences'))],
+            itinerary=[DayPlan.from_dict(d, i) for i, d in enumerate(_items(data.get('itinerary'))) if isinstance(d, dict)],
+            accommodation=[Accommodation.from_dict(a) for a in _items(data.get('accommodation')) if isinstance(a, dict)],
+            transportation=transportation,
+            budget_breakdown=budget_breakdown,
+            tips=[_text(t) for t in _items(data.get('tips'))],
+            extra=_extra(data, cls)
+        )
+
+    def to_dict(self):
+        return {
+            **self.extra,
+            'destination': self.destination,
+            'duration': self.duration,
+            'budget': self.budget,
+            'travelers': self.travelers,
+            'preferences': self.preferences,
+            'itinerary': [d.to_dict() for d in self.itinerary],
+            'accommodation': [a.to_dict() for a in self.accommodation],
+            'transportation': self.transportation,
+            'budget_breakdown': self.budget_breakdown,
+            'tips': self.tips
+        }
@@ -0,0 +1,152 @@
+"""已保存计划的全文检索和分面统计
+
+保存计划时把活动名称、地点、住宿和小贴士拼成 search_text 列，目的地单独一列：
+SQLite 用 FTS5（trigram 分词，中文无需分词词典）建立外部内容索引，Supabase 用
+tsvector 加 pg_trgm 索引。检索只返回列表需要的摘要字段，不读取完整的 plan_data。
+
+查询词按空白切分，所有词都要命中；分面（天数、预算区间、创建月份）按命中文本查询
+的计划统计，不受分面筛选条件本身影响，便于切换筛选条件。
+"""
+import re
+
+# search_text 的最大长度，超出部分不参与检索
+SEARCH_TEXT_LIMIT = 8000
+# trigram 分词只能匹配至少 3 个字符的词，更短的词退回到 LIKE
+TRIGRAM_MIN_LENGTH = 3
+MAX_TERMS = 8
+
+DURATION_BUCKETS = (('1-3', 1, 3), ('4-7', 4, 7), ('8+', 8, None))
+BUDGET_BUCKETS = (('<2000', None, 2000), ('2000-5000', 2000, 5000),
+                  ('5000-10000', 5000, 10000), ('10000+', 10000, None))
+_MONTH = re.compile(r'^\d{4}-\d{2}$')
+
+
+def build_search_text(plan_data):
+    """提取活动名称、地点、住宿和小贴士，去重后每项一行"""
+    parts = []
+    for day in plan_data.get('itinerary') or []:
+        if not isinstance(day, dict):
+            continue
+        for activity in day.get('activities') or []:
+            if isinstance(activity, dict):
+                parts.extend((activity.get('activity'), activity.get('location')))
+    for hotel in plan_data.get('accommodation') or []:
+        if isinstance(hotel, dict):
+            parts.extend((hotel.get('name'), hotel.get('location')))
+    tips = plan_data.get('tips')
+    if isinstance(tips, list):
+        parts.extend(tips)
+
+    seen = set()
+    lines = []
+    for part in parts:
+        text = str(part).strip() if isinstance(part, (str, int, float)) else ''
+        if text and text not in seen:
+            seen.add(text)
+            lines.append(text)
+    return '\n'.join(lines)[:SEARCH_TEXT_LIMIT]
+
+
+def split_terms(query):
+    """查询词按空白切分（去重，最多 MAX_TERMS 个）"""
+    terms = []
+    for term in (query or '').split():
+        term = term.strip('"')
+        if term and term not in terms:
+            terms.append(term)
+    return terms[:MAX_TERMS]
+
+
+def fts_match_expression(terms):
+    """把长度足够的词拼成 FTS5 MATCH 表达式（每个词作为短语，AND 连接）"""
+    phrases = ['"' + term.replace('"', '""') + '"' for term in terms if len(term) >= TRIGRAM_MIN_LENGTH]
+    return ' AND '.join(phrases) or None
+
+
+def like_pattern(term):
+    """LIKE 模式，转义 % 和 _（转义符为反斜杠）"""
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _bucket(buckets, key):
+    for name, low, high in buckets:
+        if name == key:
+            return low, high
+    raise ValueError(f'无效的筛选条件: {key}')
+
+
+def parse_filters(args):
+    """把 duration / budget / month 参数（分面的取值）转换为范围条件，无效时抛出 ValueError"""
+    filters = {}
+    if args.get('duration'):
+        filters['min_duration'], filters['max_duration'] = _bucket(DURATION_BUCKETS, args['duration'])
+    if args.get('budget'):
+        filters['min_budget'], filters['max_budget'] = _bucket(BUDGET_BUCKETS, args['budget'])
+    if args.get('month'):
+        if not _MONTH.match(args['month']):
+            raise ValueError(f"无效的月份: {args['month']}")
+        filters['month'] = args['month']
+    return {key: value for key, value in filters.items() if value is not None}
+
+
+def _bucket_name(buckets, value, inclusive):
+    """inclusive 为真时区间两端都包含（天数），否则左闭右开（预算）"""
+    if value is None:
+        return None
+    for name, low, high in buckets:
+        if (low is None or value >= low) and (high is None or value < high or (inclusive and value == high)):
+            return name
+    return None
+
+
+def build_facets(groups):
+    """groups 为按 (duration, total_budget, month) 聚合的 {..., 'count': n}，返回各分面的计数"""
+    counts = {'duration': {}, 'budget': {}, 'month': {}}
+    for group in groups:
+        count = int(group['count'])
+        names = {
+            'duration': _bucket_name(DURATION_BUCKETS, group.get('duration'), True),
+            'budget': _bucket_name(BUDGET_BUCKETS, group.get('total_budget'), False),
+            'month': group.get('month')
+        }
+        for facet, name in names.items():
+            if name:
+                counts[facet][name] = counts[facet].get(name, 0) + count
+
+    order = {
+        'duration': [name for name, _, _ in DURATION_BUCKETS],
+        'budget': [name for name, _, _ in BUDGET_BUCKETS],
+        'month': sorted(counts['month'], reverse=True)
+    }
+    return {facet: [{'key': name, 'count': counts[facet][name]} for name in order[facet] if name in counts[facet]]
+            for facet in counts}
+
+
+def format_search_response(data, terms):
+    """把后端返回的 {results, total, facet_groups} 整理为接口格式：检索文本换成摘要，分组换成分面"""
+    results = []
+    for row in data.get('results') or []:
+        result = {key: value for key, value in dict(row).items() if key not in ('search_text', 'rank')}
+        result['snippet'] = make_snippet(row['search_text'], terms)
+        results.append(result)
+    return {
+        'results': results,
+        'total': int(data.get('total') or 0),
+        'facets': build_facets(data.get('facet_groups') or [])
+    }
+
+
+def make_snippet(text, terms, width=40):
+    """取 search_text 中第一个命中词所在的一行作为摘要，过长时截取命中词附近"""
+    if not text:
+        return ''
+    lowered = [term.lower() for term in terms]
+    for line in text.split('\n'):
+        position = next((line.lower().find(term) for term in lowered if term in line.lower()), -1)
+        if position < 0:
+            continue
+        if len(line) <= width:
+            return line
+        start = max(0, position - width // 3)
+        return ('…' if start else '') + line[start:start + width] + ('…' if start + width < len(line) else '')
+    return ''
@@ -0,0 +1,59 @@
+import base64
+import json
+import re
+
+_NUMBER = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+def parse_number(value, default=None):
+    """从 5000、"5000元"、"约3天" 这类值中取出数值"""
+    if isinstance(value, bool):
+        return default
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        match = _NUMBER.search(value.replace(',', ''))
+        if match:
+            number = float(match.group())
+            return int(number) if number.is_integer() else number
+    return default
+
+
+def extract_plan_summary(plan_data):
+    """提取列表/摘要视图需要的派生字段，保存计划时写入独立列"""
+    itinerary = plan_data.get('itinerary')
+    day_count = len(itinerary) if isinstance(itinerary, list) else 0
+
+    breakdown = plan_data.get('budget_breakdown')
+    total_budget = None
+    if isinstance(breakdown, dict):
+        total_budget = parse_number(breakdown.get('total'))
+    if total_budget is None:
+        total_budget = parse_number(plan_data.get('budget'))
+
+    duration = parse_number(plan_data.get('duration'))
+    if duration is None and day_count:
+        duration = day_count
+
+    return {
+        'destination': plan_data.get('destination'),
+        'duration': int(duration) if duration is not None else None,
+        'total_budget': total_budget,
+        'day_count': day_count
+    }
+
+
+def encode_cursor(created_at, plan_id):
+    """把列表最后一条记录的 (created_at, id) 编码成分页游标"""
+    raw = json.dumps([created_at, plan_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析分页游标，格式不正确时抛出 ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, plan_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return str(created_at), int(plan_id)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f'无效的分页游标: {cursor}') from e
@@ -0,0 +1,90 @@
+"""慢请求采样分析
+
+后台线程每隔 interval 秒读取一次正在处理请求的线程的调用栈（sys._current_frames），
+请求结束时如果耗时超过阈值，就把采样结果按 collapsed 格式写入文件：
+每行 "帧;帧;帧 次数"，可以直接交给 flamegraph.pl 或 speedscope 生成火焰图。
+采样只读取栈帧，不需要 settrace，对未命中阈值的请求几乎没有额外开销。
+"""
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+
+def collapse_stack(frame):
+    """把栈帧转成从外到内、以分号连接的一行"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SlowRequestProfiler:
+    def __init__(self, output_dir, threshold_ms, interval_ms=5, max_files=200):
+        self.output_dir = output_dir
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.max_files = max_files
+        self.dumps = 0
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            os.makedirs(self.output_dir, exist_ok=True)
+            self._thread = threading.Thread(target=self._loop, name='slow-request-profiler', daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        me = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                idents = list(self._active)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident in idents:
+                    samples = self._active.get(ident)
+                    frame = frames.get(ident)
+                    if samples is not None and frame is not None and ident != me:
+                        samples[collapse_stack(frame)] += 1
+
+    def begin(self):
+        """在请求开始时调用，开始采样当前线程"""
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+
+    def end(self, name, elapsed):
+        """请求结束时调用；耗时超过阈值时写出采样文件，返回文件路径"""
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        if not samples or elapsed < self.threshold:
+            return None
+        safe_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_') or 'request'
+        path = os.path.join(self.output_dir, f'{int(time.time() * 1000)}-{safe_name}-{int(elapsed * 1000)}ms.folded')
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in samples.most_common():
+                    f.write(f'{stack} {count}\n')
+            self.dumps += 1
+            self._prune()
+        except OSError as e:
+            print(f"写入采样文件错误: {e}")
+            return None
+        return path
+
+    def _prune(self):
+        """只保留最近的 max_files 个文件"""
+        files = sorted(f for f in os.listdir(self.output_dir) if f.endswith('.folded'))
+        for name in files[:-self.max_files]:
+            try:
+                os.remove(os.path.join(self.output_dir, name))
+            except OSError:
+                pass
@@ -0,0 +1,43 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucketLimiter:
+    """按 key（IP、用户名等）独立计数的令牌桶
+
+    每个 key 最多积累 capacity 个令牌，每秒补充 refill_rate 个，每次请求消耗一个。
+    只保留最近使用的 maxsize 个 key，防止伪造大量 key 撑爆内存。
+    """
+
+    def __init__(self, capacity, refill_rate, maxsize=100000):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def allow(self, key):
+        """消耗一个令牌，返回 (是否允许, 需要等待的秒数)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.refill_rate)
+            if tokens >= 1:
+                allowed, retry_after = True, 0
+                tokens -= 1
+            else:
+                allowed, retry_after = False, (1 - tokens) / self.refill_rate
+                self.rejected += 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return allowed, retry_after
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def stats(self):
+        return {'keys': len(self._buckets), 'rejected': self.rejected}
@@ -0,0 +1,104 @@
+import json
+
+
+class IncrementalPlanParser:
+    """增量 JSON 解析器
+
+    大模型流式输出计划 JSON 时逐段喂入文本，每当顶层数组（如 itinerary、
+    accommodation）中的某个元素对象闭合，就立即解析并产出该元素；
+    顶层的字符串字段（如 destination）在值结束时同样立即产出。
+    JSON 之前的说明文字或代码块标记会被忽略。
+    """
+
+    def __init__(self, watch=('itinerary', 'accommodation')):
+        self.watch = set(watch)
+        self.text = ''
+        self._pos = 0
+        self._started = False
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_key = None
+        self._top_key = None
+        self._value_pending = False
+        self._array_key = None
+        self._elem_start = None
+        self.done = False
+
+    def feed(self, chunk):
+        """追加一段文本，返回本次新完成的事件列表"""
+        self.text += chunk
+        events = []
+        text = self.text
+
+        for i in range(self._pos, len(text)):
+            if self.done:
+                break
+            c = text[i]
+
+            if not self._started:
+                if c == '{':
+                    self._started = True
+                    self._stack.append(c)
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == '\\':
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._on_string_end(i, events)
+                continue
+
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c in '{[':
+                if len(self._stack) == 1:
+                    self._value_pending = False
+                    if c == '[' and self._top_key in self.watch:
+                        self._array_key = self._top_key
+                self._stack.append(c)
+                if len(self._stack) == 3 and c == '{' and self._array_key:
+                    self._elem_start = i
+            elif c in '}]':
+                depth = len(self._stack)
+                if depth == 3 and c == '}' and self._elem_start is not None:
+                    element = self._loads(text[self._elem_start:i + 1])
+                    if element is not None:
+                        events.append({'type': self._array_key, 'data': element})
+                    self._elem_start = None
+                elif depth == 2 and c == ']':
+                    self._array_key = None
+                self._stack.pop()
+                if not self._stack:
+                    self.done = True
+            elif len(self._stack) == 1:
+                if c == ':':
+                    self._top_key = self._last_key
+                    self._value_pending = True
+                elif c == ',':
+                    self._value_pending = False
+
+        self._pos = len(text)
+        return events
+
+    def _on_string_end(self, end, events):
+        if len(self._stack) != 1:
+            return
+        value = self._loads(self.text[self._string_start:end + 1])
+        if self._value_pending:
+            events.append({'type': 'field', 'key': self._top_key, 'value': value})
+            self._value_pending = False
+        else:
+            self._last_key = value
+
+    @staticmethod
+    def _loads(fragment):
+        try:
+            return json.loads(fragment)
+        except json.JSONDecodeError:
+            return None
@@ -1,6 +1,15 @@
 from supabase import create_client, Client
 from config import Config
-import hashlib
+from utils.cache import TTLCache
+from utils.plan_utils import encode_cursor, decode_cursor
+from utils.plan_costs import extract_plan_columns
+from utils.plan_export import EXPORT_COLUMNS, prepare_import_row
+from utils.plan_patch import touches_costs, touches_search
+from utils.plan_search import format_search_response, like_pattern, split_terms
+from utils.expense_utils import build_expense_summary, validate_expenses
+from utils.budget_analysis import group_budget_inputs
+from utils.password_service import get_password_hasher
+import copy
 import json
 from datetime import datetime
 
@@ -10,16 +19,23 @@ class SupabaseService:
             Config.SUPABASE_URL,
             Config.SUPABASE_KEY
         )
+        # 已解析的计划详情缓存，更新/删除时失效
+        self.plan_cache = TTLCache(maxsize=Config.PLAN_DETAIL_CACHE_SIZE, ttl=Config.PLAN_DETAIL_CACHE_TTL)
+    
+    def _decode_plan_data(self, plan_data):
+        """plan_data 是 JSONB；兼容早期以 JSON 字符串形式写入的数据"""
+        if isinstance(plan_data, str):
+            return json.loads(plan_data)
+        return plan_data
     
     def hash_password(self, password):
-        """密码哈希"""
-        return hashlib.sha256(password.encode()).hexdigest()
+        """密码哈希（scrypt，在独立的计算池中执行）"""
+        return get_password_hasher().hash(password)
     
     def create_user(self, username, email, password):
         """创建用户"""
+        password_hash = self.hash_password(password)
         try:
-            password_hash = self.hash_password(password)
-            
             data = {
                 'username': username,
                 'email': email,
@@ -35,22 +51,35 @@ class SupabaseService:
             return False, f'注册失败: {error_msg}'
     
     def authenticate_user(self, username, password):
-        """验证用户"""
+        """验证用户；旧格式的密码哈希在登录成功时自动升级"""
         try:
-            password_hash = self.hash_password(password)
-            
             result = self.supabase.table('users')\
                 .select('*')\
                 .eq('username', username)\
-                .eq('password_hash', password_hash)\
                 .execute()
-            
-            if result.data and len(result.data) > 0:
-                return result.data[0]
-            return None
         except Exception as e:
             print(f"认证错误: {e}")
             return None
+        
+        hasher = get_password_hasher()
+        if not result.data:
+            hasher.dummy_verify(password).result()
+            return None
+        user = result.data[0]
+        if not hasher.verify(password, user['password_hash']):
+            return None
+        
+        if hasher.needs_rehash(user['password_hash']):
+            self._update_password_hash(user['id'], hasher.hash(password))
+        return user
+    
+    def _update_password_hash(self, user_id, password_hash):
+        try:
+            result = self.supabase.table('users').update({'password_hash': password_hash}).eq('id', user_id).execute()
+            if not result.data:
+                print("更新密码哈希失败: 没有更新到用户行（users 表的更新权限只授予 service_role）")
+        except Exception as e:
+            print(f"更新密码哈希错误: {e}")
     
     def get_user_by_id(self, user_id):
         """根据 ID 获取用户"""
@@ -71,12 +100,13 @@ class SupabaseService:
         """保存旅行计划"""
         try:
             title = plan_data.get('destination', '未命名计划')
-            plan_json = json.dumps(plan_data, ensure_ascii=False)
             
+            # 直接写入 JSONB，避免被二次编码成字符串
             data = {
                 'user_id': user_id,
                 'title': title,
-                'plan_data': plan_json
+                'plan_data': plan_data,
+                **extract_plan_columns(plan_data)
             }
             
             result = self.supabase.table('travel_plans').insert(data).execute()
@@ -92,7 +122,7 @@ class SupabaseService:
         """获取用户的所有计划"""
         try:
             result = self.supabase.table('travel_plans')\
-                .select('id, title, created_at, updated_at')\
+                .select('id, title, destination, duration, total_budget, day_count, created_at, updated_at')\
                 .eq('user_id', user_id)\
                 .order('created_at', desc=True)\
                 .execute()
@@ -102,8 +132,45 @@ class SupabaseService:
             print(f"获取计划列表错误: {e}")
             return []
     
+    def get_user_plans_page(self, user_id, limit, cursor=None):
+        """按 (created_at, id) 键集分页获取计划列表，返回 (plans, next_cursor)"""
+        try:
+            query = self.supabase.table('travel_plans')\
+                .select('id, title, destination, duration, total_budget, day_count, created_at, updated_at')\
+                .eq('user_id', user_id)
+            
+            if cursor:
+                created_at, plan_id = decode_cursor(cursor)
+                # postgrest-py 没有 or_ 方法，直接追加 PostgREST 的 or 过滤参数
+                query.params = query.params.add(
+                    'or', f'(created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{plan_id}))'
+                )
+            
+            result = query\
+                .order('created_at', desc=True)\
+                .order('id', desc=True)\
+                .limit(limit + 1)\
+                .execute()
+            
+            rows = result.data or []
+            plans = rows[:limit]
+            next_cursor = None
+            if len(rows) > limit:
+                last = plans[-1]
+                next_cursor = encode_cursor(last['created_at'], last['id'])
+            return plans, next_cursor
+        except ValueError:
+            raise
+        except Exception as e:
+            print(f"获取计划列表错误: {e}")
+            return [], None
+    
     def get_plan_by_id(self, plan_id, user_id):
-        """获取特定计划"""
+        """获取特定计划，已解析的结果会被缓存（返回副本，调用方修改不会影响缓存）"""
+        cached = self.plan_cache.get(int(plan_id))
+        if cached is not None:
+            return copy.deepcopy(cached) if str(cached['user_id']) == str(user_id) else None
+        
         try:
             result = self.supabase.table('travel_plans')\
                 .select('*')\
@@ -113,23 +180,40 @@ class SupabaseService:
             
             if result.data and len(result.data) > 0:
                 plan = result.data[0]
-                plan['plan_data'] = json.loads(plan['plan_data'])
+                plan['plan_data'] = self._decode_plan_data(plan['plan_data'])
+                self.plan_cache.set(int(plan['id']), copy.deepcopy(plan))
                 return plan
             return None
         except Exception as e:
             print(f"获取计划详情错误: {e}")
             return None
     
+    def get_plan_day(self, plan_id, user_id, day_index):
+        """通过 JSONB 路径查询只取出某一天的行程"""
+        try:
+            result = self.supabase.table('travel_plans')\
+                .select(f'day:plan_data->itinerary->{int(day_index)}')\
+                .eq('id', plan_id)\
+                .eq('user_id', user_id)\
+                .execute()
+            
+            if result.data and len(result.data) > 0:
+                return result.data[0]['day']
+            return None
+        except Exception as e:
+            print(f"获取行程天错误: {e}")
+            return None
+    
     def update_plan(self, plan_id, user_id, plan_data):
         """更新旅行计划"""
         try:
             title = plan_data.get('destination', '未命名计划')
-            plan_json = json.dumps(plan_data, ensure_ascii=False)
             
             data = {
                 'title': title,
-                'plan_data': plan_json,
-                'updated_at': datetime.utcnow().isoformat()
+                'plan_data': plan_data,
+                'updated_at': datetime.utcnow().isoformat(),
+                **extract_plan_columns(plan_data)
             }
             
             result = self.supabase.table('travel_plans')\
@@ -138,11 +222,39 @@ class SupabaseService:
                 .eq('user_id', user_id)\
                 .execute()
             
-            return True
+            self.plan_cache.delete(int(plan_id))
+            # 计划不存在或不属于该用户时没有更新到任何行
+            return bool(result.data)
         except Exception as e:
             print(f"更新计划错误: {e}")
             return False
     
+    def apply_plan_patch(self, plan_id, user_id, ops):
+        """按 JSON Patch 局部修改计划，由数据库函数 apply_plan_patch 用 jsonb_set 在服务端合并"""
+        try:
+            result = self.supabase.rpc('apply_plan_patch', {
+                'p_plan_id': plan_id,
+                'p_user_id': user_id,
+                'p_ops': ops
+            }).execute()
+            if result.data and (touches_costs(ops) or touches_search(ops)):
+                self._refresh_derived_columns(plan_id)
+            self.plan_cache.delete(int(plan_id))
+            return bool(result.data)
+        except Exception as e:
+            print(f"局部更新计划错误: {e}")
+            return False
+    
+    def _refresh_derived_columns(self, plan_id):
+        """数据库函数无法生成费用摘要和检索文本，补丁改动相关字段后读回计划重新计算"""
+        rows = self.supabase.table('travel_plans').select('plan_data').eq('id', plan_id).execute().data
+        if rows:
+            columns = extract_plan_columns(rows[0]['plan_data'])
+            self.supabase.table('travel_plans')\
+                .update({'cost_summary': columns['cost_summary'], 'search_text': columns['search_text']})\
+                .eq('id', plan_id)\
+                .execute()
+    
     def delete_plan(self, plan_id, user_id):
         """删除旅行计划"""
         try:
@@ -151,6 +263,7 @@ class SupabaseService:
                 .eq('id', plan_id)\
                 .eq('user_id', user_id)\
                 .execute()
+            self.plan_cache.delete(int(plan_id))
             return True
         except Exception as e:
             print(f"删除计划错误: {e}")
@@ -174,6 +287,33 @@ class SupabaseService:
             print(f"添加费用记录错误: {e}")
             return False
     
+    def add_expenses(self, plan_id, user_id, expenses):
+        """批量添加费用记录：一次 HTTP 请求批量插入，返回每条的结果"""
+        valid, results = validate_expenses(expenses)
+        if not valid:
+            return results
+        
+        try:
+            owner = self.supabase.table('travel_plans')\
+                .select('id')\
+                .eq('id', plan_id)\
+                .eq('user_id', user_id)\
+                .execute()
+            if not owner.data:
+                error = '计划不存在'
+            else:
+                rows = [{'plan_id': plan_id, 'user_id': user_id, **expense} for _, expense in valid]
+                self.supabase.table('expenses').insert(rows).execute()
+                error = None
+        except Exception as e:
+            print(f"批量添加费用记录错误: {e}")
+            error = '保存失败'
+        
+        if error:
+            for index, _ in valid:
+                results[index].update(success=False, error=error)
+        return results
+    
     def get_plan_expenses(self, plan_id, user_id):
         """获取计划的所有费用记录"""
         try:
@@ -188,3 +328,108 @@ class SupabaseService:
         except Exception as e:
             print(f"获取费用记录错误: {e}")
             return []
+    
+    def delete_expense(self, expense_id, user_id):
+        """删除费用记录（汇总表由数据库触发器同步更新）"""
+        try:
+            result = self.supabase.table('expenses')\
+                .delete()\
+                .eq('id', expense_id)\
+                .eq('user_id', user_id)\
+                .execute()
+            return bool(result.data)
+        except Exception as e:
+            print(f"删除费用记录错误: {e}")
+            return False
+    
+    def get_expense_summary(self, plan_id, user_id):
+        """从汇总表读取计划的费用总计、分类合计和每日合计"""
+        try:
+            result = self.supabase.table('expense_summaries')\
+                .select('category, date, total, count')\
+                .eq('plan_id', plan_id)\
+                .eq('user_id', user_id)\
+                .execute()
+            return build_expense_summary(result.data or [])
+        except Exception as e:
+            print(f"获取费用汇总错误: {e}")
+            return build_expense_summary([])
+    
+    def get_budget_inputs(self, plan_ids, user_id):
+        """批量读取多个计划的预算拆分和费用汇总，供预算分析使用"""
+        plan_ids = [int(plan_id) for plan_id in plan_ids]
+        if not plan_ids:
+            return []
+        try:
+            plans = self.supabase.table('travel_plans')\
+                .select('id, destination, total_budget, cost_summary, budget_breakdown:plan_data->budget_breakdown')\
+                .eq('user_id', user_id)\
+                .in_('id', plan_ids)\
+                .execute()
+            rows = self.supabase.table('expense_summaries')\
+                .select('plan_id, category, date, total, count')\
+                .eq('user_id', user_id)\
+                .in_('plan_id', plan_ids)\
+                .execute()
+            return group_budget_inputs(plan_ids, plans.data or [], rows.data or [])
+        except Exception as e:
+            print(f"获取预算数据错误: {e}")
+            return []
+    
+    def search_plans(self, user_id, query='', filters=None, limit=20, offset=0):
+        """由数据库函数 search_plans 完成全文检索和分面统计，返回摘要而不读取 plan_data"""
+        terms = split_terms(query)
+        try:
+            result = self.supabase.rpc('search_plans', {
+                'p_user_id': user_id,
+                'p_query': ' '.join(terms),
+                'p_terms': [like_pattern(term) for term in terms],
+                'p_filters': filters or {},
+                'p_limit': limit,
+                'p_offset': offset
+            }).execute()
+            return format_search_response(result.data or {}, terms)
+        except Exception as e:
+            print(f"检索计划错误: {e}")
+            return None
+    
+    # 以下方法供导出 / 导入使用，失败时直接抛出异常
+    def export_rows(self, table, after_id=0, limit=1000, user_id=None):
+        """按 id 顺序读取 after_id 之后的一批行"""
+        query = self.supabase.table(table).select(', '.join(EXPORT_COLUMNS[table])).gt('id', after_id)
+        if user_id is not None:
+            query = query.eq('user_id', user_id)
+        rows = query.order('id').limit(limit).execute().data or []
+        if table == 'travel_plans':
+            for row in rows:
+                row['plan_data'] = self._decode_plan_data(row['plan_data'])
+        return rows
+    
+    def import_rows(self, table, rows, keep_ids=True):
+        """一次请求批量写入，返回各行的 id；keep_ids 为真时保留原 id，已存在的行跳过"""
+        payload = [prepare_import_row(table, row, keep_ids) for row in rows]
+        if keep_ids:
+            self.supabase.table(table)\
+                .upsert(payload, on_conflict='id', ignore_duplicates=True, returning='minimal')\
+                .execute()
+            return [row['id'] for row in payload]
+        result = self.supabase.table(table).insert(payload).execute()
+        return [row['id'] for row in result.data]
+    
+    def sync_id_sequences(self):
+        """按原 id 导入后把自增序列推进到各表的最大 id"""
+        self.supabase.rpc('sync_id_sequences', {}).execute()
+    
+    # 以下方法供后台同步服务使用：按主键整行写入，失败时直接抛出异常以便重试
+    def upsert_rows(self, table, rows):
+        """按 id 批量插入或覆盖整行"""
+        self.supabase.table(table).upsert(rows, on_conflict='id').execute()
+    
+    def delete_rows(self, table, ids):
+        """按 id 批量删除"""
+        self.supabase.table(table).delete().in_('id', ids).execute()
+    
+    def fetch_rows(self, table, ids):
+        """按 id 批量读取整行"""
+        result = self.supabase.table(table).select('*').in_('id', ids).execute()
+        return result.data or []
@@ -0,0 +1,327 @@
+import httpx
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from utils.db_service import DatabaseService
+
+# 按外键依赖排序：写入时从前往后，删除时从后往前
+SYNC_TABLES = ('users', 'travel_plans', 'expenses')
+
+# 推送到云端的列（本地独有的列不会同步）
+SYNC_COLUMNS = {
+    'users': ('id', 'username', 'email', 'password_hash', 'created_at'),
+    'travel_plans': ('id', 'user_id', 'title', 'plan_data', 'destination', 'duration',
+                     'total_budget', 'day_count', 'cost_summary', 'search_text', 'created_at', 'updated_at'),
+    'expenses': ('id', 'plan_id', 'user_id', 'category', 'amount', 'description', 'date', 'created_at')
+}
+
+
+def _is_transient(error):
+    """网络错误、429 和 5xx 与具体的行无关：整批稍后重试，不计入各行的失败次数"""
+    if isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError)):
+        return True
+    status = getattr(error, 'status_code', None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+def _parse_timestamp(value):
+    """统一解析 SQLite（UTC、无时区）和 Postgres（带时区）的时间戳"""
+    if not value:
+        return None
+    text = str(value).replace(' ', 'T', 1)
+    if text.endswith('Z'):
+        text = text[:-1] + '+00:00'
+    try:
+        parsed = datetime.fromisoformat(text)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+class HybridDatabaseService(DatabaseService):
+    """混合存储：所有读写都走本地 SQLite，变更记录到 sync_changes 表，
+    由 SupabaseSyncWorker 在后台批量推送到云端"""
+
+    def init_db(self):
+        super().init_db()
+        with self.connection() as conn:
+            self._create_change_log(conn)
+
+    def _create_change_log(self, conn):
+        created = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sync_changes'"
+        ).fetchone() is None
+
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS sync_changes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                table_name TEXT NOT NULL,
+                row_id INTEGER NOT NULL,
+                op TEXT NOT NULL,
+                changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                claimed_by TEXT,
+                claimed_until REAL,
+                next_attempt_at REAL NOT NULL DEFAULT 0
+            )
+        ''')
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(sync_changes)')}
+        if 'next_attempt_at' not in columns:
+            conn.execute('ALTER TABLE sync_changes ADD COLUMN next_attempt_at REAL NOT NULL DEFAULT 0')
+        # 新变更的 next_attempt_at 为 0，排在等待重试的变更之前
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_sync_changes_due ON sync_changes (next_attempt_at, id)')
+        # 变更日志只记录行 ID，同步时读取最新的行数据，同一行的多次修改只推送一次
+        for table in SYNC_TABLES:
+            conn.executescript(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_sync_{table}_insert AFTER INSERT ON {table}
+                BEGIN
+                    INSERT INTO sync_changes (table_name, row_id, op) VALUES ('{table}', NEW.id, 'upsert');
+                END;
+                CREATE TRIGGER IF NOT EXISTS trg_sync_{table}_update AFTER UPDATE ON {table}
+                BEGIN
+                    INSERT INTO sync_changes (table_name, row_id, op) VALUES ('{table}', NEW.id, 'upsert');
+                END;
+                CREATE TRIGGER IF NOT EXISTS trg_sync_{table}_delete AFTER DELETE ON {table}
+                BEGIN
+                    INSERT INTO sync_changes (table_name, row_id, op) VALUES ('{table}', OLD.id, 'delete');
+                END;
+            ''')
+
+        if created:
+            self._backfill_change_log(conn)
+
+    def _backfill_change_log(self, conn):
+        """首次开启混合模式时，把已有的行全部记为待推送，先父表后子表，保证云端外键可以满足"""
+        for table in SYNC_TABLES:
+            conn.execute(
+                f"INSERT INTO sync_changes (table_name, row_id, op) SELECT '{table}', id, 'upsert' FROM {table} ORDER BY id"
+            )
+
+
+class SupabaseSyncWorker:
+    """后台同步线程：把本地变更日志批量推送到云端
+
+    remote 需要提供 upsert_rows(table, rows)、delete_rows(table, ids)
+    和 fetch_rows(table, ids) 三个方法（SupabaseService 已实现），
+    因此也可以换成本地替身进行测试。
+    计划表以 updated_at 解决冲突：云端版本更新时不覆盖，而是拉取到本地。
+    某张表的整批写入被拒绝时逐行重试，只有失败的行计入重试次数并按指数退避推迟，
+    不会拖住同一批中的其他变更。
+    """
+
+    def __init__(self, local, remote, batch_size=200, interval=2.0, max_attempts=10, lease=60):
+        self.local = local
+        self.remote = remote
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.worker_id = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.synced = 0
+        self.pulled = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_sync_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='supabase-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        consecutive_failures = 0
+        while not self._stop.is_set():
+            try:
+                processed = self.run_once()
+                consecutive_failures = 0
+                # 还有积压时立即处理下一批
+                if processed >= self.batch_size:
+                    continue
+                delay = self.interval
+            except Exception as e:
+                consecutive_failures += 1
+                delay = min(self.interval * (2 ** consecutive_failures), 300)
+                print(f"云端同步失败，{delay:.0f} 秒后重试: {e}")
+            self._stop.wait(delay)
+
+    def _claim(self):
+        """按到期时间认领一批变更；多个进程同时运行时靠租约避免重复推送"""
+        claim_id = f'{self.worker_id}-{uuid.uuid4().hex[:8]}'
+        now = time.time()
+        with self.local.connection() as conn:
+            conn.execute(
+                '''UPDATE sync_changes SET claimed_by = ?, claimed_until = ?
+                   WHERE id IN (
+                       SELECT id FROM sync_changes
+                       WHERE attempts < ? AND next_attempt_at <= ?
+                         AND (claimed_until IS NULL OR claimed_until < ?)
+                       ORDER BY next_attempt_at, id LIMIT ?
+                   )''',
+                (claim_id, now + self.lease, self.max_attempts, now, now, self.batch_size)
+            )
+            rows = conn.execute(
+                'SELECT id, table_name, row_id, op, attempts FROM sync_changes WHERE claimed_by = ? ORDER BY id',
+                (claim_id,)
+            ).fetchall()
+        return claim_id, [dict(row) for row in rows]
+
+    def run_once(self):
+        """处理一批变更，返回处理的变更条数"""
+        claim_id, changes = self._claim()
+        if not changes:
+            return 0
+
+        # 同一行只保留最后一次操作
+        latest = {}
+        for change in changes:
+            latest[(change['table_name'], change['row_id'])] = change['op']
+
+        failed = {}
+        try:
+            for table in SYNC_TABLES:
+                ids = [row_id for (name, row_id), op in latest.items() if name == table and op == 'upsert']
+                if ids:
+                    failed.update(self._push_group(table, ids, self._push_upserts))
+            for table in reversed(SYNC_TABLES):
+                ids = [row_id for (name, row_id), op in latest.items() if name == table and op == 'delete']
+                if ids:
+                    failed.update(self._push_group(table, ids, self.remote.delete_rows))
+        except Exception as e:
+            # 暂时性错误：释放认领，由 _loop 退避后整批重试
+            self.failures += 1
+            self.last_error = str(e)
+            with self.local.connection() as conn:
+                conn.execute(
+                    'UPDATE sync_changes SET last_error = ?, claimed_by = NULL, claimed_until = NULL WHERE claimed_by = ?',
+                    (str(e)[:500], claim_id)
+                )
+            raise
+
+        now = time.time()
+        retries = []
+        for change in changes:
+            error = failed.get((change['table_name'], change['row_id']))
+            if error is not None:
+                delay = min(self.interval * (2 ** change['attempts']), 300)
+                retries.append((str(error)[:500], now + delay, change['id']))
+        with self.local.connection() as conn:
+            conn.executemany(
+                '''UPDATE sync_changes SET attempts = attempts + 1, last_error = ?, next_attempt_at = ?,
+                   claimed_by = NULL, claimed_until = NULL WHERE id = ?''',
+                retries
+            )
+            conn.execute('DELETE FROM sync_changes WHERE claimed_by = ?', (claim_id,))
+        if failed:
+            self.failures += 1
+            self.last_error = str(next(iter(failed.values())))
+        self.synced += len(changes) - len(retries)
+        self.last_sync_at = now
+        return len(changes)
+
+    def _push_group(self, table, ids, push):
+        """推送一张表的一组行，返回 {(表, 行 ID): 异常}；整组被拒绝时逐行重试找出有问题的行"""
+        try:
+            push(table, ids)
+            return {}
+        except Exception as e:
+            if _is_transient(e):
+                raise
+            if len(ids) == 1:
+                return {(table, ids[0]): e}
+        failed = {}
+        for row_id in ids:
+            try:
+                push(table, [row_id])
+            except Exception as e:
+                if _is_transient(e):
+                    raise
+                failed[(table, row_id)] = e
+        return failed
+
+    def _push_upserts(self, table, ids):
+        columns = SYNC_COLUMNS[table]
+        placeholders = ','.join('?' * len(ids))
+        with self.local.connection() as conn:
+            rows = [dict(row) for row in conn.execute(
+                f'SELECT {", ".join(columns)} FROM {table} WHERE id IN ({placeholders})', ids
+            )]
+        if not rows:
+            # 这些行之后已被删除，删除操作会单独同步
+            return
+
+        if table == 'travel_plans':
+            rows = self._resolve_plan_conflicts(rows)
+            for row in rows:
+                row['plan_data'] = json.loads(row['plan_data'])
+                row['cost_summary'] = json.loads(row['cost_summary']) if row['cost_summary'] else None
+        if rows:
+            self.remote.upsert_rows(table, rows)
+
+    def _resolve_plan_conflicts(self, rows):
+        """云端 updated_at 更新的计划不推送，改为拉取到本地"""
+        remote_rows = {row['id']: row for row in self.remote.fetch_rows('travel_plans', [r['id'] for r in rows])}
+        to_push = []
+        for row in rows:
+            remote = remote_rows.get(row['id'])
+            remote_time = _parse_timestamp(remote['updated_at']) if remote else None
+            local_time = _parse_timestamp(row['updated_at'])
+            if remote_time and local_time and remote_time > local_time:
+                self._pull_plan(remote)
+            else:
+                to_push.append(row)
+        return to_push
+
+    def _pull_plan(self, remote):
+        plan_data = remote['plan_data']
+        if not isinstance(plan_data, str):
+            plan_data = json.dumps(plan_data, ensure_ascii=False)
+        cost_summary = remote.get('cost_summary')
+        if cost_summary is not None and not isinstance(cost_summary, str):
+            cost_summary = json.dumps(cost_summary, ensure_ascii=False)
+        with self.local.connection() as conn:
+            last_change = conn.execute('SELECT COALESCE(MAX(id), 0) FROM sync_changes').fetchone()[0]
+            conn.execute(
+                '''UPDATE travel_plans SET title = ?, plan_data = ?, destination = ?, duration = ?,
+                   total_budget = ?, day_count = ?, cost_summary = ?, search_text = ?, updated_at = ?
+                   WHERE id = ?''',
+                (remote['title'], plan_data, remote.get('destination'), remote.get('duration'),
+                 remote.get('total_budget'), remote.get('day_count'), cost_summary, remote.get('search_text'),
+                 remote['updated_at'], remote['id'])
+            )
+            # 拉取本身触发的变更记录无需再推回云端
+            conn.execute(
+                "DELETE FROM sync_changes WHERE table_name = 'travel_plans' AND row_id = ? AND id > ?",
+                (remote['id'], last_change)
+            )
+        self.local.plan_cache.delete(int(remote['id']))
+        self.pulled += 1
+
+    def stats(self):
+        with self.local.connection() as conn:
+            pending = conn.execute(
+                'SELECT COUNT(*) FROM sync_changes WHERE attempts < ?', (self.max_attempts,)
+            ).fetchone()[0]
+            dead = conn.execute(
+                'SELECT COUNT(*) FROM sync_changes WHERE attempts >= ?', (self.max_attempts,)
+            ).fetchone()[0]
+        return {
+            'pending': pending,
+            'failed_permanently': dead,
+            'synced': self.synced,
+            'pulled': self.pulled,
+            'failures': self.failures,
+            'last_error': self.last_error,
+            'last_sync_at': self.last_sync_at
+        }
@@ -0,0 +1,96 @@
+import json
+import threading
+import time
+from utils.cache import TTLCache
+from utils.db_pool import ConnectionPool
+
+# 只缓存身份信息，不缓存密码哈希等敏感字段
+CACHED_USER_FIELDS = ('id', 'username', 'email')
+
+
+class UserCache:
+    """用户身份缓存
+
+    第一层是进程内 LRU；配置 shared_path 后增加一层本地 SQLite 共享存储，
+    同一台机器上的多个 worker 进程可以共用查询结果。
+    多进程部署时进程内缓存的 TTL 应设得较短，使其他进程的失效操作尽快生效。
+    """
+
+    def __init__(self, maxsize=10000, ttl=300, shared_path=None, shared_ttl=None):
+        self.ttl = ttl
+        self.shared_ttl = shared_ttl or ttl
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.shared_hits = 0
+        self.loads = 0
+        self._pool = None
+
+        if shared_path:
+            self._pool = ConnectionPool(shared_path, max_size=4)
+            with self._pool.connection() as conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS user_cache (
+                        user_id TEXT PRIMARY KEY,
+                        data TEXT NOT NULL,
+                        expires_at REAL NOT NULL
+                    )
+                ''')
+
+    def get_or_load(self, user_id, loader):
+        """按缓存层次查找用户，全部未命中时调用 loader(user_id) 并写回缓存"""
+        key = str(user_id)
+        user = self._memory.get(key)
+        if user is not None:
+            return user
+
+        if self._pool:
+            user = self._get_shared(key)
+            if user is not None:
+                with self._lock:
+                    self.shared_hits += 1
+                self._memory.set(key, user)
+                return user
+
+        with self._lock:
+            self.loads += 1
+        user_data = loader(user_id)
+        if not user_data:
+            return None
+
+        user = {field: user_data.get(field) for field in CACHED_USER_FIELDS}
+        self._memory.set(key, user)
+        if self._pool:
+            self._set_shared(key, user)
+        return user
+
+    def _get_shared(self, key):
+        with self._pool.connection() as conn:
+            row = conn.execute(
+                'SELECT data FROM user_cache WHERE user_id = ? AND expires_at > ?',
+                (key, time.time())
+            ).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def _set_shared(self, key, user):
+        with self._pool.connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO user_cache (user_id, data, expires_at) VALUES (?, ?, ?)',
+                (key, json.dumps(user, ensure_ascii=False), time.time() + self.shared_ttl)
+            )
+
+    def invalidate(self, user_id):
+        """账户信息变化时调用，清除所有缓存层中的记录"""
+        key = str(user_id)
+        self._memory.delete(key)
+        if self._pool:
+            with self._pool.connection() as conn:
+                conn.execute('DELETE FROM user_cache WHERE user_id = ?', (key,))
+
+    def stats(self):
+        stats = self._memory.stats()
+        stats['shared_hits'] = self.shared_hits
+        stats['loads'] = self.loads
+        requests = stats['hits'] + self.shared_hits + self.loads
+        stats['hit_ratio'] = round((stats['hits'] + self.shared_hits) / requests, 4) if requests else 0.0
+        stats['shared'] = self._pool is not None
+        return stats
@@ -3,39 +3,304 @@ import base64
 import hashlib
 import hmac
 import json
-from datetime import datetime
-from urllib.parse import urlencode
+import queue
+import threading
 import time
+import uuid
+from email.utils import formatdate
+from urllib.parse import urlencode
+
+# 科大讯飞语音听写（流式版）WebSocket 接口
+IAT_HOST = 'iat-api.xfyun.cn'
+IAT_PATH = '/v2/iat'
+# 讯飞要求签名中的 date 与服务器时间相差不超过 300 秒
+SIGNATURE_MAX_SKEW = 300
+AUDIO_FORMAT = 'audio/L16;rate=16000'
+
 
 class VoiceService:
     def __init__(self):
         self.app_id = Config.XFYUN_APP_ID
         self.api_key = Config.XFYUN_API_KEY
         self.api_secret = Config.XFYUN_API_SECRET
-    
+        # 签名按时间窗口缓存：同一窗口内所有客户端共用一个预签名 URL
+        self.window = max(1, min(Config.VOICE_SIGN_WINDOW, SIGNATURE_MAX_SKEW - 30))
+        self._signed = (None, None)
+        self._lock = threading.Lock()
+
     def get_client_config(self):
-        """获取客户端语音识别配置"""
+        """获取客户端语音识别配置：不下发密钥和预签名 URL，讯飞连接只由服务端中转发起"""
         return {
             'app_id': self.app_id,
-            'api_key': self.api_key,
-            # 注意：实际生产环境中，不应该直接暴露 API Secret
-            # 应该在后端生成签名后返回给前端
+            'relay': Config.VOICE_RELAY_ENABLED
         }
-    
-    def generate_signature(self):
-        """生成科大讯飞 WebSocket 连接签名"""
-        ts = str(int(time.time()))
-        base_string = self.app_id + ts
-        
-        signature = hmac.new(
-            self.api_secret.encode('utf-8'),
-            base_string.encode('utf-8'),
-            hashlib.sha1
-        ).digest()
-        
-        signature_b64 = base64.b64encode(signature).decode('utf-8')
-        
+
+    def generate_signature(self, now=None):
+        """生成科大讯飞 WebSocket 连接签名（HMAC-SHA256），同一时间窗口内复用"""
+        now = time.time() if now is None else now
+        window_start = int(now // self.window * self.window)
+        cached_start, cached = self._signed
+        if cached_start == window_start:
+            return cached
+
+        with self._lock:
+            if self._signed[0] == window_start:
+                return self._signed[1]
+            date = formatdate(window_start, usegmt=True)
+            signature_origin = f'host: {IAT_HOST}\ndate: {date}\nGET {IAT_PATH} HTTP/1.1'
+            signature = base64.b64encode(hmac.new(
+                self.api_secret.encode('utf-8'),
+                signature_origin.encode('utf-8'),
+                hashlib.sha256
+            ).digest()).decode('utf-8')
+            authorization_origin = (f'api_key="{self.api_key}", algorithm="hmac-sha256", '
+                                    f'headers="host date request-line", signature="{signature}"')
+            signed = {
+                'authorization': base64.b64encode(authorization_origin.encode('utf-8')).decode('utf-8'),
+                'date': date,
+                'host': IAT_HOST,
+                # 签名的 date 是窗口起点，超过允许的时间差后讯飞会拒绝连接
+                'expires_at': window_start + SIGNATURE_MAX_SKEW
+            }
+            self._signed = (window_start, signed)
+            return signed
+
+    def get_signed_url(self, now=None):
+        """返回预签名的 WebSocket URL 及其过期时间（Unix 时间戳）"""
+        signed = self.generate_signature(now)
+        params = {'authorization': signed['authorization'], 'date': signed['date'], 'host': signed['host']}
         return {
-            'ts': ts,
-            'signa': signature_b64
+            'url': f'wss://{IAT_HOST}{IAT_PATH}?{urlencode(params)}',
+            'expires_at': signed['expires_at']
         }
+
+
+class EchoRecognizer:
+    """本地识别替身：把收到的音频字节按 UTF-8 解码当作识别结果，用于测试和压测中转链路
+
+    每个分片返回一次累计的中间结果，结束时返回最终结果；latency 模拟识别耗时。
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def open(self, on_result):
+        return _EchoStream(on_result, self.latency)
+
+
+class _EchoStream:
+    def __init__(self, on_result, latency):
+        self.on_result = on_result
+        self.latency = latency
+        self.text = ''
+
+    def send(self, chunk, last=False):
+        if self.latency:
+            time.sleep(self.latency)
+        self.text += chunk.decode('utf-8', errors='ignore')
+        self.on_result(self.text, last)
+
+    def close(self):
+        pass
+
+
+class XfyunRecognizer:
+    """通过预签名 URL 连接讯飞语音听写，音频为 16k 16bit 单声道 PCM"""
+
+    def __init__(self, voice_service, timeout=10):
+        self.voice_service = voice_service
+        self.timeout = timeout
+
+    def open(self, on_result):
+        try:
+            import websocket
+        except ImportError:
+            raise RuntimeError('服务端中转需要安装 websocket-client')
+        ws = websocket.create_connection(self.voice_service.get_signed_url()['url'], timeout=self.timeout)
+        return _XfyunStream(ws, self.voice_service.app_id, on_result)
+
+
+class _XfyunStream:
+    def __init__(self, ws, app_id, on_result):
+        self.ws = ws
+        self.app_id = app_id
+        self.on_result = on_result
+        self.started = False
+        self.pieces = []
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    def send(self, chunk, last=False):
+        data = {
+            'status': 2 if last else (1 if self.started else 0),
+            'format': AUDIO_FORMAT,
+            'encoding': 'raw',
+            'audio': base64.b64encode(chunk).decode('ascii')
+        }
+        frame = {'data': data}
+        if not self.started:
+            frame['common'] = {'app_id': self.app_id}
+            frame['business'] = {'language': 'zh_cn', 'domain': 'iat', 'accent': 'mandarin'}
+            self.started = True
+        self.ws.send(json.dumps(frame))
+        if last:
+            self.reader.join(timeout=self.ws.gettimeout())
+
+    def _read(self):
+        try:
+            while True:
+                message = json.loads(self.ws.recv())
+                if message.get('code') != 0:
+                    self.on_result(None, True, message.get('message') or '识别失败')
+                    return
+                data = message.get('data') or {}
+                words = ''.join(ws['cw'][0]['w'] for ws in (data.get('result') or {}).get('ws', []) if ws.get('cw'))
+                self.pieces.append(words)
+                final = data.get('status') == 2
+                self.on_result(''.join(self.pieces), final)
+                if final:
+                    return
+        except Exception as e:
+            self.on_result(None, True, f'识别连接中断: {e}')
+
+    def close(self):
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+
+
+class RelaySession:
+    """一次语音输入：客户端分片上传音频，后台线程转发给识别器，识别结果供 SSE 读取
+
+    音频队列有上限，识别器跟不上时上传请求会等待，超时则让客户端稍后重试（背压）；
+    中间结果只保留最新的一份，读取慢的客户端会直接拿到合并后的文本。
+    """
+
+    def __init__(self, session_id, owner_id, recognizer, queue_size, idle_timeout, on_close):
+        self.id = session_id
+        self.owner_id = str(owner_id)
+        self.recognizer = recognizer
+        self.idle_timeout = idle_timeout
+        self.on_close = on_close
+        self.audio = queue.Queue(maxsize=queue_size)
+        self.text = ''
+        self.final = False
+        self.error = None
+        self.version = 0
+        self.received_last = False
+        self._changed = threading.Condition()
+        self.worker = threading.Thread(target=self._run, name=f'voice-{session_id[:8]}', daemon=True)
+        self.worker.start()
+
+    def put_audio(self, chunk, last=False, timeout=2.0):
+        """放入一个音频分片，队列已满且超时未腾出空间时返回 False"""
+        if self.final or self.received_last:
+            return False
+        try:
+            self.audio.put((chunk, last), timeout=timeout)
+        except queue.Full:
+            return False
+        if last:
+            self.received_last = True
+        return True
+
+    def _publish(self, text, final, error=None):
+        with self._changed:
+            if text is not None:
+                self.text = text
+            if error:
+                self.error = error
+            self.final = self.final or final
+            self.version += 1
+            self._changed.notify_all()
+
+    def _run(self):
+        stream = None
+        try:
+            stream = self.recognizer.open(self._publish)
+            while not self.final:
+                try:
+                    chunk, last = self.audio.get(timeout=self.idle_timeout)
+                except queue.Empty:
+                    self._publish(None, True, '等待音频超时')
+                    break
+                stream.send(chunk, last)
+                if last:
+                    break
+        except Exception as e:
+            print(f"语音中转错误: {e}")
+            self._publish(None, True, str(e))
+        finally:
+            if stream:
+                stream.close()
+            if not self.final:
+                self._publish(None, True)
+            self.on_close(self)
+
+    def wait_for_update(self, version, timeout):
+        """等待结果版本号超过 version，返回 (version, text, final, error)"""
+        with self._changed:
+            if self.version <= version and not self.final:
+                self._changed.wait(timeout)
+            return self.version, self.text, self.final, self.error
+
+
+class VoiceRelay:
+    """服务端语音中转：限制同时进行的会话数，每个会话一个转发线程"""
+
+    def __init__(self, recognizer, max_sessions=20, queue_size=32, idle_timeout=30, retain=60):
+        self.recognizer = recognizer
+        self.max_sessions = max_sessions
+        self.queue_size = queue_size
+        self.idle_timeout = idle_timeout
+        self.retain = retain
+        self._sessions = {}
+        self._finished = {}
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def create(self, owner_id):
+        """新建会话，已达上限时返回 None"""
+        with self._lock:
+            self._cleanup()
+            if len(self._sessions) >= self.max_sessions:
+                self.rejected += 1
+                return None
+            session_id = uuid.uuid4().hex
+            # 先占位，避免并发创建时超过上限
+            self._sessions[session_id] = None
+        session = RelaySession(session_id, owner_id, self.recognizer, self.queue_size,
+                               self.idle_timeout, self._release)
+        with self._lock:
+            if session_id in self._sessions:
+                self._sessions[session_id] = session
+        return session
+
+    def _release(self, session):
+        """会话结束后释放名额，结果再保留一段时间供客户端读取"""
+        with self._lock:
+            self._sessions.pop(session.id, None)
+            self._finished[session.id] = (session, time.monotonic())
+
+    def _cleanup(self):
+        now = time.monotonic()
+        for session_id, (_, finished_at) in list(self._finished.items()):
+            if now - finished_at > self.retain:
+                del self._finished[session_id]
+
+    def get(self, session_id, owner_id):
+        with self._lock:
+            session = self._sessions.get(session_id) or self._finished.get(session_id, (None,))[0]
+        if session and session.owner_id == str(owner_id):
+            return session
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': sum(1 for s in self._sessions.values() if s),
+                'finished': len(self._finished),
+                'max_sessions': self.max_sessions,
+                'rejected': self.rejected
+            }
@@ -0,0 +1,10 @@
+"""生产环境 WSGI 入口
+
+    gunicorn -c gunicorn.conf.py
+
+也可以交给其他 WSGI 服务器加载 wsgi:app。使用本地数据库时，部署前需要执行一次
+flask --app app init-db（gunicorn.conf.py 会在主进程中自动执行）。
+"""
+from app import create_app
+
+app = create_app()